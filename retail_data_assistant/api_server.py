@@ -0,0 +1,488 @@
+"""
+Headless HTTP API of the assistant, for dashboards and scripts that can't
+use the Streamlit page.
+
+Endpoints:
+    POST /ask           {"question": "...", "previous_result_id": "..."}  -> SQL and results
+    POST /generate-sql  {"question": "..."}  -> SQL only
+    POST /execute-sql   {"sql": "..."}       -> results of a validated SELECT
+    POST /rebuild                            -> build a new database snapshot in the background
+    GET  /health        readiness, worker pool, request coalescing, admission and snapshot state
+    GET  /metrics       Prometheus metrics
+
+Answers of /ask carry a "result_id". Sent back as "previous_result_id" with
+the next question, it lets a refinement ("а теперь только Москва") be
+answered from that result instead of a new query.
+
+LLM calls of /ask and /generate-sql queue for a shared rate limit; scripts
+and batch jobs should send "X-Priority: batch" so interactive users go first.
+
+Results are JSON by default, or an Arrow IPC stream with ?format=arrow or
+"Accept: application/vnd.apache.arrow.stream" (the plan is stored in the
+schema metadata under "plan").
+
+Usage:
+    python api_server.py [--host 127.0.0.1] [--port 8000]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from data_manager.db_bootstrap import DatabaseBootstrap
+from data_manager.followup import ResultContext
+from data_manager.sql_validator import SQLValidationError
+from data_manager.resource_governor import ResourceGovernor, QueryRejected
+from utils.metrics import QueryMetrics
+from utils.hedging import HedgePolicy
+from utils.rate_limiter import LLMRateLimiter, LLMQueueTimeout, PRIORITIES, INTERACTIVE, priority
+from utils.config import (
+    DB_PATH, API_QUERY_LOG_DB_PATH, METRICS_WINDOW, SQL_MAX_ESTIMATED_COST, SQL_MAX_REPAIR_ATTEMPTS,
+    TEMPLATES_ENABLED, SEMANTIC_LAYER_ENABLED, VALUE_CATALOG_ENABLED, EXAMPLE_WARMUP_ENABLED,
+    SINGLE_FLIGHT_ENABLED, SANDBOX_WORKERS, SANDBOX_MEMORY_LIMIT, SANDBOX_THREADS, API_HOST, API_PORT, API_WORKERS, API_MAX_PENDING, API_REQUEST_TIMEOUT,
+    GOVERNOR_ENABLED, GOVERNOR_CLASSES, GOVERNOR_ADMISSION_WAIT, DB_THREADS, DB_MEMORY_LIMIT, DB_TEMP_DIRECTORY,
+    DB_MAX_TEMP_DIRECTORY_SIZE, SNAPSHOT_POLL_INTERVAL, SNAPSHOT_DRAIN_TIMEOUT, SNAPSHOT_MAX_SHRINK, SNAPSHOTS_KEPT,
+    OPENAI_BASE_URL, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_QUEUE_MAX_WAIT, LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_MAX_CONNECTIONS,
+    LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_INITIAL_DELAY, LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_WINDOW, LLM_BACKEND, LLM_REPLAY_LATENCY, LLM_REPLAY_SEED, DECOMPOSITION_ENABLED,
+    DECOMPOSITION_MAX_SUBQUERIES, DECOMPOSITION_MAX_INTERMEDIATE_ROWS, FOLLOWUP_ENABLED, FOLLOWUP_CONTEXTS_KEPT,
+    PREVIEW_SAMPLE_PERCENT, PREVIEW_SAMPLE_MIN_ROWS, SKETCHES_ENABLED, SKETCH_PRECISION
+)
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class ServiceBusy(Exception):
+    """Raised when the worker pool queue is full."""
+
+
+class WorkerPool:
+    def __init__(self, workers=4, max_pending=32):
+        """
+        Bounded thread pool for blocking work (DuckDB queries, LLM calls).
+
+        Requests beyond workers + max_pending are rejected instead of queued,
+        so a burst degrades into fast 503 responses rather than growing
+        latency for everyone. A task counts against the limit until its
+        thread finishes, even if the request already timed out.
+
+        Args:
+            workers (int): Number of worker threads
+            max_pending (int): Tasks allowed to wait for a free worker
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """
+        Run a blocking function on the pool.
+
+        Args:
+            func (callable): The function to run
+            timeout (float, optional): Seconds to wait for the result
+
+        Returns:
+            The function's result
+
+        Raises:
+            ServiceBusy: If the queue is full
+            asyncio.TimeoutError: If the result is not ready in time
+        """
+        if self.in_flight >= self.workers + self.max_pending:
+            self.rejected += 1
+            raise ServiceBusy()
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        future = loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        future.add_done_callback(self._done)
+        try:
+            # shield: a timeout abandons the result, the thread runs to completion
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+
+    def _done(self, future):
+        self.in_flight -= 1
+        self.completed += 1
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+        }
+
+
+class AssistantService:
+    def __init__(self, workers=API_WORKERS, max_pending=API_MAX_PENDING, timeout=API_REQUEST_TIMEOUT):
+        """
+        The assistant's components, created once the database is ready.
+
+        Args:
+            workers (int): Worker threads for blocking work
+            max_pending (int): Requests allowed to wait for a worker
+            timeout (float): Request timeout in seconds
+        """
+        self.pool = WorkerPool(workers, max_pending)
+        self.timeout = timeout
+        self.bootstrap = DatabaseBootstrap(DB_PATH, max_shrink=SNAPSHOT_MAX_SHRINK, snapshots_kept=SNAPSHOTS_KEPT)
+        self.query_executor = None
+        self.pipeline = None
+        self.query_log = None
+        self.error = None
+        # Recent results by result_id, for follow-up questions
+        self.contexts = OrderedDict()
+        self._contexts_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.pipeline is not None
+
+    def start(self):
+        """Create the database and components; runs on a worker thread."""
+        try:
+            self._start()
+        except Exception as e:
+            logger.error(f"API service failed to start: {e}")
+            self.error = e
+
+    def _start(self):
+        # Imported here so the server starts listening before the heavy imports
+        from data_manager.query_executor import QueryExecutor
+        from data_manager.query_log import QueryLog
+        from data_manager.semantic_layer import SemanticLayer
+        from data_manager.example_warmer import ExampleWarmer
+        from llm_processor import LLMProcessor
+        from llm_backends import ReplayBackend
+        from intent_matcher import IntentMatcher
+        from pipeline import QuestionPipeline
+
+        self.bootstrap.ensure()
+        governor = None
+        if GOVERNOR_ENABLED:
+            governor = ResourceGovernor(
+                GOVERNOR_CLASSES, admission_wait=GOVERNOR_ADMISSION_WAIT, threads=DB_THREADS,
+                memory_limit=DB_MEMORY_LIMIT, temp_directory=DB_TEMP_DIRECTORY,
+                max_temp_directory_size=DB_MAX_TEMP_DIRECTORY_SIZE
+            )
+        self.query_executor = QueryExecutor(
+            DB_PATH, max_estimated_cost=SQL_MAX_ESTIMATED_COST, coalesce=SINGLE_FLIGHT_ENABLED,
+            sandbox_workers=SANDBOX_WORKERS, sandbox_memory_limit=SANDBOX_MEMORY_LIMIT, sandbox_threads=SANDBOX_THREADS,
+            governor=governor, drain_timeout=SNAPSHOT_DRAIN_TIMEOUT, sample_percent=PREVIEW_SAMPLE_PERCENT,
+            sample_min_rows=PREVIEW_SAMPLE_MIN_ROWS, sketch_precision=SKETCH_PRECISION
+        )
+        self.query_executor.watch_snapshots(SNAPSHOT_POLL_INTERVAL)
+        self.query_log = QueryLog(API_QUERY_LOG_DB_PATH, window=METRICS_WINDOW)
+        value_catalog = self.query_executor.value_catalog if VALUE_CATALOG_ENABLED else None
+        semantic_layer = None
+        if SEMANTIC_LAYER_ENABLED:
+            semantic_layer = SemanticLayer(
+                max_rows=self.query_executor.max_rows,
+                sketches=self.query_executor.distinct_sketches if SKETCHES_ENABLED else None,
+            )
+        intent_matcher = None
+        if TEMPLATES_ENABLED:
+            intent_matcher = IntentMatcher(
+                self.query_executor.reader, semantic_layer or SemanticLayer(), value_catalog=value_catalog
+            )
+            self.query_executor.on_switch(intent_matcher.refresh_catalog)
+        example_warmer = None
+        if EXAMPLE_WARMUP_ENABLED:
+            example_warmer = ExampleWarmer(self.query_executor)
+            example_warmer.start()
+        llm_processor = LLMProcessor(
+            value_catalog=value_catalog, coalesce=SINGLE_FLIGHT_ENABLED,
+            rate_limiter=LLMRateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, max_wait=LLM_QUEUE_MAX_WAIT),
+            max_retries=LLM_MAX_RETRIES, retry_base_delay=LLM_RETRY_BASE_DELAY,
+            retry_max_delay=LLM_RETRY_MAX_DELAY, base_url=OPENAI_BASE_URL,
+            hedge_policy=HedgePolicy(
+                LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_INITIAL_DELAY, LLM_HEDGE_MIN_SAMPLES,
+                LLM_HEDGE_WINDOW
+            ) if LLM_HEDGE_ENABLED else None,
+            connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT, max_connections=LLM_MAX_CONNECTIONS,
+            backend=ReplayBackend(latency=LLM_REPLAY_LATENCY, seed=LLM_REPLAY_SEED) if LLM_BACKEND == 'replay' else None,
+            term_macros=self.query_executor.term_macros
+        )
+        self.pipeline = QuestionPipeline(
+            self.query_executor, llm_processor,
+            intent_matcher=intent_matcher, semantic_layer=semantic_layer,
+            example_warmer=example_warmer, max_repairs=SQL_MAX_REPAIR_ATTEMPTS, decompose=DECOMPOSITION_ENABLED,
+            max_subqueries=DECOMPOSITION_MAX_SUBQUERIES, max_intermediate_rows=DECOMPOSITION_MAX_INTERMEDIATE_ROWS,
+            followups=FOLLOWUP_ENABLED
+        )
+        logger.info("API service ready")
+
+    def context(self, result_id):
+        """The result of an earlier /ask as context for a follow-up, or None if it is no longer kept."""
+        with self._contexts_lock:
+            return self.contexts.get(result_id)
+
+    def _keep_context(self, result_id, plan, results):
+        """Keep a result for follow-ups, the FOLLOWUP_CONTEXTS_KEPT most recent ones."""
+        context = ResultContext(
+            plan.question, plan.display_sql, results, complete=len(results) < self.query_executor.max_rows
+        )
+        with self._contexts_lock:
+            self.contexts[result_id] = context
+            while len(self.contexts) > FOLLOWUP_CONTEXTS_KEPT:
+                self.contexts.popitem(last=False)
+
+    def ask(self, question, level=INTERACTIVE, context=None):
+        metrics = QueryMetrics(question)
+        try:
+            with priority(level):
+                plan, results = self.pipeline.answer(question, metrics=metrics, context=context)
+            if not FOLLOWUP_ENABLED or len(results) == 0:
+                return plan.to_dict(), results, metrics
+            # The query log id identifies the result for follow-ups
+            self._keep_context(metrics.query_id, plan, results)
+            return {**plan.to_dict(), 'result_id': metrics.query_id}, results, metrics
+        except Exception as e:
+            metrics.fail(e)
+            raise
+        finally:
+            self.query_log.record(metrics)
+
+    def generate_sql(self, question, level=INTERACTIVE):
+        metrics = QueryMetrics(question)
+        with priority(level):
+            plan = self.pipeline.plan(question, metrics=metrics)
+        return plan.to_dict(), metrics
+
+    def execute_sql(self, sql):
+        metrics = QueryMetrics()
+        metrics.source = 'api'
+        try:
+            with metrics.stage('validate'):
+                analysis = self.query_executor.rewriter.analyze(sql)
+                metrics.sql = analysis.sql
+                metrics.findings = analysis.findings
+                self.query_executor.validator.validate(analysis.sql)
+            results = self.query_executor.execute_query(analysis.sql, metrics=metrics)
+            plan = {'sql': analysis.sql, 'source': 'api', 'findings': analysis.findings}
+            return plan, results, metrics
+        except Exception as e:
+            metrics.fail(e)
+            raise
+        finally:
+            self.query_log.record(metrics)
+
+
+service = AssistantService()
+
+
+def _wants_arrow(request):
+    return request.query_params.get('format') == 'arrow' or ARROW_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def _timings(metrics):
+    return {stage: round(seconds * 1000, 2) for stage, seconds in metrics.stages.items()}
+
+
+def _result_response(request, plan, results, metrics):
+    """Serialize a plan and its results as JSON or an Arrow IPC stream."""
+    if _wants_arrow(request):
+        import pyarrow as pa
+        table = pa.Table.from_pandas(results, preserve_index=False)
+        table = table.replace_schema_metadata({'plan': json.dumps(plan, ensure_ascii=False, default=str)})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE)
+
+    data = json.loads(results.to_json(orient='split', date_format='iso', index=False))
+    return JSONResponse({
+        **plan,
+        'columns': data['columns'],
+        'rows': data['data'],
+        'row_count': len(results),
+        'timings_ms': _timings(metrics),
+    })
+
+
+async def _read_field(request, field):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    value = body.get(field) if isinstance(body, dict) else None
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+
+def _error(status, message, **headers):
+    return JSONResponse({'error': message}, status_code=status, headers=headers or None)
+
+
+def endpoint(field):
+    """Wrap a handler: check readiness, read the request field, map errors to statuses."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapped(request):
+            if not service.ready:
+                return _error(503, "Сервис прогревается, повторите запрос позже", **{'Retry-After': '5'})
+            value = await _read_field(request, field)
+            if value is None:
+                return _error(400, f"Поле '{field}' обязательно")
+            try:
+                return await handler(request, value)
+            except ServiceBusy:
+                return _error(503, "Сервис перегружен, повторите запрос позже", **{'Retry-After': '1'})
+            except QueryRejected as e:
+                return _error(503, str(e), **{'Retry-After': str(GOVERNOR_ADMISSION_WAIT)})
+            except LLMQueueTimeout as e:
+                wait = service.pipeline.llm_processor.rate_limiter.estimate_wait()
+                return _error(503, str(e), **{'Retry-After': str(max(1, round(wait)))})
+            except asyncio.TimeoutError:
+                return _error(504, f"Запрос не выполнен за {service.timeout} секунд")
+            except SQLValidationError as e:
+                return _error(422, str(e))
+            except Exception as e:
+                logger.error(f"Error handling {request.url.path}: {e}")
+                return _error(500, str(e))
+        return wrapped
+    return decorator
+
+
+def _priority(request):
+    """LLM priority from the X-Priority header: 'interactive' (default) or 'batch'."""
+    return PRIORITIES.get(request.headers.get('x-priority', 'interactive').lower(), INTERACTIVE)
+
+
+@endpoint('question')
+async def ask(request, question):
+    previous = await _read_field(request, 'previous_result_id')
+    context = None
+    if previous is not None:
+        context = service.context(previous)
+        if context is None:
+            return _error(404, "Результат предыдущего запроса не найден, задайте вопрос полностью")
+    plan, results, metrics = await service.pool.run(
+        service.ask, question, _priority(request), context, timeout=service.timeout
+    )
+    return _result_response(request, plan, results, metrics)
+
+
+@endpoint('question')
+async def generate_sql(request, question):
+    plan, metrics = await service.pool.run(
+        service.generate_sql, question, _priority(request), timeout=service.timeout
+    )
+    return JSONResponse({**plan, 'timings_ms': _timings(metrics)})
+
+
+@endpoint('sql')
+async def execute_sql(request, sql):
+    plan, results, metrics = await service.pool.run(service.execute_sql, sql, timeout=service.timeout)
+    return _result_response(request, plan, results, metrics)
+
+
+async def rebuild(request):
+    if not service.ready:
+        return _error(503, "Сервис прогревается, повторите запрос позже", **{'Retry-After': '5'})
+    # Readers switch to the new snapshot once it is validated and published
+    started = service.bootstrap.start_rebuild()
+    return JSONResponse(
+        {'started': started, 'snapshot': os.path.basename(service.query_executor.db_path)},
+        status_code=202 if started else 409
+    )
+
+
+async def health(request):
+    body = {'ready': service.ready, 'pool': service.pool.stats()}
+    if service.ready:
+        backend = service.pipeline.llm_processor.backend
+        body['llm_backend'] = backend.name if backend is not None else None
+        body['llm_rate_limit'] = {
+            **service.pipeline.llm_processor.rate_limiter.stats(),
+            'estimated_wait_seconds': round(service.pipeline.llm_processor.rate_limiter.estimate_wait(), 1),
+        }
+        if service.pipeline.llm_processor.hedge_policy is not None:
+            body['llm_hedging'] = service.pipeline.llm_processor.hedge_policy.stats()
+        body['coalescing'] = {
+            'llm': service.pipeline.llm_processor.in_flight.stats(),
+            'sql': service.query_executor.in_flight.stats(),
+        }
+        if service.query_executor.sandbox is not None:
+            body['sandbox'] = service.query_executor.sandbox.stats()
+        if service.query_executor.governor is not None:
+            body['governor'] = service.query_executor.governor.stats()
+        body['snapshot'] = {
+            'file': os.path.basename(service.query_executor.db_path),
+            'rebuilding': service.bootstrap.rebuilding,
+            'rebuild_error': str(service.bootstrap.rebuild_error) if service.bootstrap.rebuild_error else None,
+        }
+    if service.error is not None:
+        body['error'] = str(service.error)
+    return JSONResponse(body, status_code=200 if service.ready else 503)
+
+
+async def prometheus_metrics(request):
+    lines = service.query_log.to_prometheus().rstrip("\n").split("\n") if service.ready else []
+    for name, value in service.pool.stats().items():
+        if name in ('completed', 'rejected', 'timed_out'):
+            lines.append(f"# TYPE retail_assistant_api_{name}_total counter")
+            lines.append(f"retail_assistant_api_{name}_total {value}")
+        else:
+            lines.append(f"# TYPE retail_assistant_api_{name} gauge")
+            lines.append(f"retail_assistant_api_{name} {value}")
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Start listening at once; requests get 503 until the components are ready
+    asyncio.get_running_loop().run_in_executor(service.pool.executor, service.start)
+    yield
+    service.pool.executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = Starlette(
+    routes=[
+        Route('/ask', ask, methods=['POST']),
+        Route('/generate-sql', generate_sql, methods=['POST']),
+        Route('/execute-sql', execute_sql, methods=['POST']),
+        Route('/rebuild', rebuild, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Route('/metrics', prometheus_metrics, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
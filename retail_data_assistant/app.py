@@ -1,8 +1,36 @@
 import streamlit as st
-import pandas as pd
+from data_manager.db_bootstrap import DatabaseBootstrap
 from data_manager.query_executor import QueryExecutor
+from data_manager.resource_governor import ResourceGovernor
 from llm_processor import LLMProcessor
-from data_manager.formatter import format_results
+from llm_backends import ReplayBackend
+from intent_matcher import IntentMatcher
+from data_manager.query_log import QueryLog
+from data_manager.query_profiler import QueryProfiler
+from data_manager.semantic_layer import SemanticLayer
+from data_manager.example_warmer import ExampleWarmer, question_key
+from data_manager.followup import ResultContext, looks_followup
+from pipeline import QuestionPipeline
+from utils.metrics import QueryMetrics, start_metrics_server
+from utils.hedging import HedgePolicy
+from utils.rate_limiter import LLMRateLimiter
+from utils.config import (
+    DB_PATH, QUERY_LOG_DB_PATH, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_WINDOW,
+    DB_PROFILING_ENABLED, SQL_MAX_ESTIMATED_COST, SQL_MAX_REPAIR_ATTEMPTS, TEMPLATES_ENABLED,
+    SEMANTIC_LAYER_ENABLED, VALUE_CATALOG_ENABLED, EXAMPLE_WARMUP_ENABLED, SESSION_MAX_ANSWERS,
+    SINGLE_FLIGHT_ENABLED, SANDBOX_WORKERS, SANDBOX_MEMORY_LIMIT, SANDBOX_THREADS, GOVERNOR_ENABLED,
+    GOVERNOR_CLASSES, GOVERNOR_ADMISSION_WAIT, DB_THREADS, DB_MEMORY_LIMIT, DB_TEMP_DIRECTORY,
+    DB_MAX_TEMP_DIRECTORY_SIZE, SNAPSHOT_POLL_INTERVAL, SNAPSHOT_DRAIN_TIMEOUT, OPENAI_BASE_URL,
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_QUEUE_MAX_WAIT, LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_MAX_CONNECTIONS,
+    LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_INITIAL_DELAY, LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_WINDOW, LLM_BACKEND, LLM_REPLAY_LATENCY, LLM_REPLAY_SEED, DECOMPOSITION_ENABLED,
+    DECOMPOSITION_MAX_SUBQUERIES, DECOMPOSITION_MAX_INTERMEDIATE_ROWS, FOLLOWUP_ENABLED, PREVIEW_ENABLED,
+    PREVIEW_MIN_ESTIMATED_COST, PREVIEW_SAMPLE_PERCENT, PREVIEW_SAMPLE_MIN_ROWS, SKETCHES_ENABLED, SKETCH_PRECISION,
+    CHARTS_ENABLED, CHART_MAX_POINTS, CHART_MAX_SERIES, CHART_DOWNSAMPLING, CHART_FULL_SERIES
+)
+from contextlib import nullcontext
+from datetime import datetime
 import os
 import sys
 
@@ -25,17 +53,97 @@ st.markdown("""
 """)
 
 # Initialize components
+@st.cache_resource
+def get_database_bootstrap():
+    # The database is created in the background, so the page renders at once
+    return DatabaseBootstrap(DB_PATH).start()
+
 @st.cache_resource
 def get_query_executor():
-    return QueryExecutor()
+    profiler = QueryProfiler(QUERY_LOG_DB_PATH) if DB_PROFILING_ENABLED else None
+    governor = None
+    if GOVERNOR_ENABLED:
+        governor = ResourceGovernor(
+            GOVERNOR_CLASSES, admission_wait=GOVERNOR_ADMISSION_WAIT, threads=DB_THREADS,
+            memory_limit=DB_MEMORY_LIMIT, temp_directory=DB_TEMP_DIRECTORY,
+            max_temp_directory_size=DB_MAX_TEMP_DIRECTORY_SIZE
+        )
+    query_executor = QueryExecutor(
+        DB_PATH, profiler=profiler, max_estimated_cost=SQL_MAX_ESTIMATED_COST, coalesce=SINGLE_FLIGHT_ENABLED,
+        sandbox_workers=SANDBOX_WORKERS, sandbox_memory_limit=SANDBOX_MEMORY_LIMIT, sandbox_threads=SANDBOX_THREADS,
+        governor=governor, drain_timeout=SNAPSHOT_DRAIN_TIMEOUT, sample_percent=PREVIEW_SAMPLE_PERCENT,
+        sample_min_rows=PREVIEW_SAMPLE_MIN_ROWS, sketch_precision=SKETCH_PRECISION
+    )
+    # Rebuilds publish a new snapshot; readers switch to it without a restart
+    query_executor.watch_snapshots(SNAPSHOT_POLL_INTERVAL)
+    return query_executor
 
 @st.cache_resource
 def get_llm_processor():
-    return LLMProcessor()
+    value_catalog = get_query_executor().value_catalog if VALUE_CATALOG_ENABLED else None
+    # One budget for all sessions of the process
+    rate_limiter = LLMRateLimiter(
+        LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, max_wait=LLM_QUEUE_MAX_WAIT
+    )
+    hedge_policy = HedgePolicy(
+        LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_INITIAL_DELAY, LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_WINDOW
+    ) if LLM_HEDGE_ENABLED else None
+    return LLMProcessor(
+        value_catalog=value_catalog, coalesce=SINGLE_FLIGHT_ENABLED, rate_limiter=rate_limiter,
+        max_retries=LLM_MAX_RETRIES, retry_base_delay=LLM_RETRY_BASE_DELAY,
+        retry_max_delay=LLM_RETRY_MAX_DELAY, base_url=OPENAI_BASE_URL, hedge_policy=hedge_policy,
+        connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT, max_connections=LLM_MAX_CONNECTIONS,
+        backend=ReplayBackend(latency=LLM_REPLAY_LATENCY, seed=LLM_REPLAY_SEED) if LLM_BACKEND == 'replay' else None,
+        term_macros=get_query_executor().term_macros
+    )
+
+@st.cache_resource
+def get_semantic_layer():
+    query_executor = get_query_executor()
+    return SemanticLayer(
+        max_rows=query_executor.max_rows,
+        sketches=query_executor.distinct_sketches if SKETCHES_ENABLED else None,
+    )
+
+@st.cache_resource
+def get_intent_matcher():
+    value_catalog = get_query_executor().value_catalog if VALUE_CATALOG_ENABLED else None
+    intent_matcher = IntentMatcher(get_query_executor().reader, get_semantic_layer(), value_catalog=value_catalog)
+    get_query_executor().on_switch(intent_matcher.refresh_catalog)
+    return intent_matcher
+
+@st.cache_resource
+def get_example_warmer():
+    example_warmer = ExampleWarmer(get_query_executor())
+    example_warmer.start()
+    return example_warmer
+
+@st.cache_resource
+def get_query_log():
+    query_log = QueryLog(QUERY_LOG_DB_PATH, window=METRICS_WINDOW)
+    if METRICS_ENABLED:
+        start_metrics_server(query_log.to_prometheus, METRICS_HOST, METRICS_PORT)
+    return query_log
 
-# Get instances
-query_executor = get_query_executor()
-llm_processor = get_llm_processor()
+# Get instances; components that need the database wait until it is ready
+database = get_database_bootstrap()
+query_log = get_query_log()
+if database.ready:
+    query_executor = get_query_executor()
+    llm_processor = get_llm_processor()
+    intent_matcher = get_intent_matcher() if TEMPLATES_ENABLED else None
+    semantic_layer = get_semantic_layer() if SEMANTIC_LAYER_ENABLED else None
+    example_warmer = get_example_warmer() if EXAMPLE_WARMUP_ENABLED else None
+    pipeline = QuestionPipeline(
+        query_executor, llm_processor, intent_matcher=intent_matcher, semantic_layer=semantic_layer,
+        example_warmer=example_warmer, max_repairs=SQL_MAX_REPAIR_ATTEMPTS, decompose=DECOMPOSITION_ENABLED,
+        max_subqueries=DECOMPOSITION_MAX_SUBQUERIES, max_intermediate_rows=DECOMPOSITION_MAX_INTERMEDIATE_ROWS,
+        followups=FOLLOWUP_ENABLED, preview_min_cost=PREVIEW_MIN_ESTIMATED_COST if PREVIEW_ENABLED else None
+    )
+elif database.error is not None:
+    st.error(f"Не удалось подготовить базу данных: {database.error}")
+else:
+    st.info("⏳ Приложение прогревается: идет подготовка базы данных. Запросы станут доступны через несколько секунд.")
 
 # Make sure the session state for query input exists
 if 'query_input' not in st.session_state:
@@ -44,61 +152,408 @@ if 'query_input' not in st.session_state:
 # Add temporary storage for example queries
 if 'example_query' not in st.session_state:
     st.session_state.example_query = ""
+
+# Answers of this session by question, so reruns caused by other widgets
+# never repeat the LLM call or the query
+if 'answers' not in st.session_state:
+    st.session_state.answers = {}
+    st.session_state.current_question = None
     
 # If we have a pending example, put it in the query_input field
 if st.session_state.example_query:
     st.session_state.query_input = st.session_state.example_query
     st.session_state.example_query = ""  # Clear after use
 
+
+# SQL headings by where the SQL came from
+SQL_TITLES = {
+    'example': "SQL запрос примера:",
+    'template': "SQL запрос по шаблону:",
+    'spec': "SQL запрос по спецификации:",
+    'decomposed': "SQL запрос из параллельных подзапросов:",
+    'followup': "SQL запрос к результату предыдущего вопроса:",
+    'llm': "Сгенерированный SQL запрос:",
+}
+
+
+def followup_context(question):
+    """
+    The current answer as context for a question that may refine it.
+    
+    Args:
+        question (str): The question in natural language
+        
+    Returns:
+        tuple: (session key of the current answer, data_manager.followup.ResultContext),
+            or (None, None) if the question is answered on its own
+    """
+    key = st.session_state.current_question
+    previous = st.session_state.answers.get(key)
+    if (not FOLLOWUP_ENABLED or not looks_followup(question) or previous is None
+            or previous['results'] is None or previous['results'].num_rows == 0):
+        return None, None
+    context = ResultContext(
+        previous['question'], previous['sql'], previous['results'],
+        # Estimates from a sample can't answer refinements on their own
+        complete=previous['results'].num_rows < query_executor.max_rows and previous['preview'] is None,
+    )
+    return key, context
+
+
+def session_key(question, context_key=None):
+    """Key of an answer in the session; a follow-up is keyed by the answer it refines as well."""
+    if context_key is None:
+        return question_key(question)
+    return f"{context_key} → {question_key(question)}"
+
+
+def answer_question(question, context_key=None, context=None):
+    """
+    Run a question through the pipeline and keep the answer in session state.
+    
+    Args:
+        question (str): The question in natural language
+        context_key (str, optional): Session key of the answer the question refines
+        context (data_manager.followup.ResultContext, optional): That answer
+        
+    Returns:
+        dict: The answer: SQL and how it was obtained, the result as an Arrow
+            table, its formatted view and CSV, or the error
+    """
+    metrics = QueryMetrics(question)
+    answer = {
+        'key': session_key(question, context_key),
+        'question': question,
+        'context_key': context_key,
+        'context': context,
+        'answered_at': datetime.now(),
+        'sql_title': None,
+        'sql': None,
+        'caption': None,
+        'spec': None,
+        'findings': [],
+        'results': None,
+        'formatted': None,
+        'csv': None,
+        # Time series chart of the results: figure and caption
+        'chart': None,
+        # Query the chart may read the whole series from when the results were cut
+        'chart_sql': None,
+        'error': None,
+        # Sample fraction, exact results future and error while the results are a preview
+        'preview': None,
+        # Logged once the answer is rendered, so the render stage is included
+        'pending_metrics': metrics,
+    }
+    try:
+        plan = pipeline.plan(question, metrics=metrics, context=context)
+        answer['sql_title'] = SQL_TITLES[plan.source]
+        answer['sql'] = plan.display_sql
+        answer['chart_sql'] = plan.chart_sql
+        answer['spec'] = plan.spec
+        answer['findings'] = plan.findings
+        if plan.source == 'template':
+            answer['caption'] = f"Вопрос распознан без обращения к LLM: {plan.description}"
+        elif plan.description:
+            answer['caption'] = plan.description
+        
+        # Slow aggregate queries are shown from a sample of sales first; the
+        # exact results replace the preview once their query finishes
+        exact_metrics = QueryMetrics(question)
+        exact_metrics.source, exact_metrics.sql = metrics.source, metrics.sql
+        preview = pipeline.preview(plan, metrics=metrics, exact_metrics=exact_metrics)
+        if preview is not None:
+            metrics.source = 'preview'
+            answer['preview'] = {'fraction': preview.fraction, 'exact': preview.exact, 'error': None}
+            preview.exact.add_done_callback(lambda future: record_exact(future, exact_metrics))
+            results = preview.results
+        else:
+            results = pipeline.execute(plan, metrics=metrics)
+        # A preview is charted from its own rows; the exact results may read the whole series
+        store_results(answer, results, metrics, chart_sql=None if preview is not None else answer['chart_sql'])
+    except Exception as e:
+        metrics.fail(e)
+        answer['error'] = str(e)
+    
+    remember_answer(answer)
+    return answer
+
+
+def store_results(answer, results, metrics=None, chart_sql=None):
+    """
+    Keep results in an answer as an Arrow table, with their formatted view,
+    CSV and chart.
+    
+    Args:
+        answer (dict): The answer from answer_question
+        results (pandas.DataFrame): The results
+        metrics (utils.metrics.QueryMetrics, optional): Timed as the format and chart stages
+        chart_sql (str, optional): Query of the results, run again for the
+            whole series if the results were cut at the row limit
+    """
+    if results is not None:
+        import pyarrow as pa
+        answer['results'] = pa.Table.from_pandas(results, preserve_index=False)
+    
+    # Format the results once; reruns reuse the formatted view
+    if results is not None and len(results) > 0:
+        # pandas and numpy are only imported once there is something to format
+        from data_manager.formatter import format_results
+        if metrics is not None:
+            with metrics.stage('format'):
+                answer['formatted'] = format_results(results)
+        else:
+            answer['formatted'] = format_results(results)
+        answer['csv'] = answer['formatted'].to_csv(index=False)
+        with metrics.stage('chart') if metrics is not None else nullcontext():
+            answer['chart'] = build_chart(results, chart_sql)
+    else:
+        answer['formatted'] = answer['csv'] = answer['chart'] = None
+
+
+def build_chart(results, sql=None):
+    """
+    Chart results that are a time series, downsampled to CHART_MAX_POINTS
+    points per line and drawn with WebGL.
+    
+    Args:
+        results (pandas.DataFrame): The results
+        sql (str, optional): Their query; if the results were cut at the row
+            limit, the whole series is downsampled by DuckDB instead
+    
+    Returns:
+        dict: The figure and its caption, or None if the results are not a time series
+    """
+    if not CHARTS_ENABLED:
+        return None
+    from data_manager.charts import detect_time_series, chart_data, time_series_figure
+    
+    spec = detect_time_series(results)
+    if spec is None:
+        return None
+    data, method = None, CHART_DOWNSAMPLING
+    if sql is not None and CHART_FULL_SERIES and len(results) >= query_executor.max_rows:
+        try:
+            data = query_executor.execute_chart(
+                sql, spec, buckets=max(CHART_MAX_POINTS // 4, 1), max_series=CHART_MAX_SERIES
+            )
+            method = 'minmax'
+        except Exception:
+            # The rows at hand still make a chart
+            data = None
+    if data is None:
+        data = chart_data(
+            results, spec, max_points=CHART_MAX_POINTS, method=CHART_DOWNSAMPLING, max_series=CHART_MAX_SERIES
+        )
+    
+    notes = []
+    if data.total_points > data.shown_points:
+        how = "минимумы и максимумы по интервалам" if method == 'minmax' else "сохранена форма линий (LTTB)"
+        shown, total = (f"{count:,}".replace(',', ' ') for count in (data.shown_points, data.total_points))
+        notes.append(f"показано {shown} из {total} точек, {how}")
+    if data.total_series > data.shown_series:
+        notes.append(f"{data.shown_series} из {data.total_series} рядов с наибольшими значениями")
+    return {
+        'figure': time_series_figure(data.points, spec),
+        'caption': "График: " + "; ".join(notes) if notes else None,
+    }
+
+
+def record_exact(future, exact_metrics):
+    """Log the exact query behind a preview once it finishes, even if the page was left."""
+    if future.exception() is not None:
+        exact_metrics.fail(future.exception())
+    query_log.record(exact_metrics)
+
+
+def finish_preview(answer):
+    """Replace the preview of an answer with the exact results, or keep it with the error."""
+    preview = answer['preview']
+    try:
+        store_results(answer, preview['exact'].result(), chart_sql=answer['chart_sql'])
+        answer['preview'] = None
+    except Exception as e:
+        preview['error'] = str(e)
+    preview['exact'] = None
+
+
+def spinner_text():
+    """Progress message, with the expected wait when LLM calls are queued for the rate limit."""
+    wait = llm_processor.rate_limiter.estimate_wait()
+    if wait >= 1:
+        return f"Обрабатываю ваш запрос... (очередь к LLM: около {wait:.0f} с)"
+    return "Обрабатываю ваш запрос..."
+
+
+def remember_answer(answer):
+    """Store an answer as the current one, keeping the SESSION_MAX_ANSWERS most recent."""
+    answers = st.session_state.answers
+    key = answer['key']
+    answers.pop(key, None)
+    answers[key] = answer
+    while len(answers) > SESSION_MAX_ANSWERS:
+        answers.pop(next(iter(answers)))
+    st.session_state.current_question = key
+
+
+@st.fragment
+def results_area():
+    """Show the current answer; its widgets only rerun this fragment."""
+    answers = st.session_state.answers
+    key = st.session_state.current_question
+    if key not in answers:
+        return
+    
+    # Switching between earlier answers of the session
+    if len(answers) > 1:
+        keys = list(reversed(answers))
+        chosen = st.selectbox(
+            "Запросы этой сессии:",
+            keys,
+            index=keys.index(key),
+            # Follow-ups are marked under the answer they refine
+            format_func=lambda k: ('↳ ' if answers[k]['context_key'] else '') + answers[k]['question'],
+        )
+        if chosen != key:
+            st.session_state.current_question = key = chosen
+    
+    if st.button("🔄 Выполнить заново", key="answer_again"):
+        with st.spinner(spinner_text()):
+            answer_question(answers[key]['question'], answers[key]['context_key'], answers[key]['context'])
+        key = st.session_state.current_question
+        if answers[key]['preview'] is not None:
+            # The whole page reruns to start waiting for the exact results
+            st.rerun()
+    
+    answer = answers[key]
+    metrics = answer.pop('pending_metrics', None)
+    try:
+        render_answer(answer, metrics)
+    finally:
+        if metrics is not None:
+            query_log.record(metrics)
+
+
+def render_answer(answer, metrics=None):
+    """
+    Display a stored answer.
+    
+    Args:
+        answer (dict): The answer from answer_question
+        metrics (utils.metrics.QueryMetrics, optional): Timed as the render
+            stage when the answer is shown for the first time
+    """
+    st.subheader("Ваш запрос:")
+    st.info(answer['question'])
+    
+    if answer['sql'] is not None:
+        st.subheader(answer['sql_title'])
+        st.code(answer['sql'], language="sql")
+    if answer['caption']:
+        st.caption(answer['caption'])
+    if answer['preview'] is not None:
+        share = f"{answer['preview']['fraction'] * 100:g}%"
+        if answer['preview']['error'] is not None:
+            st.warning(
+                f"Точный запрос не выполнен: {answer['preview']['error']}. "
+                f"Показана оценка по выборке {share} продаж."
+            )
+        else:
+            st.info(
+                f"⏳ Предварительная оценка по выборке {share} продаж: суммы и количества пересчитаны на все "
+                f"продажи, в колонках «±» — 95% доверительный интервал. Точный результат вычисляется "
+                f"и заменит оценку."
+            )
+    if answer['spec'] is not None:
+        with st.expander("Спецификация запроса"):
+            st.json(answer['spec'])
+    if answer['findings']:
+        with st.expander(f"Анализ запроса ({len(answer['findings'])})"):
+            for finding in answer['findings']:
+                st.markdown(f"- {finding}")
+    
+    if answer['error'] is not None:
+        st.error(f"Произошла ошибка: {answer['error']}")
+    elif answer['formatted'] is not None:
+        if metrics is not None:
+            with metrics.stage('render'):
+                _render_results(answer)
+        else:
+            _render_results(answer)
+    else:
+        st.warning("Запрос выполнен успешно, но данные не найдены.")
+
+
+def _render_results(answer):
+    if answer['chart'] is not None:
+        st.subheader("График:")
+        st.plotly_chart(answer['chart']['figure'], use_container_width=True)
+        if answer['chart']['caption']:
+            st.caption(answer['chart']['caption'])
+    
+    st.subheader("Результаты:")
+    st.dataframe(answer['formatted'], use_container_width=True)
+    
+    # Download option
+    st.download_button(
+        label="Скачать результаты как CSV",
+        data=answer['csv'],
+        file_name="results.csv",
+        mime="text/csv",
+    )
+
+
 # User input
 user_query = st.text_area("Ваш запрос:", 
     placeholder="Например: Покажи топ-10 товаров по продажам за последний месяц", 
     height=100,
     key="query_input")
 
-# Process button
-if st.button("📊 Выполнить запрос"):
+# Process button; a question already answered in this session is shown
+# again from session state, "Выполнить заново" recomputes it
+if st.button("📊 Выполнить запрос", disabled=not database.ready):
     if user_query:
-        with st.spinner("Обрабатываю ваш запрос..."):
-            # Process with LLM
-            try:
-                st.subheader("Ваш запрос:")
-                st.info(user_query)
-                
-                # Generate SQL
-                sql_query = llm_processor.generate_sql(user_query)
-                
-                st.subheader("Сгенерированный SQL запрос:")
-                st.code(sql_query, language="sql")
-                
-                # Execute the query
-                results = query_executor.execute_query(sql_query)
-                
-                # Format and display results
-                if results is not None and len(results) > 0:
-                    formatted_results = format_results(results)
-                    
-                    st.subheader("Результаты:")
-                    st.dataframe(formatted_results, use_container_width=True)
-                    
-                    # Download option
-                    csv = formatted_results.to_csv(index=False)
-                    st.download_button(
-                        label="Скачать результаты как CSV",
-                        data=csv,
-                        file_name="results.csv",
-                        mime="text/csv",
-                    )
-                else:
-                    st.warning("Запрос выполнен успешно, но данные не найдены.")
-            except Exception as e:
-                st.error(f"Произошла ошибка: {str(e)}")
+        # A refinement ("а теперь только Москва") is answered in the context
+        # of the current answer, from its result when possible
+        context_key, context = followup_context(user_query)
+        key = session_key(user_query, context_key)
+        if key in st.session_state.answers:
+            remember_answer(st.session_state.answers[key])
+        else:
+            with st.spinner(spinner_text()):
+                answer_question(user_query, context_key, context)
     else:
         st.warning("Пожалуйста, введите запрос.")
 
-# Sidebar with examples
-with st.sidebar:
-    st.header("Примеры запросов")
+results_area()
+
+
+def pending_previews():
+    """Answers of the session whose exact results are still being computed."""
+    return [
+        answer for answer in st.session_state.answers.values()
+        if answer['preview'] is not None and answer['preview']['exact'] is not None
+    ]
+
+
+@st.fragment(run_every=1)
+def exact_result_watcher():
+    """Wait for the exact results behind previews, then show them in place of the previews."""
+    finished = [answer for answer in pending_previews() if answer['preview']['exact'].done()]
+    for answer in finished:
+        finish_preview(answer)
+    if finished:
+        st.rerun()
+
+
+# Polls only while some answer is a preview
+if pending_previews():
+    exact_result_watcher()
+
+
+@st.fragment
+def example_buttons():
+    """Sidebar example buttons; a click reruns the page only to fill the input."""
     example_queries = [
         "Покажи топ-10 товаров по продажам за последний месяц",
         "Какие магазины имеют наибольшую выручку в категории 'Молочные продукты'?",
@@ -116,9 +571,19 @@ with st.sidebar:
         if st.button(f"Пример {i+1}", key=f"example_{i}"):
             # Store the example in a temporary variable
             st.session_state.example_query = query
+            # An example answered earlier in this session is shown right away
+            key = question_key(query)
+            if key in st.session_state.answers:
+                remember_answer(st.session_state.answers[key])
             # Need to rerun to update the text area
             st.rerun()
 
+
+# Sidebar with examples
+with st.sidebar:
+    st.header("Примеры запросов")
+    example_buttons()
+
     st.markdown("---")
     st.markdown("### О проекте")
     st.markdown("""
@@ -130,4 +595,9 @@ with st.sidebar:
         - OpenAI GPT-4o mini
         - DuckDB
         - Python
-    """) 
\ No newline at end of file
+    """) 
+
+# Rerun until the background initialization finishes
+if not database.ready and database.error is None:
+    database.wait(timeout=1)
+    st.rerun()
@@ -0,0 +1,91 @@
+"""
+Time series charts of large results: fetching every point versus
+downsampling in NumPy (LTTB, min-max) or in DuckDB (M4 over the whole
+result), with the size of the figure sent to the browser.
+
+Usage:
+    python benchmarks/bench_charts.py [--scale 20000] [--max-points 2000] [--repeat 3]
+"""
+import argparse
+import statistics
+import time
+
+from harness import scaled_database, write_results
+
+from data_manager.charts import chart_data, detect_time_series, m4_points, m4_sql, time_series_figure
+
+# Daily revenue per store and per product, and every sale of a store as its
+# own point (sales of a day are spread over it by sale_id)
+QUERIES = {
+    'день × магазин': (
+        "SELECT s.sale_date, st.store_name, SUM(s.total_amount) AS revenue "
+        "FROM sales s JOIN stores st ON s.store_id = st.store_id GROUP BY ALL"
+    ),
+    'день × товар': (
+        "SELECT s.sale_date, p.product_name, SUM(s.total_amount) AS revenue "
+        "FROM sales s JOIN products p ON s.product_id = p.product_id GROUP BY ALL"
+    ),
+    'продажа × магазин': (
+        "SELECT s.sale_date + to_microseconds(s.sale_id) AS sold_at, st.store_name, s.total_amount "
+        "FROM sales s JOIN stores st ON s.store_id = st.store_id"
+    ),
+}
+
+
+def _median_ms(func, repeat):
+    result = func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=20000)
+    parser.add_argument('--max-points', type=int, default=2000)
+    parser.add_argument('--max-series', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    conn = scaled_database(args.scale)
+    records = []
+    for name, sql in QUERIES.items():
+        fetch_ms, df = _median_ms(lambda: conn.execute(sql).fetchdf(), args.repeat)
+        spec = detect_time_series(df)
+        full = chart_data(df, spec, max_points=len(df), max_series=args.max_series)
+        cases = {
+            'all points': (fetch_ms, full),
+            'lttb': lambda: chart_data(df, spec, max_points=args.max_points, max_series=args.max_series),
+            'minmax': lambda: chart_data(
+                df, spec, max_points=args.max_points, method='minmax', max_series=args.max_series
+            ),
+            'duckdb m4': lambda: m4_points(conn.execute(
+                m4_sql(sql, spec, buckets=args.max_points // 4, max_series=args.max_series)
+            ).fetchdf()),
+        }
+        for method, case in cases.items():
+            if callable(case):
+                elapsed, data = _median_ms(case, args.repeat)
+                # Downsampling in NumPy needs the result fetched first
+                elapsed += fetch_ms if method != 'duckdb m4' else 0
+            else:
+                elapsed, data = case
+            figure_ms, figure = _median_ms(lambda: time_series_figure(data.points, spec).to_json(), args.repeat)
+            records.append({
+                'query': name,
+                'method': method,
+                'rows': len(df),
+                'points': data.shown_points,
+                'data_ms': elapsed,
+                'figure_ms': figure_ms,
+                'figure_kb': len(figure) / 1024,
+            })
+
+    write_results('charts', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Compound questions as one query with CTEs versus independent sub-queries
+run in parallel on separate cursors and combined locally
+(QueryExecutor.execute_decomposed). The decompositions are written by hand,
+as the LLM would return them for the two questions.
+
+In the app process DuckDB already spreads one query over all cores, so the
+sub-queries mostly compete for the same threads; with sandbox workers each
+sub-query gets a worker process and its threads of its own.
+
+Usage:
+    python benchmarks/bench_decomposition.py [--scale 20000] [--repeat 5] [--sandbox-workers 0]
+"""
+import argparse
+import statistics
+import time
+
+from harness import scaled_database, write_results
+
+from data_manager.decomposition import DecomposedQuery, SubQuery
+from data_manager.query_executor import QueryExecutor
+
+CASES = {
+    "Сравни продажи по регионам за первый квартал этого года и прошлого": DecomposedQuery([
+        SubQuery('this_year', (
+            "SELECT st.region, SUM(s.total_amount) AS revenue, COUNT(DISTINCT s.customer_id) AS customers "
+            "FROM sales s JOIN stores st ON s.store_id = st.store_id JOIN calendar cal ON s.sale_date = cal.date "
+            "WHERE cal.is_current_year AND cal.quarter = 1 GROUP BY st.region"
+        )),
+        SubQuery('last_year', (
+            "SELECT st.region, SUM(s.total_amount) AS revenue, COUNT(DISTINCT s.customer_id) AS customers "
+            "FROM sales s JOIN stores st ON s.store_id = st.store_id JOIN calendar cal ON s.sale_date = cal.date "
+            "WHERE cal.is_last_year AND cal.quarter = 1 GROUP BY st.region"
+        )),
+    ], (
+        "SELECT t.region, t.revenue, l.revenue AS revenue_last_year, "
+        "round(100 * (t.revenue - l.revenue) / l.revenue, 1) AS growth_pct, t.customers, l.customers AS customers_last_year "
+        "FROM this_year t FULL JOIN last_year l ON l.region = t.region ORDER BY t.revenue DESC LIMIT 100"
+    )),
+    "Клиенты, потратившие больше всего, и что они покупали": DecomposedQuery([
+        SubQuery('top_customers', (
+            "SELECT c.customer_id, c.first_name, c.last_name, SUM(s.total_amount) AS spent "
+            "FROM sales s JOIN customers c ON s.customer_id = c.customer_id "
+            "GROUP BY ALL ORDER BY spent DESC LIMIT 10"
+        )),
+        SubQuery('purchases', (
+            "SELECT s.customer_id, cat.category_name, SUM(s.quantity) AS units, SUM(s.total_amount) AS amount "
+            "FROM sales s JOIN products p ON s.product_id = p.product_id "
+            "JOIN categories cat ON p.category_id = cat.category_id GROUP BY ALL"
+        )),
+    ], (
+        "SELECT t.first_name, t.last_name, t.spent, p.category_name, p.units, p.amount "
+        "FROM top_customers t JOIN purchases p ON p.customer_id = t.customer_id "
+        "ORDER BY t.spent DESC, p.amount DESC LIMIT 1000"
+    )),
+}
+
+
+def _median_ms(func, repeat):
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(func())
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sandbox-workers', type=int, default=0)
+    args = parser.parse_args()
+
+    scaled_database(args.scale).close()
+    executor = QueryExecutor(f"bench_x{args.scale}.db", coalesce=False, sandbox_workers=args.sandbox_workers)
+    executor.query_timeout_seconds = 600
+    records = []
+    for question, decomposed in CASES.items():
+        single_ms, single_rows = _median_ms(lambda: executor.execute_query(decomposed.as_single_sql()), args.repeat)
+        parallel_ms, parallel_rows = _median_ms(lambda: executor.execute_decomposed(decomposed), args.repeat)
+        records.append({
+            'question': question[:40],
+            'single_ms': single_ms,
+            'decomposed_ms': parallel_ms,
+            'speedup': single_ms / parallel_ms,
+            'rows': parallel_rows,
+            'same_rows': single_rows == parallel_rows,
+        })
+
+    if executor.sandbox is not None:
+        executor.sandbox.close()
+    write_results('decomposition', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
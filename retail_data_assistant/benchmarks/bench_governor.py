@@ -0,0 +1,115 @@
+"""
+Latency of light queries while a burst of heavy ones runs, with and
+without the resource governor: without it every heavy query runs at once
+and competes for the cores; with it heavy queries take one of their class
+slots in turn (or are rejected after the admission wait) and light queries
+keep their latency.
+
+Usage:
+    python benchmarks/bench_governor.py [--scale 20000] [--clients 8] [--heavy 16] [--heavy-slots 2]
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import scaled_database, percentile, write_results
+
+from data_manager.query_executor import QueryExecutor
+from data_manager.resource_governor import ResourceGovernor, QueryRejected
+from utils.config import GOVERNOR_CLASSES
+from utils.metrics import QueryMetrics
+
+HEAVY_QUERIES = [
+    "SELECT p.category_id, s.sale_date, SUM(s.total_amount) AS revenue, COUNT(DISTINCT s.customer_id) AS customers "
+    "FROM sales s JOIN products p ON s.product_id = p.product_id GROUP BY ALL ORDER BY revenue DESC",
+    "SELECT s.store_id, date_trunc('week', s.sale_date) AS week, quantile_cont(s.total_amount, 0.9) AS p90 "
+    "FROM sales s GROUP BY ALL ORDER BY p90 DESC",
+    "SELECT s.customer_id, COUNT(DISTINCT s.product_id) AS products, SUM(s.total_amount) AS spent "
+    "FROM sales s GROUP BY ALL ORDER BY spent DESC",
+]
+
+LIGHT_QUERIES = [
+    "SELECT store_name, city FROM stores ORDER BY store_name",
+    "SELECT category_name FROM categories ORDER BY category_name",
+]
+
+
+def _run_burst(executor, clients, heavy):
+    """Run heavy queries from several threads while one thread keeps asking light ones."""
+    light = []
+    heavy_ms = []
+    rejected = []
+    done = threading.Event()
+
+    def ask_light():
+        i = 0
+        while not done.is_set():
+            start = time.perf_counter()
+            executor.execute_query(LIGHT_QUERIES[i % len(LIGHT_QUERIES)])
+            light.append((time.perf_counter() - start) * 1000)
+            i += 1
+            time.sleep(0.02)
+
+    def ask_heavy(i):
+        start = time.perf_counter()
+        try:
+            executor.execute_query(HEAVY_QUERIES[i % len(HEAVY_QUERIES)], metrics=QueryMetrics())
+            heavy_ms.append((time.perf_counter() - start) * 1000)
+        except QueryRejected:
+            rejected.append(i)
+
+    prober = threading.Thread(target=ask_light)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(ask_heavy, range(heavy)))
+    wall = (time.perf_counter() - start) * 1000
+    done.set()
+    prober.join()
+    return wall, light, heavy_ms, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--heavy', type=int, default=16)
+    parser.add_argument('--heavy-slots', type=int, default=2)
+    parser.add_argument('--admission-wait', type=float, default=60)
+    args = parser.parse_args()
+
+    scaled_database(args.scale).close()
+    db_name = f"bench_x{args.scale}.db"
+    classes = [dict(definition) for definition in GOVERNOR_CLASSES]
+    classes[-1]['slots'] = args.heavy_slots
+    records = []
+
+    for mode in ('no governor', 'governor'):
+        governor = ResourceGovernor(classes, admission_wait=args.admission_wait) if mode == 'governor' else None
+        executor = QueryExecutor(db_name, coalesce=False, governor=governor)
+        executor.query_timeout_seconds = 600
+        try:
+            # Warm up, so the cost estimates are cached before the burst
+            for query in HEAVY_QUERIES + LIGHT_QUERIES:
+                executor.execute_query(query)
+            wall, light, heavy_ms, rejected = _run_burst(executor, args.clients, args.heavy)
+            records.append({
+                'mode': mode,
+                'wall_ms': wall,
+                'light_p50_ms': percentile(light, 50),
+                'light_p95_ms': percentile(light, 95),
+                'heavy_p50_ms': percentile(heavy_ms, 50),
+                'heavy_p95_ms': percentile(heavy_ms, 95),
+                'rejected': len(rejected),
+            })
+            if governor is not None:
+                print(governor.stats())
+        finally:
+            executor.conn.close()
+
+    write_results('governor', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Latency of the template fast path: matching, prepared execution and the same
+SQL executed without preparing, plus the share of questions that match.
+
+Usage:
+    python benchmarks/bench_intent_matcher.py [--scale 2000] [--repeat 20]
+"""
+import argparse
+import time
+
+from harness import scaled_database, percentile, write_results
+
+from data_manager.query_executor import QueryExecutor
+from data_manager.semantic_layer import SemanticLayer
+from intent_matcher import IntentMatcher
+
+QUESTIONS = [
+    "Покажи топ-10 товаров по продажам за последний месяц",
+    "Какие магазины имеют наибольшую выручку в категории 'Молочные продукты'?",
+    "Какие категории товаров приносят наибольшую прибыль в магазинах формата мини-маркет?",
+    "Топ-5 брендов по выручке за последние 3 месяца в Москве",
+    "Выручка по регионам за прошлый год",
+    "Средний чек по городам в этом году",
+    "5 худших магазинов по марже за прошлый месяц",
+    "Топ-3 подкатегории по прибыли в категории напитки за второй квартал",
+    "Какие поставщики дают наибольшую выручку в Санкт-Петербурге?",
+    "Сравни продажи по регионам за первый квартал этого года",
+    "Какие товары чаще всего покупают вместе с хлебом?",
+    "Покажи динамику продаж мороженого по месяцам за прошлый год",
+]
+
+
+def _median_ms(run, repeat):
+    run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return percentile(timings, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    scaled_database(args.scale).close()
+    executor = QueryExecutor(f"bench_x{args.scale}.db")
+    matcher = IntentMatcher(executor.reader, SemanticLayer())
+
+    records = []
+    for question in QUESTIONS:
+        template = matcher.match(question)
+        record = {
+            'question': question[:50],
+            'matched': template is not None,
+            'match_ms': _median_ms(lambda: matcher.match(question), args.repeat),
+        }
+
+        if template is not None:
+            record['prepared_ms'] = _median_ms(
+                lambda: executor.execute_prepared(template.sql, template.params), args.repeat
+            )
+            record['unprepared_ms'] = _median_ms(
+                lambda: executor.execute_query(template.display_sql), args.repeat
+            )
+        records.append(record)
+
+    matched = sum(1 for record in records if record['matched'])
+    print(f"Matched {matched} of {len(records)} questions")
+    write_results('intent_matcher', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
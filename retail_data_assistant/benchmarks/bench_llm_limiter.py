@@ -0,0 +1,101 @@
+"""
+A batch job and interactive users sharing one LLM quota, against the stub
+provider in stub_llm_server.py: a burst of batch questions is sent while
+interactive questions keep arriving. Without the rate limiter the burst runs
+into the provider's 429s and calls fail after their retries; with it calls
+queue inside the process, interactive ones ahead of the batch.
+
+Usage:
+    python benchmarks/bench_llm_limiter.py [--stub-rpm 30] [--limiter-rpm 25]
+        [--batch 40] [--batch-clients 16] [--interactive 10] [--interval 1]
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import percentile, write_results
+from stub_llm_server import start_stub
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+from llm_processor import LLMProcessor  # noqa: E402
+from utils.metrics import QueryMetrics  # noqa: E402
+from utils.rate_limiter import LLMRateLimiter, BATCH, INTERACTIVE, priority  # noqa: E402
+
+
+def _ask(llm, question, level, latencies, failures):
+    start = time.perf_counter()
+    metrics = QueryMetrics(question)
+    try:
+        with priority(level):
+            llm.generate_sql(question, metrics=metrics)
+        latencies.append((time.perf_counter() - start) * 1000)
+    except Exception:
+        failures.append(question)
+    return metrics.llm_retries
+
+
+def _run(llm, args):
+    """Send the batch burst and the interactive questions; returns per-priority results."""
+    results = {level: ([], []) for level in (INTERACTIVE, BATCH)}
+    retries = []
+
+    def interactive():
+        for i in range(args.interactive):
+            retries.append(_ask(llm, f"Выручка магазина {i} за прошлую неделю", INTERACTIVE, *results[INTERACTIVE]))
+            time.sleep(args.interval)
+
+    user = threading.Thread(target=interactive)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.batch_clients) as pool:
+        futures = [
+            pool.submit(_ask, llm, f"Продажи товара {i} по месяцам", BATCH, *results[BATCH])
+            for i in range(args.batch)
+        ]
+        user.start()
+        retries.extend(future.result() for future in futures)
+    user.join()
+    return (time.perf_counter() - start) * 1000, results, sum(retries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stub-rpm', type=int, default=30)
+    parser.add_argument('--limiter-rpm', type=int, default=25)
+    parser.add_argument('--batch', type=int, default=40)
+    parser.add_argument('--batch-clients', type=int, default=16)
+    parser.add_argument('--interactive', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    records = []
+    for mode in ('no limiter', 'limiter'):
+        # A fresh stub per mode, so both start with a full provider window
+        server, limits = start_stub(0, args.stub_rpm, 0, args.error_rate, latency_ms=300, jitter_ms=100)
+        rate_limiter = LLMRateLimiter(args.limiter_rpm, max_wait=300) if mode == 'limiter' else None
+        llm = LLMProcessor(
+            coalesce=False, rate_limiter=rate_limiter, max_retries=3, retry_max_delay=10,
+            base_url=f"http://127.0.0.1:{server.server_port}/v1"
+        )
+        try:
+            wall, results, retries = _run(llm, args)
+        finally:
+            server.shutdown()
+        record = {'mode': mode, 'wall_ms': wall, 'stub_429': limits.rejected, 'retries': retries}
+        for level, name in ((INTERACTIVE, 'interactive'), (BATCH, 'batch')):
+            latencies, failures = results[level]
+            record[f'{name}_failed'] = len(failures)
+            record[f'{name}_p50_ms'] = percentile(latencies, 50)
+            record[f'{name}_p95_ms'] = percentile(latencies, 95)
+        records.append(record)
+        if rate_limiter is not None:
+            print(rate_limiter.stats())
+
+    write_results('llm_limiter', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
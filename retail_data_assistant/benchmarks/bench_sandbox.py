@@ -0,0 +1,113 @@
+"""
+Heavy queries in the app process versus the sandbox pool of worker
+processes: wall time of a batch of concurrent analytical queries, latency
+of a trivial query on the app's own connection while the batch runs (how
+responsive the UI process stays), and the time to stop a runaway query.
+
+Usage:
+    python benchmarks/bench_sandbox.py [--scale 20000] [--workers 4] [--clients 8] [--queries 32]
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import scaled_database, percentile, write_results
+
+from data_manager.query_executor import QueryExecutor
+
+HEAVY_QUERIES = [
+    "SELECT p.category_id, s.sale_date, SUM(s.total_amount) AS revenue, COUNT(DISTINCT s.customer_id) AS customers "
+    "FROM sales s JOIN products p ON s.product_id = p.product_id GROUP BY ALL ORDER BY revenue DESC",
+    "SELECT s.store_id, date_trunc('week', s.sale_date) AS week, quantile_cont(s.total_amount, 0.9) AS p90 "
+    "FROM sales s GROUP BY ALL ORDER BY p90 DESC",
+    "SELECT s.product_id, SUM(s.quantity) AS units, AVG(s.total_amount) AS avg_check "
+    "FROM sales s WHERE s.sale_date >= CURRENT_DATE - INTERVAL 365 DAY GROUP BY ALL ORDER BY units DESC",
+]
+
+RUNAWAY_QUERY = "SELECT COUNT(*) FROM range(100000000000) a, range(10) b"
+
+
+def _run_batch(executor, clients, queries):
+    """Run queries from several threads; return the wall time and probe latencies on the app connection."""
+    probes = []
+    done = threading.Event()
+
+    def probe():
+        cursor = executor.conn.cursor()
+        while not done.is_set():
+            start = time.perf_counter()
+            cursor.execute("SELECT COUNT(*) FROM stores").fetchall()
+            probes.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.05)
+        cursor.close()
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(lambda i: executor.execute_query(HEAVY_QUERIES[i % len(HEAVY_QUERIES)]), range(queries)))
+    wall = (time.perf_counter() - start) * 1000
+    done.set()
+    prober.join()
+    return wall, probes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=32)
+    parser.add_argument('--memory-limit', default="1GB")
+    args = parser.parse_args()
+
+    # The sandbox needs the file free of writers
+    scaled_database(args.scale).close()
+    db_name = f"bench_x{args.scale}.db"
+    records = []
+
+    for mode, workers in (('in-process', 0), ('sandbox', args.workers)):
+        executor = QueryExecutor(
+            db_name, coalesce=False, sandbox_workers=workers, sandbox_memory_limit=args.memory_limit
+        )
+        executor.query_timeout_seconds = 600
+        try:
+            wall, probes = _run_batch(executor, args.clients, args.queries)
+            records.append({
+                'mode': mode,
+                'case': f"{args.queries} heavy queries, {args.clients} clients",
+                'wall_ms': wall,
+                'queries_per_s': args.queries / wall * 1000,
+                'probe_p50_ms': percentile(probes, 50),
+                'probe_p95_ms': percentile(probes, 95),
+            })
+
+            executor.query_timeout_seconds = 1
+            start = time.perf_counter()
+            try:
+                executor.execute_query(RUNAWAY_QUERY)
+            except Exception:
+                pass
+            stopped = (time.perf_counter() - start) * 1000
+            # A thread-based timeout only interrupts; the next query shows whether the connection recovered
+            start = time.perf_counter()
+            executor.execute_query("SELECT 1")
+            records.append({
+                'mode': mode,
+                'case': "runaway query, 1 s timeout",
+                'wall_ms': stopped,
+                'queries_per_s': None,
+                'probe_p50_ms': (time.perf_counter() - start) * 1000,
+                'probe_p95_ms': None,
+            })
+        finally:
+            if executor.sandbox is not None:
+                executor.sandbox.close()
+            executor.conn.close()
+
+    write_results('sandbox', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Distinct customer and receipt counts from the HyperLogLog sketches versus
+COUNT(DISTINCT) over sales, for specs compiled by the semantic layer, plus
+the time to build the sketches and to extend them with one more day of sales.
+
+Usage:
+    python benchmarks/bench_sketches.py [--scale 20000] [--repeat 5] [--precision 12]
+"""
+import argparse
+import time
+
+from harness import scaled_database, time_query, write_results
+
+from data_manager.semantic_layer import SemanticLayer
+from data_manager.sketches import DistinctSketches
+
+SPECS = {
+    "Клиенты и чеки по регионам за последние 6 месяцев": {
+        "metrics": ["уникальные клиенты", "чеки"],
+        "dimensions": ["region"],
+        "period": {"name": "last_n_months", "n": 6},
+    },
+    "Чеки по отделам и форматам магазинов": {
+        "metrics": ["чеки", "уникальные клиенты"],
+        "dimensions": ["department", "format"],
+    },
+    "Чеки по месяцам в молочных продуктах": {
+        "metrics": ["чеки"],
+        "time_grain": "month",
+        "filters": [{"dimension": "category", "op": "=", "value": "Молочные продукты"}],
+    },
+    "Чеки за прошлый год": {
+        "metrics": ["чеки"],
+        "period": {"name": "last_year"},
+    },
+}
+
+
+def _max_error(sketched, exact):
+    """Largest relative error of the estimates over matching rows."""
+    exact = {tuple(row[:-1]): row[-1] for row in exact}
+    errors = [
+        abs(row[-1] - exact[tuple(row[:-1])]) / exact[tuple(row[:-1])]
+        for row in sketched if exact.get(tuple(row[:-1]))
+    ]
+    return max(errors) if errors else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--precision', type=int, default=12)
+    args = parser.parse_args()
+
+    conn = scaled_database(args.scale)
+    sketches = DistinctSketches(conn, precision=args.precision)
+    start = time.perf_counter()
+    sketches.refresh(force=True)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # One more day of sales on top of the sketched ones
+    conn.execute("""
+        CREATE OR REPLACE TEMP TABLE last_day AS
+        SELECT * FROM sales WHERE sale_date = (SELECT MAX(sale_date) FROM sales);
+        DELETE FROM sales WHERE sale_date = (SELECT MAX(sale_date) FROM sales);
+    """)
+    sketches.refresh(force=True)
+    conn.execute("INSERT INTO sales SELECT * FROM last_day")
+    start = time.perf_counter()
+    added = sketches.refresh()
+    incremental_ms = (time.perf_counter() - start) * 1000
+    sketch_rows = conn.execute(f"SELECT COUNT(*) FROM {sketches.table}").fetchone()[0]
+
+    sketched_layer = SemanticLayer(sketches=sketches)
+    exact_layer = SemanticLayer()
+    records = []
+    for question, spec in SPECS.items():
+        sketched = sketched_layer.compile(dict(spec)).display_sql
+        exact = exact_layer.compile(dict(spec)).display_sql
+        sketched_stats = time_query(conn, sketched, repeat=args.repeat)
+        exact_stats = time_query(conn, exact, repeat=args.repeat)
+        # Estimates and exact counts per group, metrics one at a time
+        error = 0.0
+        for term in spec['metrics']:
+            single = {**spec, 'metrics': [term]}
+            error = max(error, _max_error(
+                conn.execute(sketched_layer.compile(dict(single)).display_sql).fetchall(),
+                conn.execute(exact_layer.compile(dict(single)).display_sql).fetchall(),
+            ))
+        records.append({
+            'question': question[:40],
+            'sketch_ms': sketched_stats['median_ms'],
+            'exact_ms': exact_stats['median_ms'],
+            'speedup': exact_stats['median_ms'] / sketched_stats['median_ms'],
+            'max_error_pct': error * 100,
+        })
+
+    records.append({
+        'question': f"build ({sketch_rows} sketch rows)",
+        'sketch_ms': build_ms,
+        'exact_ms': None,
+        'speedup': None,
+        'max_error_pct': None,
+    })
+    records.append({
+        'question': f"incremental (+{added} rows)",
+        'sketch_ms': incremental_ms,
+        'exact_ms': None,
+        'speedup': None,
+        'max_error_pct': None,
+    })
+    print(f"Expected relative standard error: {sketches.relative_error * 100:.2f}%")
+    write_results('sketches', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Before/after timings of the SQL anti-pattern rewriter.
+
+Usage:
+    python benchmarks/bench_sql_rewriter.py [--scale 20000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+
+from harness import scaled_database, time_query, write_results, ROOT_DIR
+
+from data_manager.sql_rewriter import SQLRewriter
+
+# Typical patterns the model emits for date filters
+CASES = [
+    ("month_equality",
+     "SELECT SUM(total_amount) FROM sales s "
+     "WHERE date_trunc('month', s.sale_date) = date_trunc('month', CURRENT_DATE) - INTERVAL '1 month'"),
+    ("year_equality",
+     "SELECT s.store_id, SUM(s.total_amount) FROM sales s "
+     "WHERE year(s.sale_date) = year(CURRENT_DATE) GROUP BY s.store_id"),
+    ("quarter_lower_bound",
+     "SELECT p.category_id, SUM(s.quantity) FROM sales s JOIN products p ON s.product_id = p.product_id "
+     "WHERE date_trunc('quarter', s.sale_date) >= date_trunc('quarter', CURRENT_DATE) GROUP BY p.category_id"),
+    ("week_equality",
+     "SELECT COUNT(*) FROM sales s "
+     "WHERE date_trunc('week', s.sale_date) = date_trunc('week', CURRENT_DATE) - INTERVAL 7 DAY"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    conn = scaled_database(args.scale)
+    rewriter = SQLRewriter(conn)
+
+    with open(os.path.join(ROOT_DIR, 'metadata', 'query_examples.json'), encoding='utf-8') as f:
+        examples = json.load(f)['examples']
+    cases = CASES + [(f"example_{i + 1}", example['sql']) for i, example in enumerate(examples)]
+
+    records = []
+    for name, sql in cases:
+        analysis = rewriter.analyze(sql)
+        before = time_query(conn, sql, repeat=args.repeat)
+        after = time_query(conn, analysis.sql, repeat=args.repeat) if analysis.rewritten else before
+        records.append({
+            'case': name,
+            'rewritten': analysis.rewritten,
+            'warnings': sum(1 for finding in analysis.findings if not finding.rewritten),
+            'before_ms': before['median_ms'],
+            'after_ms': after['median_ms'],
+            'speedup': before['median_ms'] / after['median_ms'] if after['median_ms'] else None,
+            'rows_match': before['rows'] == after['rows'],
+        })
+
+    write_results('sql_rewriter', records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Startup cost of the app: time to import the modules app.py loads before the
+first render (checked against STARTUP_IMPORT_BUDGET_MS), and time until the
+database is ready on a cold start, a warm start and a cold start raced by
+several processes, of which only one may build the database.
+
+Usage:
+    python benchmarks/bench_startup.py [--processes 2]
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+
+from harness import ROOT_DIR, write_results
+
+from utils.config import STARTUP_IMPORT_BUDGET_MS
+
+DB_NAME = "bench_startup.db"
+
+HEAVY_MODULES = ["pandas", "numpy", "openai"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+import streamlit
+timings = {}
+for name in %r:
+    start = time.perf_counter()
+    __import__(name)
+    timings[name] = (time.perf_counter() - start) * 1000
+print(json.dumps({'timings': timings, 'loaded': [m for m in %r if m in sys.modules]}))
+"""
+
+ENSURE_SCRIPT = """
+import json, logging, time
+logging.disable(logging.CRITICAL)
+start = time.perf_counter()
+from data_manager.db_bootstrap import DatabaseBootstrap
+DatabaseBootstrap(%r).ensure()
+print(json.dumps({'ready_ms': (time.perf_counter() - start) * 1000}))
+"""
+
+
+def _app_modules():
+    """
+    Modules of this project that app.py imports at top level, i.e. before
+    the page renders; streamlit and the standard library are loaded by the
+    time the script runs, so they are excluded from the budget.
+    """
+    with open(os.path.join(ROOT_DIR, "app.py"), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return [
+        name for name in dict.fromkeys(names)
+        if os.path.exists(os.path.join(ROOT_DIR, *name.split('.')) + ".py")
+    ]
+
+
+def _python(script):
+    """Run a snippet in a fresh interpreter from the app directory and parse its JSON output."""
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _remove_database():
+    data_dir = os.path.join(ROOT_DIR, "data")
+    for suffix in ("", ".wal", ".ready", ".lock", ".init", ".init.wal"):
+        path = os.path.join(data_dir, DB_NAME + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _race(processes):
+    """Start several cold-start processes at once; return their ready times."""
+    start = time.perf_counter()
+    running = [
+        subprocess.Popen(
+            [sys.executable, "-c", ENSURE_SCRIPT % DB_NAME], cwd=ROOT_DIR, stdout=subprocess.PIPE, text=True
+        )
+        for _ in range(processes)
+    ]
+    results = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in running]
+    for p in running:
+        if p.returncode != 0:
+            raise Exception(f"Startup process failed with code {p.returncode}")
+    return results, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=2)
+    args = parser.parse_args()
+
+    records = []
+
+    imports = _python(IMPORT_SCRIPT % (_app_modules(), HEAVY_MODULES))
+    total = sum(imports['timings'].values())
+    for name, elapsed in imports['timings'].items():
+        records.append({'case': f"import {name}", 'ms': elapsed})
+    records.append({'case': 'import total', 'ms': total})
+
+    _remove_database()
+    records.append({'case': 'cold start, database ready', 'ms': _python(ENSURE_SCRIPT % DB_NAME)['ready_ms']})
+    records.append({'case': 'warm start, database ready', 'ms': _python(ENSURE_SCRIPT % DB_NAME)['ready_ms']})
+
+    _remove_database()
+    results, wall = _race(args.processes)
+    for i, result in enumerate(results):
+        records.append({'case': f"race {i + 1}/{args.processes}, database ready", 'ms': result['ready_ms']})
+    records.append({'case': f"race of {args.processes}, wall time", 'ms': wall})
+    _remove_database()
+
+    write_results('startup', records, params=vars(args))
+
+    print(f"\nImports before first render: {total:.0f} ms (budget {STARTUP_IMPORT_BUDGET_MS} ms)")
+    if imports['loaded']:
+        print(f"Heavy modules imported eagerly: {', '.join(imports['loaded'])}")
+    if total > STARTUP_IMPORT_BUDGET_MS or imports['loaded']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Shared helpers for the benchmark scripts in this directory.
+
+Benchmarks run against a scaled copy of the sample database: the sales table
+is multiplied and spread over the two years up to today, so that plan
+differences show up in timings and relative date filters hit data. Results
+are printed and written as JSON to benchmarks/results/<name>.json.
+"""
+import json
+import os
+import sys
+import time
+import statistics
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from data_manager.db_initializer import DBInitializer  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def scaled_database(scale=20000, days=730):
+    """
+    Build (or reuse) a benchmark database with the sales table scaled up.
+
+    Args:
+        scale (int): How many copies of the sample sales to generate
+        days (int): Number of days up to today the copies are spread over
+
+    Returns:
+        duckdb.DuckDBPyConnection: Connection to the scaled database
+    """
+    db_name = f"bench_x{scale}.db"
+    initializer = DBInitializer(db_name)
+    conn = initializer.conn
+
+    sample_rows = len(open(os.path.join(initializer.data_dir, 'sales.csv'), encoding='utf-8').readlines()) - 1
+    tables = [row[0] for row in conn.execute("SHOW TABLES").fetchall()]
+    if 'sales' in tables and conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == sample_rows * scale:
+        return conn
+
+    initializer.initialize_database()
+    # Copies are inserted in date order, like a fact table loaded day by day
+    conn.execute(f"""
+        CREATE OR REPLACE TEMP TABLE sales_sample AS SELECT * FROM sales;
+        DELETE FROM sales;
+        INSERT INTO sales
+        SELECT
+            row_number() OVER (ORDER BY d.sale_date, d.sale_id, d.copy) AS sale_id,
+            d.* EXCLUDE (sale_id, copy)
+        FROM (
+            SELECT
+                s.* REPLACE (CAST(CURRENT_DATE - CAST((r.range + s.sale_id) % {int(days)} AS INTEGER) AS DATE) AS sale_date),
+                r.range AS copy
+            FROM sales_sample s, range({int(scale)}) r
+        ) d
+        ORDER BY d.sale_date;
+        DROP TABLE sales_sample;
+    """)
+    initializer.ensure_calendar()
+    return conn
+
+
+def time_query(conn, sql, repeat=5, warmup=1):
+    """
+    Time a query, returning summary statistics in milliseconds.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): The connection to run on
+        sql (str): The query
+        repeat (int): Number of timed runs
+        warmup (int): Number of untimed runs first
+
+    Returns:
+        dict: median_ms, min_ms, max_ms and rows
+    """
+    rows = None
+    for _ in range(warmup):
+        conn.execute(sql).fetchall()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(conn.execute(sql).fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'max_ms': max(timings),
+        'rows': rows,
+    }
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def write_results(name, records, params=None):
+    """
+    Print benchmark records as a table and store them as JSON.
+
+    Args:
+        name (str): Benchmark name, used as the file name
+        records (list): One dict per measured case
+        params (dict, optional): Benchmark parameters to store alongside
+
+    Returns:
+        str: Path of the written JSON file
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'benchmark': name,
+            'recorded_at': datetime.now().isoformat(timespec='seconds'),
+            'params': params or {},
+            'records': records,
+        }, f, ensure_ascii=False, indent=2, default=str)
+
+    if records:
+        columns = list(records[0].keys())
+        widths = {
+            c: min(60, max(len(c), *(len(_format(r.get(c))) for r in records))) for c in columns
+        }
+        print("  ".join(c.ljust(widths[c]) for c in columns))
+        for record in records:
+            print("  ".join(_format(record.get(c))[:widths[c]].ljust(widths[c]) for c in columns))
+    print(f"\nResults written to {path}")
+    return path
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
@@ -0,0 +1,126 @@
+"""
+Load test for api_server.py: concurrent clients send questions (or SQL) for
+a fixed time; throughput, latency percentiles and response statuses are
+reported. 503 responses show the backpressure limit at work, 504 the
+request timeout.
+
+Start the server first:
+    python api_server.py
+
+Usage:
+    python benchmarks/load_test_api.py [--url http://127.0.0.1:8000] [--endpoint ask]
+        [--clients 16] [--duration 30] [--format json]
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+from harness import percentile, write_results
+
+QUESTIONS = [
+    "Покажи топ-10 товаров по продажам за последний месяц",
+    "Какие магазины имеют наибольшую выручку в категории 'Молочные продукты'?",
+    "Топ-5 брендов по выручке за последние 3 месяца в Москве",
+    "Выручка по регионам за прошлый год",
+    "Средний чек по городам в этом году",
+    "5 худших магазинов по марже за прошлый месяц",
+]
+
+SQL = [
+    "SELECT st.region, SUM(s.total_amount) AS revenue FROM sales s JOIN stores st ON s.store_id = st.store_id GROUP BY st.region",
+    "SELECT p.brand, SUM(s.quantity) AS units FROM sales s JOIN products p ON s.product_id = p.product_id GROUP BY p.brand ORDER BY units DESC LIMIT 10",
+    "SELECT cal.month_start, SUM(s.total_amount) AS revenue FROM sales s JOIN calendar cal ON s.sale_date = cal.date GROUP BY cal.month_start ORDER BY cal.month_start",
+]
+
+
+def _request(url, body, accept):
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'Accept': accept}, method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except Exception:
+        return 'error'
+
+
+def _wait_ready(base_url, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=5) as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            pass
+        time.sleep(1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--endpoint', choices=['ask', 'generate-sql', 'execute-sql'], default='ask')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--format', choices=['json', 'arrow'], default='json')
+    args = parser.parse_args()
+
+    if not _wait_ready(args.url):
+        raise SystemExit(f"Server at {args.url} is not ready")
+
+    url = f"{args.url}/{args.endpoint}"
+    accept = 'application/vnd.apache.arrow.stream' if args.format == 'arrow' else 'application/json'
+    if args.endpoint == 'execute-sql':
+        bodies = [{'sql': sql} for sql in SQL]
+    else:
+        bodies = [{'question': question} for question in QUESTIONS]
+
+    samples = []
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+
+    def client(offset):
+        i = offset
+        while time.time() < deadline:
+            start = time.perf_counter()
+            status = _request(url, bodies[i % len(bodies)], accept)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                samples.append((status, elapsed))
+            i += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    records = []
+    for status, count in sorted(Counter(status for status, _ in samples).items(), key=lambda item: str(item[0])):
+        latencies = [elapsed for s, elapsed in samples if s == status]
+        records.append({
+            'status': status,
+            'requests': count,
+            'rps': count / wall,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': max(latencies),
+        })
+    write_results(f"load_test_api_{args.endpoint}", records, params=vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Load test of the whole question pipeline without the OpenAI API: N virtual
+users ask questions for a fixed time, each answered end to end (SQL
+generation, validation, execution, formatting) with the LLM replaced by the
+replay backend (llm_backends.ReplayBackend), which answers with the SQL of
+metadata/query_examples.json after a simulated latency. Throughput and
+latency percentiles per pipeline stage are reported, for capacity planning.
+
+Runs are repeatable: the questions of each user and the LLM latencies come
+from seeded generators. Precomputed example answers are off, so every
+question reaches the LLM and the database; --templates adds the template
+fast path.
+
+Usage:
+    python benchmarks/load_test_pipeline.py [--scale 1000] [--users 16] [--duration 30]
+        [--latency lognormal:800,0.4] [--think-ms 0] [--templates] [--sandbox-workers 0]
+"""
+import argparse
+import random
+import threading
+import time
+
+from harness import scaled_database, percentile, write_results
+
+from data_manager.formatter import format_results
+from data_manager.query_executor import QueryExecutor
+from data_manager.resource_governor import ResourceGovernor
+from data_manager.semantic_layer import SemanticLayer
+from intent_matcher import IntentMatcher
+from llm_backends import ReplayBackend
+from llm_processor import LLMProcessor
+from pipeline import QuestionPipeline
+from utils.config import (
+    GOVERNOR_ENABLED, GOVERNOR_CLASSES, GOVERNOR_ADMISSION_WAIT, DB_THREADS, DB_MEMORY_LIMIT,
+    SINGLE_FLIGHT_ENABLED, SQL_MAX_REPAIR_ATTEMPTS
+)
+from utils.metrics import QueryMetrics, STAGES
+
+# Questions beyond the examples: the replay backend answers them with the
+# SQL of an example picked by their hash, the templates may match some
+EXTRA_QUESTIONS = [
+    "Топ-5 брендов по выручке за последние 3 месяца в Москве",
+    "Выручка по регионам за прошлый год",
+    "Средний чек по городам в этом году",
+    "5 худших магазинов по марже за прошлый месяц",
+    "Топ-10 категорий по количеству продаж за неделю",
+]
+
+
+def _virtual_user(user, pipeline, questions, deadline, think_ms, seed, collected, lock):
+    """Ask questions until the deadline, recording the finish time, total latency and metrics of each."""
+    rng = random.Random(seed * 1000 + user)
+    while time.monotonic() < deadline:
+        question = rng.choice(questions)
+        metrics = QueryMetrics(question)
+        try:
+            plan, results = pipeline.answer(question, metrics=metrics)
+            if results is not None and len(results) > 0:
+                with metrics.stage('format'):
+                    format_results(results)
+        except Exception as e:
+            metrics.fail(e)
+        with lock:
+            collected.append((time.monotonic(), metrics.total_seconds, metrics))
+        if think_ms:
+            time.sleep(rng.expovariate(1000 / think_ms))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds of load not counted in the results")
+    parser.add_argument('--latency', default="lognormal:800,0.4")
+    parser.add_argument('--think-ms', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--templates', action='store_true')
+    parser.add_argument('--sandbox-workers', type=int, default=0)
+    args = parser.parse_args()
+
+    scaled_database(args.scale).close()
+    governor = ResourceGovernor(
+        GOVERNOR_CLASSES, admission_wait=GOVERNOR_ADMISSION_WAIT, threads=DB_THREADS, memory_limit=DB_MEMORY_LIMIT
+    ) if GOVERNOR_ENABLED else None
+    executor = QueryExecutor(
+        f"bench_x{args.scale}.db", coalesce=SINGLE_FLIGHT_ENABLED, sandbox_workers=args.sandbox_workers,
+        governor=governor
+    )
+    backend = ReplayBackend(latency=args.latency, seed=args.seed)
+    llm = LLMProcessor(
+        coalesce=SINGLE_FLIGHT_ENABLED, backend=backend, max_connections=args.users, term_macros=executor.term_macros
+    )
+    semantic_layer = SemanticLayer(max_rows=executor.max_rows)
+    intent_matcher = IntentMatcher(executor.reader, semantic_layer) if args.templates else None
+    pipeline = QuestionPipeline(
+        executor, llm, intent_matcher=intent_matcher, max_repairs=SQL_MAX_REPAIR_ATTEMPTS
+    )
+    questions = [example['question'] for example in backend.examples] + EXTRA_QUESTIONS
+
+    collected = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    deadline = start + args.warmup + args.duration
+    users = [
+        threading.Thread(
+            target=_virtual_user,
+            args=(user, pipeline, questions, deadline, args.think_ms, args.seed, collected, lock),
+        )
+        for user in range(args.users)
+    ]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+
+    # Questions finished during the warmup are left out
+    measured = [(total, metrics) for finished, total, metrics in collected if finished >= start + args.warmup]
+    answered = [metrics for _, metrics in measured if metrics.status == 'ok']
+    records = []
+    for stage in STAGES + ['total']:
+        if stage == 'total':
+            values = [total * 1000 for total, metrics in measured if metrics.status == 'ok']
+        else:
+            values = [metrics.stages[stage] * 1000 for metrics in answered if stage in metrics.stages]
+        if not values:
+            continue
+        records.append({
+            'stage': stage,
+            'count': len(values),
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+        })
+
+    print(f"{len(answered)} questions answered in {args.duration:.0f} s "
+          f"({len(answered) / args.duration:.1f}/s), {len(measured) - len(answered)} failed, "
+          f"{backend.calls} LLM calls")
+    sources = {}
+    for metrics in answered:
+        sources[metrics.source] = sources.get(metrics.source, 0) + 1
+    print(f"SQL sources: {sources}")
+    write_results('pipeline_load', records, params={
+        **vars(args),
+        'answered': len(answered),
+        'failed': len(measured) - len(answered),
+        'throughput_per_s': len(answered) / args.duration,
+    })
+
+
+if __name__ == '__main__':
+    main()
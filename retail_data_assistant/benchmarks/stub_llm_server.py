@@ -0,0 +1,202 @@
+"""
+OpenAI-compatible stub of /v1/chat/completions for load tests without the
+real API: answers every question with a fixed SQL query and token usage,
+enforces its own requests/tokens per minute like the provider does (429
+with Retry-After once a window is used up) and can fail a share of calls
+with 429 or add latency, including a slow tail: a share of calls takes
+much longer than the rest, as the real API's p99 does. Connections are
+kept alive, and the stub counts the connections opened and the requests
+whose client hung up before the answer (cancelled hedges).
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8100/v1 and any
+OPENAI_API_KEY.
+
+Usage:
+    python benchmarks/stub_llm_server.py [--port 8100] [--rpm 60] [--tpm 40000]
+        [--error-rate 0] [--latency-ms 200] [--jitter-ms 100] [--slow-rate 0] [--slow-ms 5000]
+"""
+import argparse
+import json
+import random
+import select
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SQL_ANSWER = (
+    "```sql\n"
+    "SELECT p.product_name, SUM(s.total_amount) AS revenue\n"
+    "FROM sales s JOIN products p ON s.product_id = p.product_id\n"
+    "GROUP BY p.product_name ORDER BY revenue DESC LIMIT 10\n"
+    "```"
+)
+
+
+class _Limits:
+    """Fixed one-minute windows of requests and tokens, as counted by the provider."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._window = 0
+        self.requests = 0
+        self.tokens = 0
+        self.served = 0
+        self.rejected = 0
+        self.connections = 0
+        self.cancelled = 0
+
+    def take(self, tokens):
+        """Count a call; returns seconds to the next window if it is over the limits, else None."""
+        with self._lock:
+            now = time.time()
+            window = int(now // 60)
+            if window != self._window:
+                self._window, self.requests, self.tokens = window, 0, 0
+            if (self.rpm and self.requests + 1 > self.rpm) or (self.tpm and self.tokens + tokens > self.tpm):
+                self.rejected += 1
+                return (window + 1) * 60 - now
+            self.requests += 1
+            self.tokens += tokens
+            self.served += 1
+            return None
+
+    def reject(self):
+        """Count a call failed on purpose."""
+        with self._lock:
+            self.served -= 1
+            self.rejected += 1
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+def make_handler(limits, error_rate=0.0, latency_ms=0, jitter_ms=0, slow_rate=0.0, slow_ms=5000):
+    """Request handler class bound to the stub's limits and fault settings."""
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, like the real API
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            limits.count('connections')
+
+        def _reply(self, status, body, headers=None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._reply(404, {'error': {'message': 'not found'}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            prompt_tokens = sum(len(message.get('content', '')) for message in request.get('messages', [])) // 3
+            completion_tokens = len(SQL_ANSWER) // 3
+
+            retry_after = limits.take(prompt_tokens + completion_tokens)
+            if retry_after is None and random.random() < error_rate:
+                retry_after = random.uniform(0.5, 2)
+                limits.reject()
+            if retry_after is not None:
+                self._reply(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                            {'Retry-After': f"{retry_after:.1f}"})
+                return
+
+            delay_ms = max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms))
+            if random.random() < slow_rate:
+                delay_ms = slow_ms
+            if self._client_gone(delay_ms / 1000):
+                limits.count('cancelled')
+                self.close_connection = True
+                return
+            self._reply(200, {
+                'id': f"chatcmpl-stub-{random.getrandbits(32):08x}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model', 'stub'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': SQL_ANSWER},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            })
+
+        def _client_gone(self, seconds):
+            """Wait for the answer to be "generated"; True if the client closed the connection meanwhile."""
+            readable, _, _ = select.select([self.connection], [], [], seconds)
+            # A closed connection is readable and yields no data; a pipelined
+            # request is not expected from the OpenAI client
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(port=8100, rpm=60, tpm=40000, error_rate=0.0, latency_ms=0, jitter_ms=0, slow_rate=0.0, slow_ms=5000):
+    """
+    Start the stub in a background thread.
+
+    Args:
+        port (int): Port on 127.0.0.1; 0 for a free one
+        rpm (int): Requests per minute before 429; 0 for no limit
+        tpm (int): Tokens per minute before 429; 0 for no limit
+        error_rate (float): Share of calls failed with 429 regardless of the limits
+        latency_ms (float): Mean response latency
+        jitter_ms (float): Latency spread, uniform around the mean
+        slow_rate (float): Share of calls answered after slow_ms instead
+        slow_ms (float): Latency of the slow tail
+
+    Returns:
+        tuple: (server, limits); the base URL is http://127.0.0.1:<server.server_port>/v1
+    """
+    limits = _Limits(rpm, tpm)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(limits, error_rate, latency_ms, jitter_ms, slow_rate, slow_ms))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server, limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--rpm', type=int, default=60)
+    parser.add_argument('--tpm', type=int, default=40000)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=100)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-ms', type=float, default=5000)
+    args = parser.parse_args()
+
+    server, limits = start_stub(
+        args.port, args.rpm, args.tpm, args.error_rate, args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms
+    )
+    print(f"Stub LLM listening on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"served {limits.served}, rejected {limits.rejected}, "
+                  f"cancelled {limits.cancelled}, connections {limits.connections}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
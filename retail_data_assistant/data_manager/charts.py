@@ -0,0 +1,357 @@
+import logging
+import numpy as np
+import pandas as pd
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Columns that are parts of a date: the time axis when there is no date
+# column, otherwise repeated by it and not charted
+TIME_PART_COLUMNS = {'year', 'quarter', 'month', 'week', 'day', 'day_of_week', 'hour'}
+
+DOWNSAMPLING_METHODS = {'lttb', 'minmax'}
+
+# Columns of the points a chart is drawn from: one row per point of a line
+POINT_COLUMNS = ['series', 'measure', 't', 'y']
+
+
+class ChartSpec:
+    """The columns of a result that make a time series chart."""
+
+    def __init__(self, time_column, measures, series_columns, dated=True):
+        self.time_column = time_column
+        # False when the time axis is a number (year) rather than a date
+        self.dated = dated
+        self.measures = measures
+        # Columns whose values name the lines, e.g. region or store
+        self.series_columns = series_columns
+
+
+class ChartData:
+    """Points of a chart after downsampling, and how much of the result they stand for."""
+
+    def __init__(self, points, total_points, total_series):
+        self.points = points
+        self.total_points = total_points
+        self.total_series = total_series
+
+    @property
+    def shown_points(self):
+        return len(self.points)
+
+    @property
+    def shown_series(self):
+        return self.points['series'].nunique()
+
+
+def detect_time_series(df, max_measures=4):
+    """
+    Find the time, measure and series columns of a result, if it is a time series.
+
+    The time axis is the first date column, or else an integer column named
+    like a date part (year, month). Measures are the other numeric columns,
+    except keys (*_id), date parts and confidence intervals ("<name> ±").
+    The remaining columns name the lines. A result with more than one row
+    per line and time (grouped by something not in it) is not charted.
+
+    Args:
+        df (pandas.DataFrame): The query results
+        max_measures (int): Most measures charted, one panel each
+
+    Returns:
+        ChartSpec: The chart columns, or None if the result is not a time series
+    """
+    if df is None or len(df) < 2:
+        return None
+
+    time_column = next(
+        (column for column in df.columns if pd.api.types.is_datetime64_any_dtype(df[column])), None
+    )
+    dated = time_column is not None
+    if time_column is None:
+        time_column = next((
+            column for column in df.columns
+            if str(column).lower() in TIME_PART_COLUMNS and pd.api.types.is_integer_dtype(df[column])
+        ), None)
+    if time_column is None or df[time_column].nunique() < 2:
+        return None
+
+    measures, series_columns = [], []
+    for column in df.columns:
+        name = str(column).lower()
+        if column == time_column or name.endswith(' ±') or name in TIME_PART_COLUMNS:
+            continue
+        numeric = pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column])
+        if numeric and not name.endswith('_id'):
+            measures.append(column)
+        else:
+            series_columns.append(column)
+    if not measures:
+        return None
+
+    if df.duplicated(subset=series_columns + [time_column]).any():
+        return None
+    return ChartSpec(time_column, measures[:max_measures], series_columns, dated=dated)
+
+
+def _series_labels(df, series_columns):
+    if not series_columns:
+        return pd.Series([''] * len(df), index=df.index)
+    labels = df[series_columns[0]].astype(str)
+    for column in series_columns[1:]:
+        labels = labels + ' / ' + df[column].astype(str)
+    return labels
+
+
+def chart_data(df, spec, max_points=2000, method='lttb', max_series=10):
+    """
+    Downsampled points of a result in memory, line by line.
+
+    Args:
+        df (pandas.DataFrame): The query results
+        spec (ChartSpec): Its chart columns
+        max_points (int): Most points kept per line
+        method (str): 'lttb' (keeps the shape of lines) or 'minmax' (keeps every peak)
+        max_series (int): Most lines kept, by total of the first measure
+
+    Returns:
+        ChartData: The points to draw
+    """
+    if method not in DOWNSAMPLING_METHODS:
+        raise Exception(f"Неизвестный метод прореживания: {method}")
+    data = df.dropna(subset=[spec.time_column])
+    labels = _series_labels(data, spec.series_columns)
+    totals = data[spec.measures[0]].groupby(labels, sort=False).sum().sort_values(ascending=False)
+
+    parts, total_points = [], 0
+    for name in totals.index[:max_series]:
+        rows = data[labels == name] if len(totals) > 1 else data
+        if not rows[spec.time_column].is_monotonic_increasing:
+            rows = rows.sort_values(spec.time_column, kind='stable')
+        t = rows[spec.time_column].to_numpy()
+        x = _numeric(rows[spec.time_column])
+        for measure in spec.measures:
+            y = rows[measure].to_numpy(dtype=np.float64)
+            present = ~np.isnan(y)
+            total_points += int(present.sum())
+            kept = np.flatnonzero(present)
+            if len(kept) > max_points:
+                if method == 'lttb':
+                    kept = kept[lttb(x[kept], y[kept], max_points)]
+                else:
+                    kept = kept[minmax(x[kept], y[kept], max(max_points // 4, 1))]
+            parts.append(pd.DataFrame({'series': name, 'measure': measure, 't': t[kept], 'y': y[kept]}))
+    points = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=POINT_COLUMNS)
+    return ChartData(points, total_points, len(totals))
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: the points that keep the shape of a line.
+
+    The first and last points are kept; in between, each of threshold - 2
+    equal buckets keeps the point forming the largest triangle with the
+    point kept before it and the average of the next bucket.
+
+    Args:
+        x (numpy.ndarray): Sorted x values as numbers
+        y (numpy.ndarray): The y values
+        threshold (int): Points kept
+
+    Returns:
+        numpy.ndarray: Indices of the kept points, ascending
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        kept[i + 1] = previous
+    return kept
+
+
+def minmax(x, y, buckets):
+    """
+    Min-max downsampling per pixel bucket (M4): of the points falling into
+    each of equal x intervals, the first, the last, the lowest and the
+    highest are kept, so the drawn line covers the same pixels as all points.
+
+    Args:
+        x (numpy.ndarray): Sorted x values as numbers
+        y (numpy.ndarray): The y values
+        buckets (int): Number of x intervals, about the chart width in pixels
+
+    Returns:
+        numpy.ndarray: Indices of the kept points, ascending
+    """
+    n = len(x)
+    if n <= 4 * buckets:
+        return np.arange(n)
+    span = x[-1] - x[0]
+    if span <= 0:
+        index = np.zeros(n, dtype=np.int64)
+    else:
+        index = np.minimum(((x - x[0]) / span * buckets).astype(np.int64), buckets - 1)
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    # Sorted by bucket, then by y: each bucket's first is its lowest point
+    order = np.lexsort((y, index))
+    return np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+
+
+def _numeric(t):
+    """Times as numbers for downsampling: nanoseconds for dates."""
+    if pd.api.types.is_datetime64_any_dtype(t):
+        return t.astype('datetime64[ns]').astype(np.int64).to_numpy(dtype=np.float64)
+    return t.to_numpy(dtype=np.float64)
+
+
+def _quote(column):
+    return '"' + str(column).replace('"', '""') + '"'
+
+
+def m4_sql(sql, spec, buckets=500, max_series=10):
+    """
+    Downsample the whole result of a query in DuckDB, for results larger
+    than what is fetched: the lines with the largest totals of the first
+    measure, min-max downsampled (M4) per x interval.
+
+    Args:
+        sql (str): The query
+        spec (ChartSpec): Chart columns of its result
+        buckets (int): Number of x intervals per line
+        max_series (int): Most lines kept
+
+    Returns:
+        str: Query returning one row per interval of each line with its
+            first, last, lowest and highest points (t_first, y_first, ...),
+            the number of points it stands for (n) and the number of lines
+            in the result (series_count)
+    """
+    sql = sql.strip()
+    if sql.endswith(';'):
+        sql = sql[:-1]
+    time_column = _quote(spec.time_column)
+    if spec.series_columns:
+        series = " || ' / ' || ".join(f"CAST({_quote(column)} AS VARCHAR)" for column in spec.series_columns)
+    else:
+        series = "''"
+    measures = ", ".join(_quote(column) for column in spec.measures)
+    casts = ", ".join(f"CAST({_quote(column)} AS DOUBLE) AS {_quote(column)}" for column in spec.measures)
+    x = f"epoch({time_column})" if spec.dated else f"CAST({time_column} AS DOUBLE)"
+    return f"""
+        WITH result AS (
+            {sql}
+        ),
+        points AS (
+            SELECT {series} AS series, {time_column} AS t, {x} AS x, {casts}
+            FROM result WHERE {time_column} IS NOT NULL
+        ),
+        top_series AS (
+            SELECT series FROM points GROUP BY series
+            ORDER BY SUM({_quote(spec.measures[0])}) DESC NULLS LAST LIMIT {int(max_series)}
+        ),
+        line_points AS (
+            UNPIVOT (SELECT * FROM points WHERE series IN (SELECT series FROM top_series))
+            ON {measures} INTO NAME measure VALUE y
+        ),
+        bounds AS (
+            SELECT MIN(x) AS lo, GREATEST(MAX(x) - MIN(x), 1e-9) AS span FROM points
+        )
+        SELECT
+            series, measure,
+            LEAST(CAST(floor((x - lo) / span * {int(buckets)}) AS INTEGER), {int(buckets) - 1}) AS bucket,
+            MIN(t) AS t_first, arg_min(y, t) AS y_first,
+            MAX(t) AS t_last, arg_max(y, t) AS y_last,
+            arg_min(t, y) AS t_low, MIN(y) AS y_low,
+            arg_max(t, y) AS t_high, MAX(y) AS y_high,
+            COUNT(*) AS n,
+            (SELECT COUNT(DISTINCT series) FROM points) AS series_count
+        FROM line_points, bounds
+        WHERE y IS NOT NULL
+        GROUP BY ALL
+    """
+
+
+def m4_points(df):
+    """
+    Points of the result of m4_sql.
+
+    Args:
+        df (pandas.DataFrame): The result of m4_sql
+
+    Returns:
+        ChartData: Each interval's distinct first, last, lowest and highest points
+    """
+    if len(df) == 0:
+        return ChartData(pd.DataFrame(columns=POINT_COLUMNS), 0, 0)
+    parts = [
+        df[['series', 'measure', f't_{kind}', f'y_{kind}']].set_axis(POINT_COLUMNS, axis=1)
+        for kind in ('first', 'last', 'low', 'high')
+    ]
+    points = pd.concat(parts, ignore_index=True).drop_duplicates()
+    points = points.sort_values(['series', 'measure', 't'], kind='stable').reset_index(drop=True)
+    return ChartData(points, int(df['n'].sum()), int(df['series_count'].iloc[0]))
+
+
+def time_series_figure(points, spec):
+    """
+    Plotly figure of a time series: a panel per measure sharing the time
+    axis, a line per series, drawn with WebGL (Scattergl) so that thousands
+    of points stay interactive.
+
+    Args:
+        points (pandas.DataFrame): Points with POINT_COLUMNS
+        spec (ChartSpec): The chart columns
+
+    Returns:
+        plotly.graph_objects.Figure: The chart
+    """
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+    from plotly.subplots import make_subplots
+
+    measures = [str(measure) for measure in spec.measures]
+    figure = make_subplots(
+        rows=len(measures), cols=1, shared_xaxes=True, vertical_spacing=0.08,
+        subplot_titles=measures if len(measures) > 1 else None,
+    )
+    series = list(dict.fromkeys(points['series']))
+    # A series has the same color in every panel
+    colors = {name: qualitative.Plotly[i % len(qualitative.Plotly)] for i, name in enumerate(series)}
+    for row, measure in enumerate(measures, start=1):
+        for name in series:
+            line = points[(points['series'] == name) & (points['measure'].astype(str) == measure)]
+            if len(line) == 0:
+                continue
+            figure.add_trace(
+                go.Scattergl(
+                    x=line['t'], y=line['y'], mode='lines', name=name or measure,
+                    line={'color': colors[name]}, legendgroup=name, showlegend=row == 1 and bool(name),
+                ),
+                row=row, col=1,
+            )
+    figure.update_layout(
+        height=220 + 200 * len(measures),
+        margin={'l': 10, 'r': 10, 't': 40, 'b': 10},
+        hovermode='x unified',
+        legend={'orientation': 'h'},
+    )
+    if len(measures) == 1:
+        figure.update_yaxes(title_text=measures[0])
+    return figure
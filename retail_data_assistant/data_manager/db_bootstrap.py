@@ -0,0 +1,406 @@
+import json
+import os
+import re
+import logging
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def is_read_only(conn):
+    """True if the connection's database is attached read-only."""
+    return conn.execute(
+        "SELECT readonly FROM duckdb_databases() WHERE database_name = current_database()"
+    ).fetchone()[0]
+
+
+class DatabaseBootstrap:
+    def __init__(self, db_path='retail_data.db', lock_timeout=600, max_shrink=0.5, snapshots_kept=2):
+        """
+        Create the analytics database once, safely across processes.
+
+        Initialization runs under a lock file next to the database, so two
+        workers starting together never build it concurrently. A new
+        database is built under a temporary name and moved into place when
+        complete, then a ready marker is written; an existing database file
+        is therefore always complete and only gets its calendar extended,
+        at most once a day according to the marker, until the first
+        snapshot is published.
+
+        A rebuild never touches the file being read: it loads a new snapshot
+        file next to it, checks its row counts and publishes it through a
+        pointer file, which readers watch to switch to the new snapshot.
+
+        Args:
+            db_path (str): Database file name inside the data directory
+            lock_timeout (int): Seconds after which a lock no longer touched by
+                its holder (a crashed process) is considered stale
+            max_shrink (float): Largest share of rows a table may lose in a rebuild
+            snapshots_kept (int): Snapshot files kept on disk, including the
+                current one, for readers still draining
+        """
+        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+        self.db_name = db_path
+        self.db_file = os.path.join(self.data_dir, db_path)
+        self.lock_file = f"{self.db_file}.lock"
+        self.ready_file = f"{self.db_file}.ready"
+        self.current_pointer = f"{self.db_file}.current"
+        self.lock_timeout = lock_timeout
+        self.max_shrink = max_shrink
+        self.snapshots_kept = snapshots_kept
+        self.error = None
+        self.started_at = None
+        self.ready_at = None
+        self._ready = threading.Event()
+        self._thread = None
+        self.rebuild_error = None
+        self._rebuild_thread = None
+        self._lock_held = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """
+        Run ensure() in a background thread; repeated calls reuse the thread.
+
+        Returns:
+            DatabaseBootstrap: self, for chaining
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-bootstrap", daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """
+        Wait for the database to become ready.
+
+        Args:
+            timeout (float, optional): Seconds to wait, forever if None
+
+        Returns:
+            bool: True if the database is ready
+        """
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        try:
+            self.ensure()
+        except Exception as e:
+            logger.error(f"Database initialization failed: {e}")
+            self.error = e
+
+    def ensure(self):
+        """
+        Create the database if it is missing, otherwise bring the calendar of
+        the initial database up to date (snapshots are left as published).
+        Blocks while another process or thread holds the lock.
+
+        Returns:
+            bool: True once the database is ready
+
+        Raises:
+            Exception: If initialization fails
+        """
+        self.started_at = self.started_at or time.time()
+        if not self._up_to_date():
+            self._acquire_lock()
+            try:
+                if not self._up_to_date():
+                    # Heavy modules (pandas, numpy) are only needed once we get here
+                    from .db_initializer import DBInitializer
+                    if not os.path.exists(self.db_file):
+                        self._build(DBInitializer)
+                    elif self.current_file() == self.db_file:
+                        self._extend_calendar(DBInitializer)
+                    self._write_marker()
+            finally:
+                self._release_lock()
+
+        self.ready_at = time.time()
+        self._ready.set()
+        logger.info(f"Database ready in {self.ready_at - self.started_at:.2f} seconds")
+        return True
+
+    def prepare(self, setup):
+        """
+        Run setup writes (term macros, value catalog, ...) on the initial
+        database through a short-lived connection, so every process can then
+        keep it open read-only. Published snapshots are complete and are
+        never written to.
+
+        Args:
+            setup (callable): Called with a read-write connection
+
+        Returns:
+            bool: False if skipped: a snapshot is published, or another
+                process has the file open and has run the setup already
+        """
+        import duckdb
+
+        if self.current_file() != self.db_file:
+            return False
+        self._acquire_lock()
+        try:
+            try:
+                conn = duckdb.connect(self.db_file)
+            except duckdb.IOException as e:
+                if 'lock' not in str(e).lower():
+                    raise
+                logger.info(f"Database opened by another process, setup skipped: {e}")
+                return False
+            try:
+                setup(conn)
+            finally:
+                conn.close()
+            return True
+        finally:
+            self._release_lock()
+
+    def _extend_calendar(self, initializer_class):
+        """
+        Extend the calendar of the initial database to today. Published
+        snapshots are never written to: each gets its calendar when built,
+        through the end of the next year.
+        """
+        import duckdb
+
+        try:
+            initializer = initializer_class(self.db_name)
+        except duckdb.IOException as e:
+            # Readers of other processes keep the file open; its calendar
+            # runs to the end of the year after it was built
+            if 'lock' not in str(e).lower():
+                raise
+            logger.warning(f"Calendar not extended, the database is open in another process: {e}")
+            return
+        try:
+            initializer.ensure_calendar()
+        finally:
+            initializer.conn.close()
+
+    def _build(self, initializer_class):
+        logger.info("Database does not exist, initializing...")
+        temp_name = f"{self.db_name}.init"
+        self._remove(temp_name)
+
+        initializer = initializer_class(temp_name)
+        try:
+            if not initializer.initialize_database():
+                raise Exception("Не удалось инициализировать базу данных")
+            initializer.conn.execute("CHECKPOINT")
+        finally:
+            initializer.conn.close()
+        os.replace(os.path.join(self.data_dir, temp_name), self.db_file)
+
+    def current_file(self):
+        """
+        The database file readers should open: the published snapshot, or
+        the initial database until the first rebuild.
+
+        Returns:
+            str: Path to the database file
+        """
+        snapshot = self.current_snapshot()
+        if snapshot is not None:
+            path = os.path.join(self.data_dir, snapshot['file'])
+            if os.path.exists(path):
+                return path
+        return self.db_file
+
+    def current_snapshot(self):
+        """
+        The published snapshot.
+
+        Returns:
+            dict: File name, build time and row counts, or None before the first rebuild
+        """
+        try:
+            with open(self.current_pointer, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def rebuilding(self):
+        return self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+
+    def start_rebuild(self):
+        """
+        Run rebuild() in a background thread.
+
+        Returns:
+            bool: False if a rebuild started here is still running
+        """
+        if self.rebuilding:
+            return False
+        self.rebuild_error = None
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"Snapshot rebuild failed: {e}")
+                self.rebuild_error = e
+
+        self._rebuild_thread = threading.Thread(target=run, name="db-rebuild", daemon=True)
+        self._rebuild_thread.start()
+        return True
+
+    def rebuild(self):
+        """
+        Build a new snapshot from the CSV files and publish it.
+
+        The data is loaded into a new file while readers keep using the
+        current one; once its row counts check out, the pointer file is
+        replaced in one step and readers switch on their next check.
+
+        Returns:
+            str: Path to the new snapshot file
+
+        Raises:
+            Exception: If the build or the row count check fails; the current
+                snapshot stays published
+        """
+        from .db_initializer import DBInitializer
+
+        self._acquire_lock()
+        try:
+            start = time.time()
+            stem = os.path.splitext(self.db_name)[0]
+            name = f"{stem}.{datetime.now():%Y%m%d%H%M%S}.db"
+            while os.path.exists(os.path.join(self.data_dir, name)):
+                # Never reuse the name of a snapshot that may be open
+                time.sleep(1)
+                name = f"{stem}.{datetime.now():%Y%m%d%H%M%S}.db"
+            temp_name = f"{name}.init"
+            reference = (self.current_snapshot() or {}).get('row_counts')
+            previous_file = self.current_file()
+            logger.info(f"Building snapshot {name}")
+
+            initializer = DBInitializer(temp_name)
+            try:
+                # Sales rows already sketched in the current snapshot aren't sketched again
+                if not initializer.initialize_database(sketch_seed=previous_file):
+                    raise Exception("Не удалось загрузить данные в новый снимок базы")
+                counts = initializer.validate_row_counts(reference, max_shrink=self.max_shrink)
+                initializer.conn.execute("CHECKPOINT")
+            except Exception:
+                initializer.conn.close()
+                self._remove(temp_name)
+                raise
+            initializer.conn.close()
+            os.replace(os.path.join(self.data_dir, temp_name), os.path.join(self.data_dir, name))
+
+            # Readers only ever see a complete pointer: written aside, then moved into place
+            pointer = {
+                'file': name,
+                'built_at': datetime.now().isoformat(timespec='seconds'),
+                'row_counts': counts,
+            }
+            with open(f"{self.current_pointer}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(pointer, f)
+            os.replace(f"{self.current_pointer}.tmp", self.current_pointer)
+            self._write_marker()
+            self._prune(stem, name)
+            logger.info(f"Snapshot {name} published in {time.time() - start:.2f} seconds")
+            return os.path.join(self.data_dir, name)
+        finally:
+            self._release_lock()
+
+    def _prune(self, stem, current):
+        """Remove old snapshot files beyond snapshots_kept; readers drain well before that."""
+        pattern = re.compile(rf"^{re.escape(stem)}\.\d{{14}}\.db$")
+        snapshots = sorted(name for name in os.listdir(self.data_dir) if pattern.match(name))
+        for name in snapshots[:-self.snapshots_kept]:
+            if name != current:
+                self._remove(name)
+                logger.info(f"Removed old snapshot {name}")
+
+    def _remove(self, name):
+        for leftover in (name, f"{name}.wal"):
+            try:
+                os.remove(os.path.join(self.data_dir, leftover))
+            except OSError:
+                pass
+
+    def _up_to_date(self):
+        """True if the database exists and its calendar was checked today."""
+        if not os.path.exists(self.db_file):
+            return False
+        try:
+            with open(self.ready_file, 'r', encoding='utf-8') as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return marker.get('calendar_date') == date.today().isoformat()
+
+    def _write_marker(self):
+        with open(self.ready_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'ready_at': datetime.now().isoformat(timespec='seconds'),
+                'calendar_date': date.today().isoformat(),
+                'pid': os.getpid(),
+            }, f)
+
+    def _acquire_lock(self):
+        """Take the lock file, waiting as long as its holder keeps it fresh."""
+        token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        while True:
+            try:
+                fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, token.encode())
+                os.close(fd)
+                self._hold_lock(token)
+                return
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(self.lock_file)
+                except OSError:
+                    continue
+                if age > self.lock_timeout:
+                    logger.warning(f"Removing stale database lock {self.lock_file}")
+                    try:
+                        os.remove(self.lock_file)
+                    except OSError:
+                        pass
+                    continue
+                time.sleep(0.1)
+
+    def _hold_lock(self, token):
+        """
+        Touch the lock file while it is held, so a build longer than
+        lock_timeout never looks stale; the lock of a crashed process stops
+        being touched and goes stale.
+        """
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lock_timeout / 4):
+                try:
+                    os.utime(self.lock_file)
+                except OSError:
+                    return
+
+        threading.Thread(target=heartbeat, name="db-lock-heartbeat", daemon=True).start()
+        self._lock_held = (token, stop)
+
+    def _release_lock(self):
+        token, stop = self._lock_held
+        self._lock_held = None
+        stop.set()
+        # A lock taken over as stale belongs to another process now
+        try:
+            with open(self.lock_file, 'r', encoding='utf-8') as f:
+                owned = f.read() == token
+            if owned:
+                os.remove(self.lock_file)
+        except OSError:
+            pass
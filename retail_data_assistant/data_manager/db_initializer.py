@@ -5,15 +5,50 @@ import logging
 from datetime import datetime, timedelta
 import numpy as np
 import random
+from .term_macros import TermMacroRegistry
+from .value_catalog import ValueCatalog
+from .sampling import FactSample
+from .sketches import DistinctSketches
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Russian public holidays (fixed dates, month/day -> name).
+# Government-decreed day transfers are published yearly and are not modelled here.
+RUSSIAN_HOLIDAYS = {
+    (1, 1): 'Новогодние каникулы',
+    (1, 2): 'Новогодние каникулы',
+    (1, 3): 'Новогодние каникулы',
+    (1, 4): 'Новогодние каникулы',
+    (1, 5): 'Новогодние каникулы',
+    (1, 6): 'Новогодние каникулы',
+    (1, 7): 'Рождество Христово',
+    (1, 8): 'Новогодние каникулы',
+    (2, 23): 'День защитника Отечества',
+    (3, 8): 'Международный женский день',
+    (5, 1): 'Праздник Весны и Труда',
+    (5, 9): 'День Победы',
+    (6, 12): 'День России',
+    (11, 4): 'День народного единства',
+}
+
+MONTH_NAMES = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+               'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+
+DAY_NAMES = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+# Tables loaded from the CSV files in the data directory, in load order
+SOURCE_TABLES = ['stores', 'categories', 'subcategories', 'suppliers', 'products',
+                 'customers', 'promotions', 'sales', 'inventory']
+
 class DBInitializer:
-    def __init__(self, db_path='retail_data.db'):
+    def __init__(self, db_path='retail_data.db', fiscal_year_start_month=1):
         """Initialize the database."""
         self.db_path = db_path
+        self.fiscal_year_start_month = fiscal_year_start_month
+        # Rows read from each CSV file by the last load
+        self.source_counts = {}
         self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
         
         # Ensure data directory exists
@@ -24,8 +59,15 @@ class DBInitializer:
         self.conn = duckdb.connect(os.path.join(self.data_dir, db_path))
         logger.info(f"Connected to database at {self.data_dir}/{db_path}")
         
-    def initialize_database(self):
-        """Initialize the database structure and load sample data."""
+    def initialize_database(self, sketch_seed=None):
+        """
+        Initialize the database structure and load sample data.
+        
+        Args:
+            sketch_seed (str, optional): Database file (the previous snapshot)
+                whose distinct count sketches are reused, so only new sales
+                rows are sketched
+        """
         try:
             # Create tables
             self._create_tables()
@@ -36,6 +78,21 @@ class DBInitializer:
             # Load data into database
             self._load_data_to_db()
             
+            # Generate or extend the calendar dimension
+            self.ensure_calendar()
+            
+            # Compile business terms into macros
+            self.ensure_term_macros()
+            
+            # Catalog of categorical values, rescanned only where data changed
+            self.refresh_value_catalog()
+            
+            # Sample of the fact table for approximate previews
+            self.refresh_fact_sample()
+            
+            # Distinct count sketches, extended with the sales rows loaded since
+            self.refresh_distinct_sketches(seed_path=sketch_seed)
+            
             logger.info("Database initialization completed successfully")
             return True
         except Exception as e:
@@ -165,6 +222,58 @@ class DBInitializer:
                 )
             """)
             
+            # Create calendar dimension table
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS calendar_days (
+                    date DATE PRIMARY KEY,
+                    day_of_month INTEGER,
+                    day_of_week INTEGER,
+                    day_name TEXT,
+                    is_weekend BOOLEAN,
+                    is_holiday BOOLEAN,
+                    holiday_name TEXT,
+                    is_working_day BOOLEAN,
+                    iso_year INTEGER,
+                    iso_week INTEGER,
+                    week_start DATE,
+                    month INTEGER,
+                    month_name TEXT,
+                    month_start DATE,
+                    month_end DATE,
+                    quarter INTEGER,
+                    quarter_start DATE,
+                    year INTEGER,
+                    year_month TEXT,
+                    fiscal_year INTEGER,
+                    fiscal_quarter INTEGER,
+                    fiscal_month INTEGER
+                )
+            """)
+            
+            # Relative flags depend on CURRENT_DATE, so they live in a view
+            # and never go stale between database loads
+            self.conn.execute("""
+                CREATE OR REPLACE VIEW calendar AS
+                SELECT
+                    d.*,
+                    d.date = CURRENT_DATE AS is_today,
+                    d.date = CURRENT_DATE - 1 AS is_yesterday,
+                    d.date BETWEEN CURRENT_DATE - 6 AND CURRENT_DATE AS is_last_7_days,
+                    d.date BETWEEN CURRENT_DATE - 29 AND CURRENT_DATE AS is_last_30_days,
+                    d.week_start = date_trunc('week', CURRENT_DATE) AS is_current_week,
+                    d.week_start = date_trunc('week', CURRENT_DATE) - INTERVAL 7 DAY AS is_last_completed_week,
+                    d.month_start = date_trunc('month', CURRENT_DATE) AS is_current_month,
+                    d.month_start = date_trunc('month', CURRENT_DATE) - INTERVAL 1 MONTH AS is_last_completed_month,
+                    d.quarter_start = date_trunc('quarter', CURRENT_DATE) AS is_current_quarter,
+                    d.quarter_start = date_trunc('quarter', CURRENT_DATE) - INTERVAL 3 MONTH AS is_last_completed_quarter,
+                    d.year = year(CURRENT_DATE) AS is_current_year,
+                    d.year = year(CURRENT_DATE) - 1 AS is_last_year,
+                    d.date <= CURRENT_DATE AND d.year = year(CURRENT_DATE) AS is_year_to_date,
+                    CURRENT_DATE - d.date AS days_ago,
+                    datediff('month', d.month_start, date_trunc('month', CURRENT_DATE)) AS months_ago
+                FROM calendar_days d
+            """)
+            
             logger.info("All tables created successfully")
             
         except Exception as e:
@@ -552,61 +661,204 @@ class DBInitializer:
                 
         return pd.DataFrame(inventory)
     
+    def _generate_calendar_data(self, start_date, end_date):
+        """Generate calendar dimension rows for every day in [start_date, end_date]."""
+        dates = pd.date_range(start_date, end_date, freq='D')
+        if len(dates) == 0:
+            return pd.DataFrame()
+        
+        iso = dates.isocalendar()
+        holiday_names = [RUSSIAN_HOLIDAYS.get((d.month, d.day)) for d in dates]
+        is_holiday = np.array([name is not None for name in holiday_names])
+        is_weekend = dates.dayofweek >= 5
+        
+        # Fiscal periods are shifted by the month the fiscal year starts in;
+        # the fiscal year is named after the calendar year it ends in
+        fiscal_offset = (dates.month - self.fiscal_year_start_month) % 12
+        fiscal_year = dates.year + ((dates.month >= self.fiscal_year_start_month) & (self.fiscal_year_start_month > 1))
+        
+        data = {
+            'date': dates.date,
+            'day_of_month': dates.day,
+            'day_of_week': dates.dayofweek + 1,
+            'day_name': [DAY_NAMES[d] for d in dates.dayofweek],
+            'is_weekend': is_weekend,
+            'is_holiday': is_holiday,
+            'holiday_name': holiday_names,
+            'is_working_day': ~is_weekend & ~is_holiday,
+            'iso_year': iso['year'].to_numpy(dtype=int),
+            'iso_week': iso['week'].to_numpy(dtype=int),
+            'week_start': (dates - pd.to_timedelta(dates.dayofweek, unit='D')).date,
+            'month': dates.month,
+            'month_name': [MONTH_NAMES[m - 1] for m in dates.month],
+            'month_start': dates.to_period('M').start_time.date,
+            'month_end': dates.to_period('M').end_time.date,
+            'quarter': dates.quarter,
+            'quarter_start': dates.to_period('Q').start_time.date,
+            'year': dates.year,
+            'year_month': dates.strftime('%Y-%m'),
+            'fiscal_year': fiscal_year,
+            'fiscal_quarter': fiscal_offset // 3 + 1,
+            'fiscal_month': fiscal_offset + 1
+        }
+        return pd.DataFrame(data)
+    
+    def ensure_calendar(self):
+        """
+        Make sure the calendar dimension covers all dates present in the data.
+        
+        The calendar spans from the start of the year before the earliest
+        sale or promotion to the end of the year after the latest one (or
+        today, whichever is later). Missing days on either side are appended,
+        so the table is extended rather than rebuilt on every load.
+        """
+        try:
+            # Older database files may predate the calendar table
+            self._create_tables()
+            
+            data_min, data_max = self.conn.execute("""
+                SELECT MIN(d), MAX(d) FROM (
+                    SELECT sale_date AS d FROM sales
+                    UNION ALL SELECT start_date FROM promotions
+                    UNION ALL SELECT end_date FROM promotions
+                    UNION ALL SELECT CURRENT_DATE
+                )
+            """).fetchone()
+            required_start = datetime(data_min.year - 1, 1, 1).date()
+            required_end = datetime(data_max.year + 1, 12, 31).date()
+            
+            existing_min, existing_max = self.conn.execute(
+                "SELECT MIN(date), MAX(date) FROM calendar_days"
+            ).fetchone()
+            
+            if existing_min is None:
+                ranges = [(required_start, required_end)]
+            else:
+                ranges = []
+                if required_start < existing_min:
+                    ranges.append((required_start, existing_min - timedelta(days=1)))
+                if required_end > existing_max:
+                    ranges.append((existing_max + timedelta(days=1), required_end))
+            
+            for start_date, end_date in ranges:
+                calendar_df = self._generate_calendar_data(start_date, end_date)
+                self.conn.execute("INSERT INTO calendar_days SELECT * FROM calendar_df")
+                logger.info(f"Calendar extended with {len(calendar_df)} days ({start_date} - {end_date})")
+            
+        except Exception as e:
+            logger.error(f"Error generating calendar: {e}")
+            raise
+    
+    def ensure_term_macros(self):
+        """
+        Create or update the DuckDB macros compiled from dictionary.json.
+        
+        Returns:
+            list: The compiled TermMacro objects
+        """
+        return TermMacroRegistry(self.conn).sync(force=True)
+    
+    def refresh_value_catalog(self):
+        """
+        Update the catalog of categorical column values after a load.
+        
+        Returns:
+            list: (table, column) pairs whose values were recomputed
+        """
+        return ValueCatalog(self.conn).refresh()
+    
+    def refresh_fact_sample(self):
+        """
+        Rebuild the sample of the sales table for previews if the table changed.
+        
+        Returns:
+            bool: True if the sample was rebuilt
+        """
+        return FactSample(self.conn).refresh()
+    
+    def refresh_distinct_sketches(self, seed_path=None):
+        """
+        Sketch the sales rows loaded since the sketches were last updated.
+        
+        Args:
+            seed_path (str, optional): Database file whose sketches are copied
+                first if this database has none
+        
+        Returns:
+            int: Sales rows sketched
+        """
+        return DistinctSketches(self.conn).refresh(seed_path=seed_path)
+    
     def _load_data_to_db(self):
-        """Load the generated data into the database."""
+        """
+        Load the generated data into the database.
+        
+        All tables are replaced in one transaction, so a connection reading
+        the database meanwhile sees either the old data or the new, never
+        half-loaded tables.
+        """
         try:
-            # Load stores data
-            stores_df = pd.read_csv(os.path.join(self.data_dir, 'stores.csv'))
-            self.conn.execute("DELETE FROM stores")
-            self.conn.execute("INSERT INTO stores SELECT * FROM stores_df")
-            
-            # Load categories data
-            categories_df = pd.read_csv(os.path.join(self.data_dir, 'categories.csv'))
-            self.conn.execute("DELETE FROM categories")
-            self.conn.execute("INSERT INTO categories SELECT * FROM categories_df")
-            
-            # Load subcategories data
-            subcategories_df = pd.read_csv(os.path.join(self.data_dir, 'subcategories.csv'))
-            self.conn.execute("DELETE FROM subcategories")
-            self.conn.execute("INSERT INTO subcategories SELECT * FROM subcategories_df")
-            
-            # Load suppliers data
-            suppliers_df = pd.read_csv(os.path.join(self.data_dir, 'suppliers.csv'))
-            self.conn.execute("DELETE FROM suppliers")
-            self.conn.execute("INSERT INTO suppliers SELECT * FROM suppliers_df")
-            
-            # Load products data
-            products_df = pd.read_csv(os.path.join(self.data_dir, 'products.csv'))
-            self.conn.execute("DELETE FROM products")
-            self.conn.execute("INSERT INTO products SELECT * FROM products_df")
-            
-            # Load customers data
-            customers_df = pd.read_csv(os.path.join(self.data_dir, 'customers.csv'))
-            self.conn.execute("DELETE FROM customers")
-            self.conn.execute("INSERT INTO customers SELECT * FROM customers_df")
-            
-            # Load promotions data
-            promotions_df = pd.read_csv(os.path.join(self.data_dir, 'promotions.csv'))
-            self.conn.execute("DELETE FROM promotions")
-            self.conn.execute("INSERT INTO promotions SELECT * FROM promotions_df")
-            
-            # Load sales data
-            sales_df = pd.read_csv(os.path.join(self.data_dir, 'sales.csv'))
-            self.conn.execute("DELETE FROM sales")
-            self.conn.execute("INSERT INTO sales SELECT * FROM sales_df")
-            
-            # Load inventory data
-            inventory_df = pd.read_csv(os.path.join(self.data_dir, 'inventory.csv'))
-            self.conn.execute("DELETE FROM inventory")
-            self.conn.execute("INSERT INTO inventory SELECT * FROM inventory_df")
+            self.conn.execute("BEGIN TRANSACTION")
+            for table in SOURCE_TABLES:
+                df = pd.read_csv(os.path.join(self.data_dir, f'{table}.csv'))
+                self.conn.execute(f"DELETE FROM {table}")
+                self.conn.execute(f"INSERT INTO {table} SELECT * FROM df")
+                self.source_counts[table] = len(df)
+            self.conn.execute("COMMIT")
             
             logger.info("All data loaded into database successfully")
             
         except Exception as e:
+            self.conn.execute("ROLLBACK")
             logger.error(f"Error loading data into database: {e}")
             raise
+    
+    def row_counts(self):
+        """
+        Count the rows of the loaded tables and the calendar.
+        
+        Returns:
+            dict: Row count per table
+        """
+        return {
+            table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in SOURCE_TABLES + ['calendar_days']
+        }
+    
+    def validate_row_counts(self, reference=None, max_shrink=0.5):
+        """
+        Check a freshly built database before readers are switched to it.
+        
+        Every table must hold exactly the rows read from its CSV file and
+        none may be empty; with a reference, no table may lose more than
+        max_shrink of its rows, which catches truncated source files.
+        
+        Args:
+            reference (dict, optional): Row counts of the database being replaced
+            max_shrink (float): Largest allowed share of lost rows per table
+            
+        Returns:
+            dict: Row count per table
+            
+        Raises:
+            Exception: If a table fails a check
+        """
+        counts = self.row_counts()
+        problems = []
+        for table, count in counts.items():
+            if count == 0:
+                problems.append(f"{table}: нет строк")
+            elif table in self.source_counts and count != self.source_counts[table]:
+                problems.append(f"{table}: {count} строк вместо {self.source_counts[table]} из CSV")
+            elif reference and reference.get(table) and count < reference[table] * (1 - max_shrink):
+                problems.append(f"{table}: {count} строк, было {reference[table]}")
+        if problems:
+            raise Exception(f"Проверка количества строк не пройдена: {'; '.join(problems)}")
+        logger.info(f"Row counts validated: {counts}")
+        return counts
 
 if __name__ == "__main__":
-    # If run directly, initialize the database
-    initializer = DBInitializer()
-    initializer.initialize_database() 
\ No newline at end of file
+    # If run directly, build a new snapshot and switch running readers to it
+    from .db_bootstrap import DatabaseBootstrap
+    from utils.config import DB_PATH, SNAPSHOT_MAX_SHRINK, SNAPSHOTS_KEPT
+    DatabaseBootstrap(DB_PATH, max_shrink=SNAPSHOT_MAX_SHRINK, snapshots_kept=SNAPSHOTS_KEPT).rebuild()
@@ -0,0 +1,113 @@
+import re
+import json
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Wording of questions that ask for several things at once: comparisons and
+# "X, and Y about them". Other questions skip the decomposition LLM call.
+COMPOUND_MARKERS = re.compile(
+    r"\b(сравни\w*|сопостав\w*|по сравнению|в сравнении|против|vs|versus|а также|плюс|"
+    r"и что|и как\w*|и сколько|и где|и кто|и чем|а что|а как\w*)\b",
+    re.IGNORECASE,
+)
+
+_NAME = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def looks_compound(question):
+    """
+    Whether a question may split into independent sub-queries.
+
+    Args:
+        question (str): The question in natural language
+
+    Returns:
+        bool: True if it has the wording of a compound question
+    """
+    return bool(COMPOUND_MARKERS.search(question))
+
+
+class SubQuery:
+    """An independent part of a decomposed question, named for the combining query."""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+
+    def to_dict(self):
+        return {'name': self.name, 'sql': self.sql}
+
+
+class DecomposedQuery:
+    def __init__(self, subqueries, combine_sql):
+        """
+        A question answered by independent sub-queries run in parallel,
+        whose results are joined locally by a combining query that reads
+        them by name.
+
+        Args:
+            subqueries (list): SubQuery objects
+            combine_sql (str): Query over the sub-query results
+        """
+        self.subqueries = subqueries
+        self.combine_sql = combine_sql
+
+    def as_single_sql(self):
+        """The same question as one query with the sub-queries as CTEs."""
+        ctes = ",\n".join(f"{sub.name} AS (\n{sub.sql}\n)" for sub in self.subqueries)
+        return f"WITH {ctes}\n{self.combine_sql}"
+
+    def to_dict(self):
+        return {
+            'subqueries': [sub.to_dict() for sub in self.subqueries],
+            'combine': self.combine_sql,
+        }
+
+
+def _strip(sql):
+    sql = sql.strip()
+    return sql[:-1].rstrip() if sql.endswith(';') else sql
+
+
+def parse_decomposition(content, max_subqueries=4):
+    """
+    Read the LLM's decomposition of a question.
+
+    Args:
+        content (str): JSON with "subqueries" ([{"name", "sql"}]) and
+            "combine", or {"single": true}
+        max_subqueries (int): Most sub-queries accepted
+
+    Returns:
+        DecomposedQuery: The decomposition, or None if the question is
+            answered better by one query or the answer is malformed
+    """
+    try:
+        plan = json.loads(content)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Decomposition is not valid JSON: {e}")
+        return None
+    if not isinstance(plan, dict) or plan.get('single'):
+        return None
+
+    subqueries = []
+    for item in plan.get('subqueries') or []:
+        if not isinstance(item, dict):
+            logger.warning(f"Invalid sub-query in decomposition: {item}")
+            return None
+        name = str(item.get('name', '')).strip().lower()
+        sql = _strip(str(item.get('sql', '')))
+        if not _NAME.match(name) or not sql or name in {sub.name for sub in subqueries}:
+            logger.warning(f"Invalid sub-query in decomposition: {item}")
+            return None
+        subqueries.append(SubQuery(name, sql))
+    combine_sql = _strip(str(plan.get('combine') or ''))
+
+    if not 2 <= len(subqueries) <= max_subqueries or not combine_sql:
+        logger.info(f"Decomposition not used: {len(subqueries)} sub-queries")
+        return None
+    return DecomposedQuery(subqueries, combine_sql)
+
@@ -0,0 +1,128 @@
+import json
+import os
+import re
+import logging
+import threading
+import time
+from datetime import date
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metadata", "query_examples.json")
+
+
+def question_key(question):
+    """Normalize a question for lookup: case, ё, punctuation and spacing are ignored."""
+    text = question.lower().replace('ё', 'е')
+    return " ".join(re.sub(r"[^\w\s-]", " ", text).split())
+
+
+class WarmExample:
+    """A query example with its prepared SQL and precomputed result."""
+
+    def __init__(self, question, sql, results, elapsed):
+        self.question = question
+        self.sql = sql
+        self.results = results
+        # Seconds the query took during warmup
+        self.elapsed = elapsed
+
+
+class ExampleWarmer:
+    def __init__(self, query_executor, examples_path=EXAMPLES_PATH):
+        """
+        Answer the sidebar example questions from query_examples.json without the LLM.
+
+        At startup each example's SQL is prepared and executed once, which
+        also warms DuckDB's buffer pool; the results are kept and served
+        directly when the example is asked. They are recomputed when the
+        data changes (after a load) or the day changes, since the examples
+        use relative periods.
+
+        Args:
+            query_executor (data_manager.query_executor.QueryExecutor): Executes the examples
+            examples_path (str): Path to query_examples.json
+        """
+        self.query_executor = query_executor
+        self.examples_path = examples_path
+        self.examples = {}
+        self.ready = False
+        self._version = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Warm up in a background thread so the UI is not blocked."""
+        thread = threading.Thread(target=self.warm, name="example-warmer", daemon=True)
+        thread.start()
+        return thread
+
+    def warm(self):
+        """
+        Prepare and run every example query, keeping the results.
+
+        Returns:
+            int: Number of examples warmed
+        """
+        with self._lock:
+            start = time.time()
+            version = self._data_version()
+            try:
+                with open(self.examples_path, 'r', encoding='utf-8') as f:
+                    examples = json.load(f).get('examples', [])
+            except (OSError, ValueError) as e:
+                logger.error(f"Query examples not loaded: {e}")
+                return 0
+
+            warmed = {}
+            for example in examples:
+                sql = example['sql'].strip().rstrip(';')
+                example_start = time.time()
+                try:
+                    results = self.query_executor.execute_prepared(sql, {})
+                except Exception as e:
+                    logger.warning(f"Example '{example['question']}' not warmed: {e}")
+                    continue
+                warmed[question_key(example['question'])] = WarmExample(
+                    example['question'], sql, results, time.time() - example_start
+                )
+
+            self.examples = warmed
+            self._version = version
+            self.ready = True
+        logger.info(f"Warmed {len(warmed)} of {len(examples)} query examples in {time.time() - start:.2f} seconds")
+        return len(warmed)
+
+    def lookup(self, question):
+        """
+        Return the precomputed answer to an example question.
+
+        Args:
+            question (str): The question in natural language
+
+        Returns:
+            WarmExample: The example with its results, or None if the question
+                is not an example or the warmup has not finished yet
+        """
+        if not self.ready:
+            return None
+        example = self.examples.get(question_key(question))
+        if example is None:
+            return None
+        if self._data_version() != self._version:
+            logger.info("Data changed since warmup, recomputing query examples")
+            self.warm()
+            example = self.examples.get(question_key(question))
+        return example
+
+    def _data_version(self):
+        """Snapshot file, sales row count and last id plus today's date; changes after every load."""
+        cursor = self.query_executor.reader.cursor()
+        try:
+            count, last_id = cursor.execute("SELECT COUNT(*), MAX(sale_id) FROM sales").fetchone()
+        except Exception:
+            count, last_id = None, None
+        finally:
+            cursor.close()
+        return self.query_executor.db_path, count, last_id, date.today()
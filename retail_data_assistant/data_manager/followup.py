@@ -0,0 +1,115 @@
+import re
+import json
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Name under which the previous result is queried
+PREVIOUS_RESULT = 'previous_result'
+
+# Wording of refinements of the previous question: they start with "а",
+# "но" or "теперь", or refer to the previous result ("из них", "этих").
+# Generic leading words ("топ", "только", "без") start standalone questions
+# as well, so other questions are planned on their own without the
+# follow-up LLM call.
+FOLLOWUP_START = re.compile(r"^\s*(а|но|теперь)\b", re.IGNORECASE)
+FOLLOWUP_REFERENCES = re.compile(
+    r"\b(из них|среди них|для них|по ним|у них|из этого|из этих|этих|эти|тех же|то же самое|"
+    r"так же|предыдущ\w* (?:результат|ответ|вопрос|запрос)\w*)\b",
+    re.IGNORECASE,
+)
+
+
+def looks_followup(question):
+    """
+    Whether a question may refine the previous one.
+
+    Args:
+        question (str): The question in natural language
+
+    Returns:
+        bool: True if it has the wording of a follow-up
+    """
+    return bool(FOLLOWUP_START.search(question) or FOLLOWUP_REFERENCES.search(question))
+
+
+class ResultContext:
+    def __init__(self, question, sql, results, complete=True):
+        """
+        A previous answer that follow-up questions may refine.
+
+        Args:
+            question (str): The previous question
+            sql (str): SQL that answered it
+            results (pyarrow.Table or pandas.DataFrame): Its results
+            complete (bool): False when the results were cut at the row
+                limit, so they can't answer filters and sorts on their own
+        """
+        import pyarrow as pa
+
+        self.question = question
+        self.sql = sql
+        if not isinstance(results, pa.Table):
+            results = pa.Table.from_pandas(results, preserve_index=False)
+        self.results = results
+        self.complete = complete
+
+    def describe(self, sample_rows=5):
+        """
+        Describe the results for the LLM: row count, columns and first rows.
+
+        Args:
+            sample_rows (int): Rows shown
+
+        Returns:
+            str: The description
+        """
+        columns = "\n".join(f"- {field.name} ({field.type})" for field in self.results.schema)
+        rows = "\n".join(
+            json.dumps(row, ensure_ascii=False, default=str)
+            for row in self.results.slice(0, sample_rows).to_pylist()
+        )
+        return f"Строк: {self.results.num_rows}\nКолонки:\n{columns}\nПервые строки:\n{rows}"
+
+
+class FollowUp:
+    """The LLM's reading of a follow-up: the standalone question and, if the previous result answers it, SQL over it."""
+
+    def __init__(self, question, sql=None):
+        self.question = question
+        self.sql = sql
+
+
+def _strip(sql):
+    sql = sql.strip()
+    return sql[:-1].rstrip() if sql.endswith(';') else sql
+
+
+def parse_followup(content, user_query):
+    """
+    Read the LLM's answer to a follow-up question.
+
+    Args:
+        content (str): JSON with "question" (the follow-up as a standalone
+            question) and "sql" (query over the previous result, or null)
+        user_query (str): The follow-up as asked, used when the answer has no question
+
+    Returns:
+        FollowUp: The follow-up, or None if the answer is malformed
+    """
+    try:
+        answer = json.loads(content)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Follow-up answer is not valid JSON: {e}")
+        return None
+    if not isinstance(answer, dict):
+        logger.warning(f"Invalid follow-up answer: {answer}")
+        return None
+
+    question = answer.get('question')
+    question = question.strip() if isinstance(question, str) and question.strip() else user_query
+    sql = answer.get('sql')
+    sql = _strip(sql) if isinstance(sql, str) and sql.strip() else None
+    return FollowUp(question, sql)
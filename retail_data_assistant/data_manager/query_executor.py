@@ -1,43 +1,338 @@
-import pandas as pd
 import duckdb
 import os
+import re
 import logging
 import time
-from .db_initializer import DBInitializer
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import date, datetime
+from .db_bootstrap import DatabaseBootstrap
+from .sql_validator import SQLValidator, SQLValidationError, check_statement
+from .sql_rewriter import SQLRewriter
+from .term_macros import TermMacroRegistry
+from .value_catalog import ValueCatalog
+from .sandbox import SandboxPool
+from .snapshot import Snapshot, SnapshotConnection
+from .sampling import FactSample, PreviewRewriter, Preview
+from .sketches import DistinctSketches
+from .resource_governor import QueryRejected
+from utils.metrics import QueryMetrics
+from utils.single_flight import SingleFlight, sql_key
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+def sql_literal(value):
+    """
+    Render a Python value as a DuckDB SQL literal.
+    
+    Args:
+        value: None, bool, int, float, str, date, datetime or a list of these
+        
+    Returns:
+        str: The SQL literal
+    """
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime):
+        return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+    if isinstance(value, date):
+        return f"DATE '{value.isoformat()}'"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(sql_literal(item) for item in value) + "]"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def inline_params(query, params):
+    """
+    Substitute named parameters ($name) of a query with SQL literals.
+    
+    Args:
+        query (str): SQL with named parameters
+        params (dict): Parameter values by name
+        
+    Returns:
+        str: The SQL with literal values
+    """
+    # Longest names first, so $store is not replaced inside $store_id
+    for name in sorted(params, key=len, reverse=True):
+        query = query.replace(f"${name}", sql_literal(params[name]))
+    return query
+
+
+# Row limit at the end of a query, outside any subquery
+TRAILING_LIMIT = re.compile(r"\s+LIMIT\s+(\d+)\s*;?\s*$", re.IGNORECASE)
+
+
+def without_row_limit(query, max_rows):
+    """
+    The whole result of a query whose rows were cut at the row limit.
+    
+    A trailing LIMIT of max_rows or more only caps the rows fetched (the
+    LLM is asked to add one, and specs default to it), so it is dropped;
+    a smaller one is the question's own top-N.
+    
+    Args:
+        query (str): SQL with literal values
+        max_rows (int): Row limit of the executor
+        
+    Returns:
+        str: The query without its row limit, or None if its LIMIT is a top-N
+    """
+    match = TRAILING_LIMIT.search(query)
+    if match is None:
+        return query
+    if int(match.group(1)) < max_rows:
+        return None
+    return query[:match.start()]
+
+
 class QueryExecutor:
-    def __init__(self, db_path='retail_data.db'):
-        """Initialize the query executor with a connection to the database."""
+    def __init__(self, db_path='retail_data.db', profiler=None, max_estimated_cost=10_000_000,
+                 prepared_cache_size=128, coalesce=True, sandbox_workers=0, sandbox_memory_limit="1GB",
+                 sandbox_threads=2, governor=None, drain_timeout=60, sample_percent=1, sample_min_rows=1_000_000,
+                 exact_workers=2, sketch_precision=12):
+        """
+        Initialize the query executor with a connection to the database.
+        
+        Args:
+            db_path (str): Database file name inside the data directory
+            profiler (QueryProfiler, optional): When set, queries are profiled by default
+            max_estimated_cost (int): Cost threshold for the EXPLAIN-based dry run
+            prepared_cache_size (int): Number of prepared statements kept for reuse
+            coalesce (bool): Share one execution between identical queries running concurrently
+            sandbox_workers (int): Worker processes for execute_query; 0 runs queries in this process
+            sandbox_memory_limit (str): DuckDB memory limit of each worker process
+            sandbox_threads (int): DuckDB threads of each worker process
+            governor (ResourceGovernor, optional): Classifies queries by estimated
+                cost and admits them by class; without it every query gets the
+                default timeout and no admission control
+            drain_timeout (float): Seconds queries on a replaced snapshot may
+                keep running before its connection is closed
+            sample_percent (float): Size of the sales sample for previews, percent of the table
+            sample_min_rows (int): Smallest sales table that gets a sample
+            exact_workers (int): Threads running the exact queries behind previews
+            sketch_precision (int): Precision of the distinct count sketches
+                (2^precision registers each)
+        """
         self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
-        self.db_path = os.path.join(self.data_dir, db_path)
         
-        # Initialize database if it doesn't exist
-        if not os.path.exists(self.db_path):
-            logger.info("Database does not exist, initializing...")
-            initializer = DBInitializer(db_path)
-            initializer.initialize_database()
+        # Create the database if it doesn't exist (once across processes),
+        # otherwise extend the calendar of the initial database to today
+        self.bootstrap = DatabaseBootstrap(db_path)
+        self.bootstrap.ensure()
+        self.db_path = self.bootstrap.current_file()
         
-        # Create or connect to the database
-        self.conn = duckdb.connect(self.db_path)
+        # The database is only ever read: other processes (the API service,
+        # sandbox workers) can open it read-only, which DuckDB allows only
+        # while no process has it open for writing. Pending writes to the
+        # initial database (term macros, value catalog) go through a
+        # short-lived connection; a published snapshot is complete already
+        def setup(setup_conn):
+            TermMacroRegistry(setup_conn).sync(force=True)
+            ValueCatalog(setup_conn).refresh()
+            FactSample(setup_conn, percent=sample_percent, min_rows=sample_min_rows).refresh()
+            DistinctSketches(setup_conn, precision=sketch_precision).refresh()
+        
+        self.bootstrap.prepare(setup)
+        self._snapshot = Snapshot(self.db_path, duckdb.connect(self.db_path, read_only=True))
+        self.drain_timeout = drain_timeout
+        self._switch_lock = threading.Lock()
+        self._switch_listeners = []
         logger.info(f"Connected to database at {self.db_path}")
         
+        # Components below open a cursor per call from this view, which
+        # always reads the current snapshot and keeps it open meanwhile
+        self.reader = SnapshotConnection(lambda: self._snapshot)
+        
+        # Process-wide DuckDB budget and spill directory
+        self.governor = governor
+        if governor is not None:
+            governor.configure(self.conn)
+        
         # Configure statement timeouts (DuckDB doesn't support direct query timeouts,
         # but we'll implement a timeout mechanism in execute_query)
         self.query_timeout_seconds = 10
         
         # Limit on returned rows
         self.max_rows = 1000
+        
+        # Dry-run validation of generated SQL before execution
+        self.validator = SQLValidator(self.reader, max_estimated_cost=max_estimated_cost)
+        
+        # Static analysis and safe rewrites of expensive SQL patterns
+        self.rewriter = SQLRewriter(self.reader)
+        
+        # Business terms from dictionary.json as DuckDB macros, recompiled
+        # when the dictionary changes
+        self.term_macros = TermMacroRegistry(self.reader)
+        self.term_macros.sync(force=True)
+        self._macros_rebuild_mtime = None
+        
+        # Distinct values of categorical columns for resolving user phrases
+        self.value_catalog = ValueCatalog(self.reader)
+        self.value_catalog.refresh()
+        
+        # Sample of the fact table for approximate previews of slow queries,
+        # whose exact queries run in the background
+        self.fact_sample = FactSample(self.reader, percent=sample_percent, min_rows=sample_min_rows)
+        self.fact_sample.refresh()
+        self.preview_rewriter = PreviewRewriter(self.reader, self.fact_sample)
+        self._exact_pool = ThreadPoolExecutor(exact_workers, thread_name_prefix="exact")
+        
+        # Mergeable sketches of distinct customers and receipts per day,
+        # store and category, read by the semantic layer
+        self.distinct_sketches = DistinctSketches(self.reader, precision=sketch_precision)
+        self.distinct_sketches.refresh()
+        
+        # Optional DuckDB JSON profiling of executed queries
+        self.profiler = profiler
+        self.profiling_enabled = profiler is not None
+        
+        # Prepared statements for template queries: PREPARE is scoped to a
+        # connection, so each statement cursor keeps its own cache of them.
+        # A query takes an idle cursor from the pool and returns it after the
+        # fetch; the lock only guards the pool, so queries run concurrently
+        self._prepared_pool = []
+        self._prepared_count = 0
+        self._prepared_lock = threading.Lock()
+        self.prepared_cache_size = prepared_cache_size
+        
+        # Identical queries in flight at the same time wait for one execution
+        self.in_flight = SingleFlight('sql', enabled=coalesce)
+        
+        # Sub-query results and previous answers are queried in a database of
+        # their own, which holds nothing else and can't read files
+        self._local_db = duckdb.connect()
+        self._local_db.execute("SET enable_external_access = false")
+        self._local_db.execute("SET lock_configuration = true")
+        
+        # Generated SQL runs in worker processes that can be killed on
+        # timeout; template queries stay on the prepared statements here
+        self.sandbox = None
+        if sandbox_workers:
+            self.sandbox = SandboxPool(
+                self.db_path, workers=sandbox_workers, memory_limit=sandbox_memory_limit, threads=sandbox_threads,
+                temp_directory=governor.temp_directory if governor is not None else None,
+            )
+    
+    @property
+    def conn(self):
+        """Connection to the current snapshot of the database."""
+        return self._snapshot.conn
+    
+    def on_switch(self, listener):
+        """
+        Register a callback run after readers switch to another snapshot.
+        
+        Args:
+            listener (callable): Called with the reader connection (see reader)
+        """
+        self._switch_listeners.append(listener)
+    
+    def switch_snapshot(self, db_file):
+        """
+        Switch readers to another database file, e.g. a freshly built snapshot.
+        
+        New queries use the new file as soon as this returns; queries still
+        running on the old one finish there, and its connection is closed
+        once they have (see Snapshot.retire).
+        
+        Args:
+            db_file (str): Path to the database file, opened read-only
+            
+        Returns:
+            bool: False if the executor already reads this file
+        """
+        with self._switch_lock:
+            if db_file == self.db_path:
+                return False
+            conn = duckdb.connect(db_file, read_only=True)
+            if self.governor is not None:
+                self.governor.configure(conn)
+            previous = self._snapshot
+            # Statement cursors of the old connection are dropped from the
+            # pool as they come back (see _checkin_prepared)
+            with self._prepared_lock:
+                self._snapshot = Snapshot(db_file, conn)
+                self.db_path = db_file
+                self._prepared_pool.clear()
+            # Components read through self.reader, which now leases the new snapshot
+            self.validator.clear_estimates()
+            self.term_macros.sync(force=True)
+            self.value_catalog.refresh()
+            self.fact_sample.refresh()
+            self.distinct_sketches.refresh()
+            if self.sandbox is not None:
+                self.sandbox.restart(db_file)
+            previous.retire(timeout=self.drain_timeout)
+        logger.info(f"Readers switched to snapshot {db_file}")
+        
+        for listener in self._switch_listeners:
+            try:
+                listener(self.reader)
+            except Exception as e:
+                logger.error(f"Snapshot switch listener failed: {e}")
+        return True
+    
+    def sync_term_macros(self):
+        """
+        Recompile the term macros if dictionary.json changed.
+        
+        The database is read-only, so changed macros reach it through a
+        rebuild: a new snapshot is built with them in the background, and
+        readers switch to it. Until then only the macros it defines are used.
+        
+        Returns:
+            list: TermMacro objects of the macros the database defines
+        """
+        macros = self.term_macros.sync()
+        if self.term_macros.stale and self.term_macros.mtime != self._macros_rebuild_mtime:
+            # One rebuild per edit of the dictionary
+            self._macros_rebuild_mtime = self.term_macros.mtime
+            if self.bootstrap.start_rebuild():
+                logger.info("dictionary.json changed, building a snapshot with its term macros")
+        return macros
     
-    def execute_query(self, query):
+    def watch_snapshots(self, interval=5):
+        """
+        Switch to newly published snapshots in a background thread, so a
+        rebuild in any process reaches this one within interval seconds.
+        
+        Args:
+            interval (float): Seconds between checks of the snapshot pointer
+        """
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    db_file = self.bootstrap.current_file()
+                    if db_file != self.db_path:
+                        self.switch_snapshot(db_file)
+                except Exception as e:
+                    logger.error(f"Snapshot not switched: {e}")
+        
+        threading.Thread(target=watch, name="snapshot-watcher", daemon=True).start()
+    
+    def execute_query(self, query, metrics=None, profile=None, max_rows=None):
         """
         Execute an SQL query with a timeout and row limit.
         
         Args:
             query (str): The SQL query to execute
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings
+            profile (bool, optional): Capture a DuckDB profile of this query;
+                defaults to profiling_enabled
+            max_rows (int, optional): Row limit added to a query without LIMIT;
+                defaults to max_rows of the executor
             
         Returns:
             pandas.DataFrame: The query results as a DataFrame
@@ -45,7 +340,12 @@ class QueryExecutor:
         Raises:
             Exception: If the query times out or other errors occur
         """
+        metrics = metrics or QueryMetrics()
+        
         try:
+            # Classified by the query as validated, before the row limit is added
+            query_class = self._classify(query)
+            
             # Check if the query already has a LIMIT clause
             has_limit = "LIMIT" in query.upper()
             
@@ -56,45 +356,364 @@ class QueryExecutor:
                     query = query.strip()[:-1]
                 
                 # Добавляем LIMIT в конец запроса
-                query = f"{query} LIMIT {self.max_rows}"
+                query = f"{query} LIMIT {max_rows or self.max_rows}"
             
-            logger.info(f"Executing query: {query}")
+            return self._coalesced(
+                sql_key(query), metrics, self._run_query, query, metrics, profile, query_class
+            )
             
-            # Start timer
-            start_time = time.time()
+        except QueryRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Error executing query: {e}")
+            raise Exception(f"Ошибка выполнения запроса: {str(e)}")
+    
+    def execute_decomposed(self, decomposed, metrics=None, max_intermediate_rows=100_000):
+        """
+        Execute the sub-queries of a decomposed question in parallel and
+        combine their results locally.
+        
+        Each sub-query goes through execute_query on its own thread, and so
+        on its own cursor (or sandbox worker), with its own governor class
+        and coalescing. The results are registered as frames in a private
+        in-memory database where the combining query joins them.
+        
+        Args:
+            decomposed (data_manager.decomposition.DecomposedQuery): The sub-queries
+            metrics (utils.metrics.QueryMetrics, optional): Collector; the parallel
+                part is timed as sql_exec, the local join as combine
+            max_intermediate_rows (int): Row limit of a sub-query without LIMIT;
+                a result that reaches it would be truncated and fails the query
             
-            # Execute the query with a timeout
-            result = self._execute_with_timeout(query)
+        Returns:
+            pandas.DataFrame: The combined results
+            
+        Raises:
+            SQLValidationError: If the combining query is not a single SELECT
+            Exception: If a sub-query or the combining query fails
+        """
+        metrics = metrics or QueryMetrics()
+        subqueries = decomposed.subqueries
+        
+        def run(sub):
+            # Sub-queries time their own stages; the caller's metrics get the wall time
+            sub_metrics = QueryMetrics()
+            df = self.execute_query(sub.sql, metrics=sub_metrics, max_rows=max_intermediate_rows)
+            if "LIMIT" not in sub.sql.upper() and len(df) >= max_intermediate_rows:
+                raise Exception(
+                    f"Промежуточный результат «{sub.name}» превысил {max_intermediate_rows} строк"
+                )
+            return df, sub_metrics
+        
+        with metrics.stage('sql_exec'), ThreadPoolExecutor(len(subqueries), thread_name_prefix="subquery") as pool:
+            outcomes = list(pool.map(run, subqueries))
+        frames = {sub.name: df for sub, (df, _) in zip(subqueries, outcomes)}
+        for _, sub_metrics in outcomes:
+            metrics.coalesced.extend(layer for layer in sub_metrics.coalesced if layer not in metrics.coalesced)
+        logger.info(
+            "Sub-queries returned " + ", ".join(f"{name}: {len(df)} rows" for name, df in frames.items())
+        )
+        
+        with metrics.stage('combine'):
+            try:
+                df = self.query_results(decomposed.combine_sql, frames)
+            except SQLValidationError:
+                raise
+            except Exception as e:
+                logger.error(f"Error combining sub-query results: {e}")
+                raise Exception(f"Ошибка объединения результатов подзапросов: {str(e)}")
+        if len(df) > self.max_rows:
+            df = df.head(self.max_rows)
+        metrics.row_count = len(df)
+        return df
+    
+    def execute_preview(self, query, metrics=None, exact_metrics=None, min_cost=0):
+        """
+        Answer an aggregate query approximately from the sample of the fact
+        table, and start the exact query in the background.
+        
+        Args:
+            query (str): The SQL query, validated
+            metrics (utils.metrics.QueryMetrics, optional): Collector for the preview's stages
+            exact_metrics (utils.metrics.QueryMetrics, optional): Collector for the exact query's stages
+            min_cost (int): Queries estimated cheaper than this get no preview
             
+        Returns:
+            data_manager.sampling.Preview: The approximate results with their
+                confidence intervals and the future of the exact results, or
+                None if the query gets no preview; run it with execute_query then
+        """
+        if not self.fact_sample.available:
+            return None
+        estimated_cost = self.validator.estimate(query)
+        if estimated_cost is None or estimated_cost < min_cost:
+            return None
+        preview_query = self.preview_rewriter.rewrite(query)
+        if preview_query is None:
+            return None
+        
+        metrics = metrics or QueryMetrics()
+        try:
+            results = self.execute_query(preview_query.sql, metrics=metrics)
+        except QueryRejected:
+            raise
+        except Exception as e:
+            logger.warning(f"Preview query failed, running the exact query only: {e}")
+            return None
+        logger.info(f"Preview from a {preview_query.fraction:.1%} sample: {len(results)} rows")
+        exact = self._exact_pool.submit(self.execute_query, query, exact_metrics or QueryMetrics())
+        return Preview(results, preview_query, exact)
+
+    def execute_chart(self, query, spec, buckets=500, max_series=10, metrics=None):
+        """
+        Downsample the whole time series of a query in DuckDB, for results
+        cut at the row limit: only a few points per x interval are fetched,
+        however many rows the query returns.
+
+        Args:
+            query (str): The query, without the row limit
+            spec (data_manager.charts.ChartSpec): Chart columns of its result
+            buckets (int): Number of x intervals per line
+            max_series (int): Most lines, by total of the first measure
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings
+
+        Returns:
+            data_manager.charts.ChartData: The points to draw
+        """
+        from .charts import m4_sql, m4_points
+
+        sql = m4_sql(query, spec, buckets=buckets, max_series=max_series)
+        # At most four points per interval of each measure of each line
+        max_rows = buckets * max_series * len(spec.measures)
+        return m4_points(self.execute_query(sql, metrics=metrics, max_rows=max_rows))
+
+    def query_results(self, query, relations):
+        """
+        Run a query over results already fetched, without the analytics
+        database.
+        
+        The relations are registered on a cursor of the private in-memory
+        database, visible only to that cursor, so concurrent calls don't see
+        each other's names.
+        
+        Args:
+            query (str): A single SELECT over the relations
+            relations (dict): pandas.DataFrame or pyarrow.Table results by name
+            
+        Returns:
+            pandas.DataFrame: The query results
+            
+        Raises:
+            SQLValidationError: If the query is not a single SELECT
+        """
+        conn = self._local_db.cursor()
+        try:
+            check_statement(conn, query)
+            for name, relation in relations.items():
+                conn.register(name, relation)
+            return conn.execute(query).fetchdf()
+        finally:
+            conn.close()
+    
+    def _classify(self, query):
+        """Find the governor class of a query from its cost estimate; None without a governor."""
+        if self.governor is None:
+            return None
+        return self.governor.classify(self.validator.estimate(query))
+    
+    def _admitted(self, query_class, metrics):
+        """Admission slot of the query's class, or a no-op without a governor."""
+        if query_class is None:
+            return nullcontext()
+        return self.governor.admit(query_class, metrics)
+    
+    def _run_query(self, query, metrics, profile, query_class=None):
+        with self._admitted(query_class, metrics):
+            return self._run_admitted(query, metrics, profile, query_class)
+    
+    def _run_admitted(self, query, metrics, profile, query_class):
+        logger.info(f"Executing query: {query}")
+        timeout = query_class.timeout if query_class is not None else self.query_timeout_seconds
+        
+        if self.sandbox is not None:
+            start_time = time.time()
+            df = self.sandbox.execute(
+                query, timeout=timeout, metrics=metrics,
+                settings=query_class.settings if query_class is not None else None,
+            )
+            metrics.row_count = len(df)
+            logger.info(f"Query returned {len(df)} rows from the sandbox in {time.time() - start_time:.2f} seconds")
+            return df
+        
+        # The snapshot is kept open until the result is fetched, even if
+        # readers switch to a newer one meanwhile
+        with self._snapshot.lease() as snapshot_conn:
+            return self._run_in_process(query, metrics, profile, timeout, snapshot_conn)
+    
+    def _run_in_process(self, query, metrics, profile, timeout, snapshot_conn):
+        # Start timer
+        start_time = time.time()
+        
+        # Every query runs on its own cursor, so callers on different
+        # threads never share one; profiling settings are per cursor too
+        if profile is None:
+            profile = self.profiling_enabled
+        conn = snapshot_conn.cursor()
+        profile_path = None
+        try:
+            if profile and self.profiler is not None:
+                profile_path = self.profiler.enable(conn)
+
+            # Execute the query with a timeout
+            with metrics.stage('sql_exec'):
+                result = self._execute_with_timeout(query, conn, timeout)
+
             # Calculate query execution time
             execution_time = time.time() - start_time
             logger.info(f"Query executed in {execution_time:.2f} seconds")
-            
+
             # Convert result to DataFrame
-            if result is not None:
+            if result is None:
+                return None
+            with metrics.stage('fetch'):
                 df = result.fetchdf()
-                logger.info(f"Query returned {len(df)} rows")
-                return df
-            return None
+            metrics.row_count = len(df)
+            logger.info(f"Query returned {len(df)} rows")
+
+            # The profile is written once the result has been consumed
+            conn.close()
+            if profile_path is not None:
+                self.profiler.collect(query, profile_path)
+                profile_path = None
+            return df
+        finally:
+            # Failed or timed out queries leave no cursor and no profile behind
+            conn.close()
+            if profile_path is not None and os.path.exists(profile_path):
+                os.remove(profile_path)
+    
+    def execute_prepared(self, query, params, metrics=None):
+        """
+        Execute a parameterized query as a cached prepared statement.
+        
+        The statement is prepared once per distinct query text and reused
+        with new parameter values, so repeated template questions skip
+        parsing, binding and planning.
+        
+        Args:
+            query (str): SQL with named parameters ($name)
+            params (dict): Parameter values by name
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings
+            
+        Returns:
+            pandas.DataFrame: The query results as a DataFrame
             
+        Raises:
+            Exception: If the query times out or other errors occur
+        """
+        metrics = metrics or QueryMetrics()
+        
+        try:
+            # EXECUTE does not take bound parameters, values go in as literals
+            arguments = ", ".join(f"{key} := {sql_literal(value)}" for key, value in params.items())
+            query_class = self._classify(inline_params(query, params)) if self.governor is not None else None
+            return self._coalesced(
+                ('prepared', sql_key(query), arguments), metrics, self._run_prepared, query, arguments, metrics,
+                query_class,
+            )
+            
+        except QueryRejected:
+            raise
         except Exception as e:
-            logger.error(f"Error executing query: {e}")
+            logger.error(f"Error executing prepared statement: {e}")
             raise Exception(f"Ошибка выполнения запроса: {str(e)}")
     
-    def _execute_with_timeout(self, query):
-        """Execute a query with a timeout."""
+    def _run_prepared(self, query, arguments, metrics, query_class=None):
+        # The slot is taken before a cursor, so a rejected query never holds one
+        with self._admitted(query_class, metrics):
+            snapshot = self._snapshot
+            with snapshot.lease():
+                entry = self._checkout_prepared(snapshot)
+                _, cursor, statements = entry
+                try:
+                    name = statements.get(query)
+                    if name is None:
+                        with self._prepared_lock:
+                            self._prepared_count += 1
+                            name = f"prepared_{self._prepared_count}"
+                        cursor.execute(f"PREPARE {name} AS {query}")
+                        statements[query] = name
+                        logger.info(f"Prepared statement {name}: {query}")
+                        if len(statements) > self.prepared_cache_size:
+                            _, evicted = statements.popitem(last=False)
+                            cursor.execute(f"DEALLOCATE {evicted}")
+                    else:
+                        statements.move_to_end(query)
+                    
+                    statement = f"EXECUTE {name}({arguments})" if arguments else f"EXECUTE {name}"
+                    with metrics.stage('sql_exec'):
+                        result = self._execute_with_timeout(
+                            statement, cursor,
+                            query_class.timeout if query_class is not None else None,
+                        )
+                    with metrics.stage('fetch'):
+                        df = result.fetchdf()
+                except Exception:
+                    # A timed out statement may still be running on the cursor
+                    cursor.close()
+                    raise
+                self._checkin_prepared(entry)
+        
+        metrics.row_count = len(df)
+        logger.info(f"Prepared statement {name} returned {len(df)} rows")
+        return df
+    
+    def _checkout_prepared(self, snapshot):
+        """An idle statement cursor of the snapshot with its statements, or a new one."""
+        with self._prepared_lock:
+            while self._prepared_pool:
+                entry = self._prepared_pool.pop()
+                if entry[0] is snapshot:
+                    return entry
+        return snapshot, snapshot.conn.cursor(), OrderedDict()
+    
+    def _checkin_prepared(self, entry):
+        """Return a statement cursor to the pool, unless its snapshot was replaced meanwhile."""
+        with self._prepared_lock:
+            if entry[0] is self._snapshot:
+                self._prepared_pool.append(entry)
+                return
+        entry[1].close()
+    
+    def _coalesced(self, key, metrics, func, *args):
+        """
+        Run a query through the single-flight group. A caller that reuses
+        an identical query in flight gets its own copy of the result; its
+        wait counts as the sql_exec stage.
+        """
+        start = time.perf_counter()
+        df, coalesced = self.in_flight.do(key, func, *args, share=lambda df: None if df is None else df.copy())
+        if coalesced:
+            metrics.coalesce('sql', 'sql_exec', time.perf_counter() - start)
+            metrics.row_count = None if df is None else len(df)
+        return df
+    
+    def _execute_with_timeout(self, query, conn=None, timeout=None):
+        """Execute a query with a timeout (query_timeout_seconds by default)."""
         # DuckDB doesn't support query timeouts directly, so we'll implement
         # a simple timeout mechanism with a separate monitoring thread
         
         import threading
         import queue
         
+        conn = conn or self.conn
+        timeout = timeout or self.query_timeout_seconds
         result_queue = queue.Queue()
         error_queue = queue.Queue()
         
         def execute_query_thread():
             try:
-                result = self.conn.execute(query)
+                result = conn.execute(query)
                 result_queue.put(result)
             except Exception as e:
                 error_queue.put(e)
@@ -105,12 +724,14 @@ class QueryExecutor:
         query_thread.start()
         
         # Wait for the query to complete or timeout
-        query_thread.join(timeout=self.query_timeout_seconds)
+        query_thread.join(timeout=timeout)
         
         # Check if the query is still running (thread is still alive)
         if query_thread.is_alive():
-            # The query is still running after the timeout
-            raise Exception(f"Запрос превысил ограничение времени выполнения ({self.query_timeout_seconds} секунд)")
+            # The query is still running after the timeout; stop it so the
+            # connection is free for the next query
+            conn.interrupt()
+            raise Exception(f"Запрос превысил ограничение времени выполнения ({timeout} секунд)")
         
         # Check if there was an error
         if not error_queue.empty():
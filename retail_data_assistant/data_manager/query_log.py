@@ -0,0 +1,252 @@
+import duckdb
+import os
+import logging
+import threading
+from utils.metrics import STAGES
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'retail_assistant'
+
+class QueryLog:
+    def __init__(self, db_path='query_log.db', window=1000):
+        """
+        Persistent log of answered questions with per-stage timings.
+
+        Args:
+            db_path (str): Database file name inside the data directory
+            window (int): Number of recent queries used for percentiles
+        """
+        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+        self.db_path = os.path.join(self.data_dir, db_path)
+        self.window = window
+        self._lock = threading.Lock()
+
+        self.conn = duckdb.connect(self.db_path)
+        stage_columns = ",\n".join(f"{stage}_ms DOUBLE" for stage in STAGES)
+        self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS query_log (
+                query_id TEXT PRIMARY KEY,
+                started_at TIMESTAMP,
+                question TEXT,
+                sql TEXT,
+                source TEXT,
+                status TEXT,
+                error TEXT,
+                row_count INTEGER,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                llm_retries INTEGER,
+                llm_hedges INTEGER,
+                total_ms DOUBLE,
+                coalesced TEXT,
+                query_class TEXT,
+                admission TEXT,
+                {stage_columns}
+            )
+        """)
+        # Logs created before a stage was introduced get the missing columns
+        for stage in STAGES:
+            self.conn.execute(f"ALTER TABLE query_log ADD COLUMN IF NOT EXISTS {stage}_ms DOUBLE")
+        self.conn.execute("ALTER TABLE query_log ADD COLUMN IF NOT EXISTS source TEXT")
+        self.conn.execute("ALTER TABLE query_log ADD COLUMN IF NOT EXISTS coalesced TEXT")
+        self.conn.execute("ALTER TABLE query_log ADD COLUMN IF NOT EXISTS llm_retries INTEGER")
+        self.conn.execute("ALTER TABLE query_log ADD COLUMN IF NOT EXISTS llm_hedges INTEGER")
+        self.conn.execute("ALTER TABLE query_log ADD COLUMN IF NOT EXISTS query_class TEXT")
+        self.conn.execute("ALTER TABLE query_log ADD COLUMN IF NOT EXISTS admission TEXT")
+        logger.info(f"Query log at {self.db_path}")
+
+    def record(self, metrics):
+        """
+        Store the metrics of one answered question.
+
+        Args:
+            metrics (utils.metrics.QueryMetrics): The collected metrics
+        """
+        stage_values = [
+            metrics.stages[stage] * 1000 if stage in metrics.stages else None
+            for stage in STAGES
+        ]
+        columns = [
+            "query_id", "started_at", "question", "sql", "source", "status", "error", "row_count",
+            "prompt_tokens", "completion_tokens", "llm_retries", "llm_hedges", "total_ms", "coalesced", "query_class", "admission"
+        ] + [f"{stage}_ms" for stage in STAGES]
+        placeholders = ", ".join(["?"] * len(columns))
+        try:
+            with self._lock:
+                self.conn.execute(
+                    f"INSERT INTO query_log ({', '.join(columns)}) VALUES ({placeholders})",
+                    [
+                        metrics.query_id,
+                        metrics.started_at,
+                        metrics.question,
+                        metrics.sql,
+                        metrics.source,
+                        metrics.status,
+                        metrics.error,
+                        metrics.row_count,
+                        metrics.prompt_tokens,
+                        metrics.completion_tokens,
+                        metrics.llm_retries,
+                        metrics.llm_hedges,
+                        metrics.total_seconds * 1000,
+                        ",".join(metrics.coalesced) or None,
+                        metrics.query_class,
+                        metrics.admission,
+                    ] + stage_values
+                )
+        except Exception as e:
+            # Losing a log record must never break answering the question
+            logger.error(f"Error writing query log: {e}")
+
+    def stage_percentiles(self):
+        """
+        Latency percentiles per stage over the recent window.
+
+        Returns:
+            pandas.DataFrame: Columns stage, count, p50_ms, p95_ms, max_ms
+        """
+        selects = " UNION ALL ".join(
+            f"SELECT '{stage}' AS stage, {i} AS ord, {stage}_ms AS ms FROM recent"
+            for i, stage in enumerate(STAGES + ['total'])
+        )
+        with self._lock:
+            return self.conn.execute(f"""
+                WITH recent AS (
+                    SELECT * FROM query_log ORDER BY started_at DESC LIMIT {int(self.window)}
+                ),
+                stages AS ({selects})
+                SELECT
+                    stage,
+                    COUNT(ms) AS count,
+                    quantile_cont(ms, 0.5) AS p50_ms,
+                    quantile_cont(ms, 0.95) AS p95_ms,
+                    MAX(ms) AS max_ms
+                FROM stages
+                GROUP BY stage, ord
+                ORDER BY ord
+            """).fetchdf()
+
+    def coalesced_counts(self):
+        """
+        Number of logged calls that reused an identical call in flight, by layer.
+
+        Returns:
+            dict: Counts for 'llm' and 'sql'
+        """
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT layer, COUNT(*)
+                FROM (SELECT unnest(string_split(coalesced, ',')) AS layer FROM query_log WHERE coalesced IS NOT NULL)
+                GROUP BY layer
+            """).fetchall()
+        return {'llm': 0, 'sql': 0, **dict(rows)}
+
+    def admission_report(self):
+        """
+        Admission outcomes per resource governor class over the recent window.
+
+        Returns:
+            pandas.DataFrame: Columns query_class, immediate, waited, rejected, p95_wait_ms
+        """
+        with self._lock:
+            return self.conn.execute(f"""
+                WITH recent AS (
+                    SELECT * FROM query_log ORDER BY started_at DESC LIMIT {int(self.window)}
+                )
+                SELECT
+                    query_class,
+                    COUNT(*) FILTER (WHERE admission = 'immediate') AS immediate,
+                    COUNT(*) FILTER (WHERE admission = 'waited') AS waited,
+                    COUNT(*) FILTER (WHERE admission = 'rejected') AS rejected,
+                    quantile_cont(admission_ms, 0.95) AS p95_wait_ms
+                FROM recent
+                WHERE query_class IS NOT NULL
+                GROUP BY query_class
+                ORDER BY query_class
+            """).fetchdf()
+
+    def recent_queries(self, limit=50):
+        """Return the most recent log records as a DataFrame."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT * FROM query_log ORDER BY started_at DESC LIMIT ?", [limit]
+            ).fetchdf()
+
+    def to_prometheus(self):
+        """
+        Render the log in Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page
+        """
+        lines = []
+
+        duration = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines.append(f"# HELP {duration} Duration of pipeline stages (quantiles over the last {self.window} queries)")
+        lines.append(f"# TYPE {duration} summary")
+        percentiles = self.stage_percentiles()
+        coalesced = self.coalesced_counts()
+        with self._lock:
+            totals = self.conn.execute(
+                "SELECT " + ", ".join(
+                    f"COUNT({stage}_ms), COALESCE(SUM({stage}_ms), 0)" for stage in STAGES + ['total']
+                ) + " FROM query_log"
+            ).fetchone()
+            statuses = self.conn.execute(
+                "SELECT status, COALESCE(source, 'llm'), COUNT(*) FROM query_log GROUP BY ALL ORDER BY ALL"
+            ).fetchall()
+            tokens = self.conn.execute(
+                "SELECT COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), "
+                "COALESCE(SUM(llm_retries), 0), COALESCE(SUM(llm_hedges), 0) FROM query_log"
+            ).fetchone()
+            admissions = self.conn.execute(
+                "SELECT query_class, admission, COUNT(*) FROM query_log "
+                "WHERE query_class IS NOT NULL GROUP BY ALL ORDER BY ALL"
+            ).fetchall()
+
+        for i, row in enumerate(percentiles.itertuples(index=False)):
+            for quantile, value in (('0.5', row.p50_ms), ('0.95', row.p95_ms)):
+                if value is not None and value == value:
+                    lines.append(f'{duration}{{stage="{row.stage}",quantile="{quantile}"}} {value / 1000:.6f}')
+            count, total_ms = totals[2 * i], totals[2 * i + 1]
+            lines.append(f'{duration}_sum{{stage="{row.stage}"}} {total_ms / 1000:.6f}')
+            lines.append(f'{duration}_count{{stage="{row.stage}"}} {count}')
+
+        queries = f"{METRIC_PREFIX}_queries_total"
+        lines.append(f"# HELP {queries} Answered questions by status and SQL source")
+        lines.append(f"# TYPE {queries} counter")
+        for status, source, count in statuses:
+            lines.append(f'{queries}{{status="{status}",source="{source}"}} {count}')
+
+        llm_tokens = f"{METRIC_PREFIX}_llm_tokens_total"
+        lines.append(f"# HELP {llm_tokens} LLM tokens consumed")
+        lines.append(f"# TYPE {llm_tokens} counter")
+        lines.append(f'{llm_tokens}{{kind="prompt"}} {tokens[0]}')
+        lines.append(f'{llm_tokens}{{kind="completion"}} {tokens[1]}')
+
+        llm_retries = f"{METRIC_PREFIX}_llm_retries_total"
+        lines.append(f"# HELP {llm_retries} LLM calls repeated after rate limiting or provider errors")
+        lines.append(f"# TYPE {llm_retries} counter")
+        lines.append(f"{llm_retries} {tokens[2]}")
+
+        llm_hedges = f"{METRIC_PREFIX}_llm_hedged_calls_total"
+        lines.append(f"# HELP {llm_hedges} Duplicate LLM calls sent because the original was slower than the hedge delay")
+        lines.append(f"# TYPE {llm_hedges} counter")
+        lines.append(f"{llm_hedges} {tokens[3]}")
+
+        governed = f"{METRIC_PREFIX}_governor_queries_total"
+        lines.append(f"# HELP {governed} Queries by resource governor class and admission outcome")
+        lines.append(f"# TYPE {governed} counter")
+        for query_class, admission, count in admissions:
+            lines.append(f'{governed}{{class="{query_class}",admission="{admission}"}} {count}')
+
+        deduplicated = f"{METRIC_PREFIX}_coalesced_calls_total"
+        lines.append(f"# HELP {deduplicated} LLM calls and queries saved by reusing an identical call in flight")
+        lines.append(f"# TYPE {deduplicated} counter")
+        for layer, count in coalesced.items():
+            lines.append(f'{deduplicated}{{layer="{layer}"}} {count}')
+
+        return "\n".join(lines) + "\n"
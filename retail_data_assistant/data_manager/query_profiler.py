@@ -0,0 +1,300 @@
+import duckdb
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Literal and noise patterns removed when fingerprinting SQL
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])[-+]?\d+(?:\.\d+)?(?:e[-+]?\d+)?\b", re.IGNORECASE)
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """
+    Strip literals, comments and formatting from a SQL statement.
+
+    Two queries that differ only in constants (dates, names, LIMIT values,
+    IN-list lengths) normalize to the same text.
+
+    Args:
+        sql (str): The SQL query
+
+    Returns:
+        str: The normalized SQL
+    """
+    normalized = _COMMENT_RE.sub(" ", sql)
+    normalized = _STRING_RE.sub("?", normalized)
+    normalized = _NUMBER_RE.sub("?", normalized)
+    normalized = _IN_LIST_RE.sub("(?+)", normalized)
+    normalized = _WHITESPACE_RE.sub(" ", normalized).strip().rstrip(";").strip()
+    return normalized.lower()
+
+
+def fingerprint_sql(sql):
+    """
+    Compute a stable fingerprint of a SQL statement with literals stripped.
+
+    Args:
+        sql (str): The SQL query
+
+    Returns:
+        tuple: (fingerprint, normalized_sql)
+    """
+    normalized = normalize_sql(sql)
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:16], normalized
+
+
+def flatten_profile(profile):
+    """
+    Flatten a DuckDB JSON profile into a list of operators.
+
+    Handles both the current profile layout (operator_name, operator_timing,
+    operator_cardinality) and the one used by older DuckDB releases
+    (name, timing, cardinality).
+
+    Args:
+        profile (dict): The parsed profiling output
+
+    Returns:
+        list: One dict per operator, in depth-first order
+    """
+    operators = []
+
+    def visit(node, parent_id, depth):
+        children = node.get('children', [])
+        extra_info = node.get('extra_info', {})
+        estimated = extra_info.get('Estimated Cardinality') if isinstance(extra_info, dict) else None
+        operator_id = len(operators)
+        operator = {
+            'operator_id': operator_id,
+            'parent_id': parent_id,
+            'depth': depth,
+            'operator_name': node.get('operator_name', node.get('name')),
+            'rows_in': sum(_cardinality(child) for child in children),
+            'rows_out': _cardinality(node),
+            'estimated_cardinality': int(estimated) if estimated not in (None, '') else None,
+            'timing_ms': float(node.get('operator_timing', node.get('timing', 0.0)) or 0.0) * 1000,
+            'extra_info': json.dumps(extra_info, ensure_ascii=False),
+        }
+        operators.append(operator)
+        for child in children:
+            visit(child, operator_id, depth + 1)
+
+    for root in profile.get('children', []):
+        visit(root, None, 0)
+    return operators
+
+
+def _cardinality(node):
+    return int(node.get('operator_cardinality', node.get('cardinality', 0)) or 0)
+
+
+class QueryProfiler:
+    def __init__(self, db_path='query_log.db'):
+        """
+        Store DuckDB query profiles next to the SQL fingerprint.
+
+        Args:
+            db_path (str): Database file name inside the data directory
+        """
+        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+        self.db_path = os.path.join(self.data_dir, db_path)
+        self._lock = threading.Lock()
+
+        self.conn = duckdb.connect(self.db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_profiles (
+                profile_id TEXT PRIMARY KEY,
+                captured_at TIMESTAMP,
+                fingerprint TEXT,
+                normalized_sql TEXT,
+                sql TEXT,
+                latency_ms DOUBLE,
+                rows_returned BIGINT,
+                profile_json TEXT
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_profile_operators (
+                profile_id TEXT,
+                operator_id INTEGER,
+                parent_id INTEGER,
+                depth INTEGER,
+                operator_name TEXT,
+                rows_in BIGINT,
+                rows_out BIGINT,
+                estimated_cardinality BIGINT,
+                timing_ms DOUBLE,
+                extra_info TEXT
+            )
+        """)
+        logger.info(f"Query profiler storing profiles in {self.db_path}")
+
+    def enable(self, conn):
+        """
+        Enable JSON profiling on a connection.
+
+        Profiling settings are scoped to the connection, so callers should
+        pass a dedicated cursor rather than a shared connection.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): The connection to profile
+
+        Returns:
+            str: Path of the file DuckDB writes the profile to
+        """
+        output_path = os.path.join(tempfile.gettempdir(), f"duckdb_profile_{uuid.uuid4().hex}.json")
+        conn.execute("SET enable_profiling = 'json'")
+        conn.execute(f"SET profiling_output = '{output_path}'")
+        return output_path
+
+    def collect(self, sql, output_path):
+        """
+        Read a profile written by DuckDB and store it.
+
+        Args:
+            sql (str): The executed SQL
+            output_path (str): Path returned by enable()
+
+        Returns:
+            str: The profile id, or None if no profile was captured
+        """
+        try:
+            if not os.path.exists(output_path):
+                logger.warning("Profiling output not found, the result may not have been consumed")
+                return None
+            with open(output_path, 'r', encoding='utf-8') as f:
+                profile = json.load(f)
+            return self.record(sql, profile)
+        except Exception as e:
+            logger.error(f"Error collecting query profile: {e}")
+            return None
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
+    def record(self, sql, profile):
+        """
+        Store a parsed profile together with its flattened operator tree.
+
+        Args:
+            sql (str): The executed SQL
+            profile (dict): The parsed DuckDB JSON profile
+
+        Returns:
+            str: The profile id
+        """
+        profile_id = str(uuid.uuid4())
+        fingerprint, normalized = fingerprint_sql(sql)
+        latency = profile.get('latency', profile.get('result', profile.get('timing', 0.0))) or 0.0
+        operators = flatten_profile(profile)
+
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO query_profiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    profile_id,
+                    datetime.now(),
+                    fingerprint,
+                    normalized,
+                    sql,
+                    float(latency) * 1000,
+                    profile.get('rows_returned'),
+                    json.dumps(profile, ensure_ascii=False),
+                ]
+            )
+            if operators:
+                self.conn.executemany(
+                    "INSERT INTO query_profile_operators VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        [
+                            profile_id,
+                            op['operator_id'],
+                            op['parent_id'],
+                            op['depth'],
+                            op['operator_name'],
+                            op['rows_in'],
+                            op['rows_out'],
+                            op['estimated_cardinality'],
+                            op['timing_ms'],
+                            op['extra_info'],
+                        ]
+                        for op in operators
+                    ]
+                )
+
+        logger.info(f"Captured profile {profile_id} for fingerprint {fingerprint} ({float(latency):.3f}s)")
+        return profile_id
+
+    def slow_query_report(self, limit=20):
+        """
+        Rank query shapes by the total time spent executing them.
+
+        Args:
+            limit (int): Maximum number of fingerprints to return
+
+        Returns:
+            pandas.DataFrame: One row per fingerprint with execution count,
+            total/avg/p95/max latency, the most expensive operator and an
+            example query
+        """
+        with self._lock:
+            return self.conn.execute("""
+                WITH hottest_operator AS (
+                    SELECT
+                        qp.fingerprint,
+                        arg_max(o.operator_name, o.total_ms) AS hottest_operator
+                    FROM (
+                        SELECT profile_id, operator_name, SUM(timing_ms) AS total_ms
+                        FROM query_profile_operators
+                        GROUP BY profile_id, operator_name
+                    ) o
+                    JOIN query_profiles qp ON o.profile_id = qp.profile_id
+                    GROUP BY qp.fingerprint
+                )
+                SELECT
+                    qp.fingerprint,
+                    COUNT(*) AS executions,
+                    SUM(qp.latency_ms) AS total_ms,
+                    AVG(qp.latency_ms) AS avg_ms,
+                    quantile_cont(qp.latency_ms, 0.95) AS p95_ms,
+                    MAX(qp.latency_ms) AS max_ms,
+                    AVG(qp.rows_returned) AS avg_rows,
+                    ANY_VALUE(h.hottest_operator) AS hottest_operator,
+                    ANY_VALUE(qp.normalized_sql) AS normalized_sql,
+                    arg_max(qp.sql, qp.captured_at) AS latest_sql
+                FROM query_profiles qp
+                LEFT JOIN hottest_operator h ON qp.fingerprint = h.fingerprint
+                GROUP BY qp.fingerprint
+                ORDER BY total_ms DESC
+                LIMIT ?
+            """, [limit]).fetchdf()
+
+    def latest_profile_id(self, fingerprint):
+        """Return the id of the most recent profile captured for a fingerprint."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT profile_id FROM query_profiles WHERE fingerprint = ? ORDER BY captured_at DESC LIMIT 1",
+                [fingerprint]
+            ).fetchone()
+        return row[0] if row else None
+
+    def operator_tree(self, profile_id):
+        """Return the flattened operator tree of one profile as a DataFrame."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT * FROM query_profile_operators WHERE profile_id = ? ORDER BY operator_id",
+                [profile_id]
+            ).fetchdf()
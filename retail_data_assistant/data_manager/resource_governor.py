@@ -0,0 +1,176 @@
+import os
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from utils.metrics import QueryMetrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+class QueryRejected(Exception):
+    """Raised when a query waited too long for an admission slot of its class."""
+
+
+class QueryClass:
+    def __init__(self, name, max_cost=None, threads=1, memory_limit="1GB", timeout=10, slots=None):
+        """
+        A class of queries by estimated cost, with its resources.
+
+        Args:
+            name (str): Class name, e.g. 'light'
+            max_cost (int, optional): Upper bound of the dry-run cost estimate; None for no bound
+            threads (int): DuckDB threads of a query of this class (sandbox workers)
+            memory_limit (str): DuckDB memory limit of a query of this class (sandbox workers)
+            timeout (float): Seconds before a query of this class is stopped
+            slots (int, optional): Queries of this class allowed to run at once; None for no cap
+        """
+        self.name = name
+        self.max_cost = max_cost
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.timeout = timeout
+        self.slots = slots
+        self._slots = threading.BoundedSemaphore(slots) if slots else None
+        self.running = 0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def settings(self):
+        """DuckDB settings applied to each query of the class in a sandbox worker."""
+        return {'threads': self.threads, 'memory_limit': self.memory_limit}
+
+
+class ResourceGovernor:
+    def __init__(self, classes, admission_wait=5, threads=None, memory_limit=None,
+                 temp_directory="duckdb_tmp", max_temp_directory_size=None):
+        """
+        Classify queries by their dry-run cost estimate and give each class
+        its timeout and a cap on concurrent queries, so a burst of heavy
+        queries can't take all cores and memory from the light ones.
+
+        DuckDB's threads, memory limit and spill directory are settings of a
+        database instance, shared by all queries in the process. In the app
+        process they are therefore set once as the total budget; per-class
+        threads and memory limits apply to queries in sandbox workers, where
+        each query has the worker's instance to itself.
+
+        Args:
+            classes (list): Class definitions (QueryClass arguments) in order of max_cost
+            admission_wait (float): Seconds a query waits for a slot before it is rejected
+            threads (int, optional): DuckDB threads of the app process
+            memory_limit (str, optional): DuckDB memory limit of the app process
+            temp_directory (str): Spill directory on local disk, relative to the data directory
+            max_temp_directory_size (str, optional): Cap on spilled data, e.g. "10GB"
+        """
+        self.classes = [QueryClass(**definition) for definition in classes]
+        self.admission_wait = admission_wait
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.temp_directory = os.path.join(DATA_DIR, temp_directory)
+        self.max_temp_directory_size = max_temp_directory_size
+        self._lock = threading.Lock()
+
+    def configure(self, conn):
+        """
+        Apply the process-wide budget and spill settings to a connection's database.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the analytics database
+        """
+        os.makedirs(self.temp_directory, exist_ok=True)
+        settings = {'temp_directory': self.temp_directory}
+        if self.max_temp_directory_size:
+            settings['max_temp_directory_size'] = self.max_temp_directory_size
+        if self.threads:
+            settings['threads'] = self.threads
+        if self.memory_limit:
+            settings['memory_limit'] = self.memory_limit
+        for name, value in settings.items():
+            conn.execute(f"SET {name} = '{value}'")
+        logger.info(f"DuckDB resources: {settings}")
+
+    def classify(self, estimated_cost):
+        """
+        Find the class of a query.
+
+        Args:
+            estimated_cost (int): Dry-run cost estimate; None if unknown
+
+        Returns:
+            QueryClass: The first class whose bound the cost fits, the last
+                class if the cost is unknown
+        """
+        if estimated_cost is not None:
+            for query_class in self.classes:
+                if query_class.max_cost is None or estimated_cost <= query_class.max_cost:
+                    return query_class
+        return self.classes[-1]
+
+    @contextmanager
+    def admit(self, query_class, metrics=None):
+        """
+        Hold an admission slot of a class while the query runs.
+
+        Args:
+            query_class (QueryClass): The query's class
+            metrics (utils.metrics.QueryMetrics, optional): Collector; the wait
+                is timed as the admission stage
+
+        Raises:
+            QueryRejected: If no slot frees up within admission_wait seconds
+        """
+        metrics = metrics or QueryMetrics()
+        metrics.query_class = query_class.name
+        waited = False
+        if query_class._slots is not None:
+            with metrics.stage('admission'):
+                if not query_class._slots.acquire(blocking=False):
+                    waited = True
+                    start = time.perf_counter()
+                    acquired = query_class._slots.acquire(timeout=self.admission_wait)
+                    with self._lock:
+                        query_class.wait_seconds += time.perf_counter() - start
+                        if acquired:
+                            query_class.waited += 1
+                        else:
+                            query_class.rejected += 1
+                    if not acquired:
+                        metrics.admission = 'rejected'
+                        logger.warning(f"Query of class {query_class.name} rejected after {self.admission_wait} s")
+                        raise QueryRejected(
+                            f"Сейчас выполняется слишком много запросов класса «{query_class.name}». "
+                            f"Повторите запрос позже."
+                        )
+        metrics.admission = 'waited' if waited else 'immediate'
+        with self._lock:
+            query_class.admitted += 1
+            query_class.running += 1
+        try:
+            yield query_class
+        finally:
+            with self._lock:
+                query_class.running -= 1
+            if query_class._slots is not None:
+                query_class._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                query_class.name: {
+                    'slots': query_class.slots,
+                    'running': query_class.running,
+                    'admitted': query_class.admitted,
+                    'waited': query_class.waited,
+                    'rejected': query_class.rejected,
+                    'wait_seconds': round(query_class.wait_seconds, 3),
+                }
+                for query_class in self.classes
+            }
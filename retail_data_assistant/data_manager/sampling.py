@@ -0,0 +1,355 @@
+import json
+import logging
+import threading
+from datetime import datetime
+from .db_bootstrap import is_read_only
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Aggregates estimated from the sample: totals are scaled up to the whole
+# table, averages are estimated as they are. Any other aggregate (MIN, MAX,
+# COUNT(DISTINCT), medians) can't be estimated from a sample, and such
+# queries get no preview.
+TOTAL_AGGREGATES = {'sum', 'count', 'count_star'}
+AVERAGE_AGGREGATES = {'avg', 'mean'}
+
+# Normal quantile of the two-sided 95% confidence interval
+Z_95 = 1.96
+
+
+def _walk(node):
+    """Yield every dict in an AST, depth first."""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item)
+
+
+class FactSample:
+    def __init__(self, conn, table='sales', key_column='sale_id', percent=1, min_rows=1_000_000, seed=42):
+        """
+        Uniform random sample of the fact table, stored next to it, for
+        approximate previews.
+
+        The sample is drawn by reservoir sampling: exactly percent of the
+        rows, each row with the same chance, so totals over it scale up to
+        the whole table with a known error. It is rebuilt when the table
+        changes (row count and a hash of its keys) or its size is
+        reconfigured; readers of a read-only
+        snapshot use the sample written by the process that built it.
+        Tables smaller than min_rows get no sample: exact queries over them
+        are fast enough.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the analytics database
+            table (str): The fact table
+            key_column (str): Its key, hashed to detect changes
+            percent (float): Size of the sample, percent of the table
+            min_rows (int): Smallest table that gets a sample
+            seed (int): Seed of the sampling, so rebuilds of the same data give the same sample
+        """
+        self.conn = conn
+        self.table = table
+        self.key_column = key_column
+        self.percent = percent
+        self.min_rows = min_rows
+        self.seed = seed
+        self.sample_table = f"{table}_preview_sample"
+        self.source_rows = None
+        self.sample_rows = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.sample_rows is not None and self.sample_rows > 1
+
+    def refresh(self, force=False):
+        """
+        Rebuild the sample if the fact table changed, and read its size.
+
+        Args:
+            force (bool): Rebuild even if the table did not change
+
+        Returns:
+            bool: True if the sample was rebuilt
+        """
+        rebuilt = False
+        with self._lock:
+            cursor = self.conn.cursor()
+            try:
+                if not is_read_only(cursor):
+                    rebuilt = self._rebuild_if_changed(cursor, force)
+
+                tables = {row[0] for row in cursor.execute("SHOW TABLES").fetchall()}
+                row = None
+                if 'fact_samples' in tables and self.sample_table in tables:
+                    row = cursor.execute(
+                        "SELECT source_rows, sample_rows FROM fact_samples WHERE table_name = ?", [self.table]
+                    ).fetchone()
+                self.source_rows, self.sample_rows = row if row is not None else (None, None)
+            finally:
+                cursor.close()
+        if rebuilt:
+            logger.info(f"Preview sample of {self.table} rebuilt: {self.sample_rows} of {self.source_rows} rows")
+        return rebuilt
+
+    def _rebuild_if_changed(self, cursor, force):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fact_samples (
+                table_name TEXT PRIMARY KEY,
+                sample_table TEXT,
+                fingerprint TEXT,
+                source_rows BIGINT,
+                sample_rows BIGINT,
+                built_at TIMESTAMP
+            )
+        """)
+        tables = {row[0] for row in cursor.execute("SHOW TABLES").fetchall()}
+        if self.table not in tables:
+            return False
+        count, checksum = cursor.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(hash({self.key_column})), 0) FROM {self.table}"
+        ).fetchone()
+        fingerprint = f"{count}:{checksum}:{self.percent}"
+        stored = cursor.execute(
+            "SELECT fingerprint FROM fact_samples WHERE table_name = ?", [self.table]
+        ).fetchone()
+        if not force and stored is not None and stored[0] == fingerprint:
+            return False
+
+        cursor.execute("BEGIN TRANSACTION")
+        try:
+            cursor.execute("DELETE FROM fact_samples WHERE table_name = ?", [self.table])
+            if count < self.min_rows:
+                cursor.execute(f"DROP TABLE IF EXISTS {self.sample_table}")
+            else:
+                cursor.execute(f"""
+                    CREATE OR REPLACE TABLE {self.sample_table} AS
+                    SELECT * FROM {self.table} USING SAMPLE {self.percent} PERCENT (reservoir, {self.seed})
+                """)
+                cursor.execute(f"""
+                    INSERT INTO fact_samples
+                    SELECT ?, ?, ?, ?, COUNT(*), ? FROM {self.sample_table}
+                """, [self.table, self.sample_table, fingerprint, count, datetime.now()])
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return count >= self.min_rows
+
+
+class PreviewQuery:
+    """A query rewritten to read the fact sample, with the interval column of each estimate."""
+
+    def __init__(self, sql, intervals, fraction):
+        self.sql = sql
+        # Result column -> column with the half-width of its 95% confidence interval
+        self.intervals = intervals
+        # Share of the fact table in the sample
+        self.fraction = fraction
+
+
+class Preview:
+    """Approximate results of a query, and the exact results on their way."""
+
+    def __init__(self, results, query, exact):
+        self.results = results
+        self.intervals = query.intervals
+        self.fraction = query.fraction
+        # concurrent.futures.Future with the exact results
+        self.exact = exact
+
+
+class PreviewRewriter:
+    def __init__(self, conn, sample):
+        """
+        Rewrite aggregate queries over the fact table to read its sample.
+
+        Queries are parsed with DuckDB's own parser (json_serialize_sql) like
+        in SQLRewriter. The fact table is replaced with the sample; SUM and
+        COUNT are scaled up by table/sample rows, AVG is kept. For every
+        result column that is one such aggregate, a column with the
+        half-width of its 95% confidence interval is added, named
+        "<column> ±". Totals of a group are estimated as totals of the
+        sample rows in the group, whose variance under sampling without
+        replacement is N²(1 - n/N)s²/n, s² being the variance of the
+        group's values over all n sample rows (zero outside the group).
+
+        Queries the sample can't answer get no preview: without aggregates
+        (lists of rows), with other aggregates (MIN, MAX, COUNT(DISTINCT)),
+        with subqueries or CTEs, or reading the fact table more than once.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the analytics database
+            sample (FactSample): The sample of the fact table
+        """
+        self.conn = conn
+        self.sample = sample
+        self._local = threading.local()
+
+    @property
+    def _cursor(self):
+        return self._local.cursor
+
+    def rewrite(self, sql):
+        """
+        Rewrite a query to read the sample.
+
+        Args:
+            sql (str): The SQL query
+
+        Returns:
+            PreviewQuery: The rewritten query, or None if the sample can't answer it
+        """
+        if not self.sample.available:
+            return None
+        cursor = self.conn.cursor()
+        try:
+            self._local.cursor = cursor
+            tree = json.loads(cursor.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+            if tree.get('error') or len(tree['statements']) != 1:
+                return None
+            node = tree['statements'][0]['node']
+            reason = self._unsupported(node)
+            if reason is not None:
+                logger.info(f"No preview for the query: {reason}")
+                return None
+
+            names = [row[0] for row in cursor.execute(f"DESCRIBE {sql}").fetchall()]
+            intervals = self._rewrite_select(node, names)
+            preview_sql = cursor.execute("SELECT json_deserialize_sql(?)", [json.dumps(tree)]).fetchone()[0]
+            logger.info(f"Preview SQL query: {preview_sql}")
+            return PreviewQuery(preview_sql, intervals, self.sample.sample_rows / self.sample.source_rows)
+        except Exception as e:
+            # Previews are an optimization: the exact query runs anyway
+            logger.error(f"Error rewriting SQL for a preview: {e}")
+            return None
+        finally:
+            self._local.cursor = None
+            cursor.close()
+
+    def _unsupported(self, node):
+        """Why the sample can't answer a query, or None if it can."""
+        if node.get('type') != 'SELECT_NODE':
+            return "not a single SELECT"
+        if node.get('cte_map', {}).get('map'):
+            return "CTEs"
+        if any(n.get('class') == 'SUBQUERY' or n.get('type') == 'SUBQUERY' for n in _walk(node)):
+            return "subqueries"
+        facts = [
+            n for n in _walk(node.get('from_table'))
+            if n.get('type') == 'BASE_TABLE' and n.get('table_name', '').lower() == self.sample.table
+        ]
+        if len(facts) != 1:
+            return f"{len(facts)} references to {self.sample.table}"
+        if any(n.get('class') in ('STAR', 'COLUMNS') for n in _walk(node.get('select_list'))):
+            return "SELECT *"
+        aggregates = self._aggregates(node)
+        if not aggregates:
+            return "no aggregates"
+        for aggregate in aggregates:
+            name = aggregate['function_name'].lower()
+            if name not in TOTAL_AGGREGATES | AVERAGE_AGGREGATES or aggregate.get('distinct'):
+                return f"aggregate {aggregate['function_name']}{' DISTINCT' if aggregate.get('distinct') else ''}"
+        return None
+
+    def _aggregates(self, node):
+        aggregate_names = self._aggregate_names()
+        return [
+            n for n in _walk(node)
+            if n.get('class') == 'FUNCTION' and n.get('function_name', '').lower() in aggregate_names
+        ]
+
+    def _aggregate_names(self):
+        if not hasattr(self, '_aggregate_function_names'):
+            self._aggregate_function_names = {
+                row[0].lower() for row in self._cursor.execute(
+                    "SELECT DISTINCT function_name FROM duckdb_functions() WHERE function_type = 'aggregate'"
+                ).fetchall()
+            }
+        return self._aggregate_function_names
+
+    def _rewrite_select(self, node, names):
+        """Point the query at the sample, scale its totals and add the interval columns."""
+        fact = next(
+            n for n in _walk(node['from_table'])
+            if n.get('type') == 'BASE_TABLE' and n.get('table_name', '').lower() == self.sample.table
+        )
+        # Columns qualified with the table name keep resolving
+        fact['alias'] = fact.get('alias') or fact['table_name']
+        fact['table_name'] = self.sample.sample_table
+
+        source_rows, sample_rows = self.sample.source_rows, self.sample.sample_rows
+        scale = source_rows / sample_rows
+        # N²(1 - n/N) / (n(n - 1)): the variance of an estimated total per
+        # unit of the sample sum of squared deviations
+        variance_factor = source_rows ** 2 * (1 - sample_rows / source_rows) / (sample_rows * (sample_rows - 1))
+
+        # Interval columns are built from the aggregates as written, before scaling
+        interval_items = []
+        intervals = {}
+        for item, name in zip(node['select_list'], names):
+            aggregate = item
+            if aggregate.get('class') == 'FUNCTION' and aggregate.get('function_name', '').lower() == 'round':
+                aggregate = aggregate['children'][0]
+            if aggregate.get('class') != 'FUNCTION' or aggregate not in self._aggregates(item):
+                continue
+            interval = self._interval_sql(aggregate, variance_factor, sample_rows)
+            interval_item = self._parse_expression(interval)
+            interval_item['alias'] = f"{name} ±"
+            interval_items.append(interval_item)
+            intervals[name] = f"{name} ±"
+
+        for item, name in zip(node['select_list'], names):
+            if self._aggregates(item):
+                # Scaled expressions keep the names of the exact query's columns
+                item['alias'] = name
+        for aggregate in self._aggregates(node):
+            if aggregate['function_name'].lower() not in TOTAL_AGGREGATES:
+                continue
+            scaled = f"({self._render(aggregate)} * {scale!r})"
+            if aggregate['function_name'].lower() != 'sum':
+                scaled = f"CAST(round({scaled}) AS BIGINT)"
+            alias = aggregate.get('alias', '')
+            aggregate.clear()
+            aggregate.update(self._parse_expression(scaled))
+            aggregate['alias'] = alias
+
+        node['select_list'].extend(interval_items)
+        return intervals
+
+    def _interval_sql(self, aggregate, variance_factor, sample_rows):
+        """SQL of the 95% confidence interval half-width of an aggregate."""
+        name = aggregate['function_name'].lower()
+        condition = f" FILTER (WHERE {self._render(aggregate['filter'])})" if aggregate.get('filter') else ""
+        if name == 'count_star' or name == 'count':
+            count = f"({self._render(aggregate)})"
+            deviations = f"{count} - {count} ^ 2 / {sample_rows}"
+            return f"{Z_95} * sqrt(greatest({variance_factor!r} * ({deviations}), 0))"
+
+        value = f"CAST({self._render(aggregate['children'][0])} AS DOUBLE)"
+        if name == 'sum':
+            deviations = f"sum({value} ^ 2){condition} - (sum({value}){condition}) ^ 2 / {sample_rows}"
+            return f"{Z_95} * sqrt(greatest({variance_factor!r} * ({deviations}), 0))"
+        # Mean of the sample rows of the group
+        correction = 1 - self.sample.sample_rows / self.sample.source_rows
+        return f"{Z_95} * stddev_samp({value}){condition} * sqrt({correction!r} / count({value}){condition})"
+
+    def _render(self, expression):
+        """Render an expression node back to SQL text, without its alias."""
+        skeleton = json.loads(self._cursor.execute("SELECT json_serialize_sql('SELECT 1')").fetchone()[0])
+        skeleton['statements'][0]['node']['select_list'] = [{**expression, 'alias': ''}]
+        sql = self._cursor.execute("SELECT json_deserialize_sql(?)", [json.dumps(skeleton)]).fetchone()[0]
+        return sql[len("SELECT "):]
+
+    def _parse_expression(self, expression_sql):
+        """Parse an expression into an AST node."""
+        tree = json.loads(self._cursor.execute(
+            "SELECT json_serialize_sql(?)", [f"SELECT {expression_sql}"]
+        ).fetchone()[0])
+        return tree['statements'][0]['node']['select_list'][0]
@@ -0,0 +1,331 @@
+import os
+import shutil
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from utils.metrics import QueryMetrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _write_stream(buffer, table):
+    """Write a table as an Arrow IPC stream into a buffer; the views of it are released on return."""
+    import pyarrow as pa
+
+    sink = pa.FixedSizeBufferWriter(pa.py_buffer(buffer))
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    sink.close()
+
+
+def _read_stream(buffer):
+    """Read an Arrow IPC stream from a buffer into a DataFrame."""
+    import pyarrow as pa
+
+    # to_pandas keeps zero-copy views of numeric columns; a single copy of
+    # the stream lets the shared memory segment be freed right away
+    return pa.ipc.open_stream(pa.py_buffer(bytes(buffer))).read_all().to_pandas()
+
+
+def _worker_temp_directory(temp_directory, pid):
+    return os.path.join(temp_directory, f"sandbox-{pid}") if temp_directory else None
+
+
+def _worker_main(db_file, memory_limit, threads, temp_directory, channel):
+    """
+    Worker process: run queries on a read-only connection and hand the
+    results back as Arrow IPC streams written into shared memory.
+    """
+    import duckdb
+    import pyarrow as pa
+    import pandas  # noqa: F401 - loaded before reporting ready, not on the first query
+
+    settings = {'memory_limit': memory_limit, 'threads': threads}
+    config = dict(settings)
+    # Each worker spills into its own directory, so instances never share temp files
+    spill_directory = _worker_temp_directory(temp_directory, os.getpid())
+    if spill_directory:
+        config['temp_directory'] = spill_directory
+    conn = duckdb.connect(db_file, read_only=True, config=config)
+    # No progress bar on the app's terminal for long queries
+    conn.execute("SET enable_progress_bar = false")
+    channel.send(('ready',))
+    while True:
+        try:
+            task = channel.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        query, query_settings = task
+        try:
+            # The worker runs one query at a time, so instance-wide settings
+            # act as per-query resources
+            for name, value in {**settings, **(query_settings or {})}.items():
+                if config.get(name) != value:
+                    conn.execute(f"SET {name} = '{value}'")
+                    config[name] = value
+            # Converted as in the app process (DECIMAL to float, DATE to
+            # datetime64); the pandas metadata restores the dtypes on the other side
+            table = pa.Table.from_pandas(conn.execute(query).fetchdf(), preserve_index=False)
+
+            # Measure the stream first, then write it straight into the segment
+            sizer = pa.MockOutputStream()
+            with pa.ipc.new_stream(sizer, table.schema) as writer:
+                writer.write_table(table)
+            size = sizer.size()
+            segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            try:
+                _write_stream(segment.buf, table)
+            except Exception:
+                segment.close()
+                segment.unlink()
+                raise
+            segment.close()
+            channel.send(('ok', segment.name, size))
+        except Exception as e:
+            channel.send(('error', str(e)))
+    conn.close()
+    if spill_directory:
+        shutil.rmtree(spill_directory, ignore_errors=True)
+
+
+class _Worker:
+    """A worker process, the pipe to it and the database file it opened."""
+
+    def __init__(self, process, channel, db_file, temp_directory=None):
+        self.process = process
+        self.channel = channel
+        self.db_file = db_file
+        self.temp_directory = temp_directory
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(5)
+        self.channel.close()
+        # A killed worker leaves its spill files behind
+        spill_directory = _worker_temp_directory(self.temp_directory, self.process.pid)
+        if spill_directory:
+            shutil.rmtree(spill_directory, ignore_errors=True)
+
+
+class SandboxPool:
+    def __init__(self, db_file, workers=2, memory_limit="1GB", threads=2, temp_directory=None, start_timeout=60):
+        """
+        Run queries in a pool of worker processes instead of the app process.
+
+        Each worker holds its own read-only DuckDB connection with a memory
+        limit, so a pathological query can exhaust only its worker. Results
+        come back as Arrow IPC streams in shared memory. A query that
+        exceeds its timeout is stopped by killing the worker, which is
+        replaced by a fresh one; thread-based timeouts can only interrupt.
+
+        Args:
+            db_file (str): Path to the database file
+            workers (int): Number of worker processes
+            memory_limit (str): DuckDB memory limit per worker, e.g. "1GB"
+            threads (int): DuckDB threads per worker
+            temp_directory (str, optional): Directory for spill files; each
+                worker uses its own subdirectory
+            start_timeout (float): Seconds to wait for a worker to connect
+        """
+        self.db_file = db_file
+        self.workers = workers
+        self.memory_limit = memory_limit
+        self.threads = threads
+        self.temp_directory = temp_directory
+        self.start_timeout = start_timeout
+        # spawn, not fork: the app process runs threads that fork would copy mid-flight
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._rotate_lock = threading.Lock()
+        self._workers = set()
+        self.executed = 0
+        self.killed = 0
+        self.crashed = 0
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+        logger.info(f"Sandbox pool of {workers} workers started for {db_file} (memory limit {memory_limit} each)")
+
+    def _spawn(self):
+        channel, child_channel = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.db_file, self.memory_limit, self.threads, self.temp_directory, child_channel),
+            name="duckdb-sandbox",
+            daemon=True,
+        )
+        process.start()
+        child_channel.close()
+        if not channel.poll(self.start_timeout):
+            process.kill()
+            raise Exception(f"Процесс выполнения запросов не запустился за {self.start_timeout} секунд")
+        try:
+            channel.recv()
+        except EOFError:
+            process.join(5)
+            raise Exception(f"Процесс выполнения запросов завершился при запуске (код {process.exitcode})")
+        worker = _Worker(process, channel, self.db_file, self.temp_directory)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _stop(self, worker):
+        """Let a worker exit after its connection is closed, or kill it if it doesn't."""
+        with self._lock:
+            self._workers.discard(worker)
+        try:
+            worker.channel.send(None)
+        except OSError:
+            pass
+        worker.process.join(5)
+        if worker.process.is_alive():
+            worker.kill()
+
+    def _replace_later(self, worker):
+        """Kill a worker and start its replacement in the background, so the caller fails fast."""
+        with self._lock:
+            self._workers.discard(worker)
+        worker.kill()
+
+        def respawn():
+            try:
+                self._idle.put(self._spawn())
+            except Exception as e:
+                logger.error(f"Sandbox worker not replaced: {e}")
+
+        threading.Thread(target=respawn, name="sandbox-respawn", daemon=True).start()
+
+    def execute(self, query, timeout=10, metrics=None, settings=None):
+        """
+        Run a query on a free worker.
+
+        Args:
+            query (str): The SQL query
+            timeout (float): Seconds before the worker is killed; waiting
+                for a free worker counts against it
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings
+            settings (dict, optional): DuckDB settings for this query
+                (threads, memory_limit), instead of the worker defaults
+
+        Returns:
+            pandas.DataFrame: The query results
+
+        Raises:
+            Exception: On query errors, timeouts and worker crashes
+        """
+        metrics = metrics or QueryMetrics()
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise Exception(f"Нет свободного процесса для выполнения запроса ({timeout} секунд)")
+
+        try:
+            with metrics.stage('sql_exec'):
+                try:
+                    worker.channel.send((query, settings))
+                    finished = worker.channel.poll(max(deadline - time.monotonic(), 0))
+                    reply = worker.channel.recv() if finished else None
+                except (EOFError, OSError):
+                    # The worker died, e.g. killed by the OS for running out of memory
+                    with self._lock:
+                        self.crashed += 1
+                    logger.error(f"Sandbox worker {worker.process.pid} crashed (exit code {worker.process.exitcode})")
+                    self._replace_later(worker)
+                    worker = None
+                    raise Exception("Процесс выполнения запроса завершился аварийно")
+                if reply is None:
+                    with self._lock:
+                        self.killed += 1
+                    logger.warning(f"Killing sandbox worker {worker.process.pid} after {timeout} seconds")
+                    self._replace_later(worker)
+                    worker = None
+                    raise Exception(f"Запрос превысил ограничение времени выполнения ({timeout} секунд)")
+
+            if reply[0] == 'error':
+                raise Exception(reply[1])
+
+            _, name, size = reply
+            with metrics.stage('fetch'):
+                df = self._read_segment(name, size)
+            with self._lock:
+                self.executed += 1
+            return df
+        finally:
+            if worker is not None:
+                self._idle.put(worker)
+
+    def _read_segment(self, name, size):
+        """Decode an Arrow IPC stream from shared memory and free the segment."""
+        segment = shared_memory.SharedMemory(name=name)
+        try:
+            return _read_stream(segment.buf[:size])
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def restart(self, db_file):
+        """
+        Switch the workers to another database file without losing capacity.
+
+        Workers are rotated in the background: a replacement for the new file
+        is started before a worker of the old one is stopped, and until then
+        the old workers keep serving queries from the old file.
+
+        Args:
+            db_file (str): The new database file
+        """
+        self.db_file = db_file
+        threading.Thread(target=self._rotate, name="sandbox-rotate", daemon=True).start()
+        logger.info(f"Sandbox pool switching to {db_file}")
+
+    def _stale(self):
+        with self._lock:
+            return sum(1 for worker in self._workers if worker.db_file != self.db_file)
+
+    def _rotate(self):
+        with self._rotate_lock:
+            while self._stale():
+                try:
+                    self._idle.put(self._spawn())
+                except Exception as e:
+                    logger.error(f"Sandbox worker for {self.db_file} not started: {e}")
+                    return
+                self._retire_stale()
+        logger.info(f"Sandbox pool switched to {self.db_file}")
+
+    def _retire_stale(self):
+        """Stop a worker of an old file once it is idle."""
+        while self._stale():
+            worker = self._idle.get()
+            if worker.db_file != self.db_file:
+                self._stop(worker)
+                return
+            self._idle.put(worker)
+            time.sleep(0.01)
+
+    def close(self):
+        """Stop all workers."""
+        for _ in range(self.workers):
+            try:
+                worker = self._idle.get(timeout=self.start_timeout)
+            except queue.Empty:
+                break
+            self._stop(worker)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'idle': self._idle.qsize(),
+                'executed': self.executed,
+                'killed': self.killed,
+                'crashed': self.crashed,
+            }
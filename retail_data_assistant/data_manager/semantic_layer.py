@@ -0,0 +1,493 @@
+import json
+import os
+import logging
+from collections import deque
+from datetime import date
+from .query_executor import inline_params
+from .sketches import SKETCH_KEYS, SKETCH_TABLE, SKETCHED_COLUMNS
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+FILTER_OPERATORS = {'=', '!=', '>', '>=', '<', '<=', 'in', 'not in'}
+SORT_ORDERS = {'asc', 'desc'}
+MAX_METRICS = 5
+MAX_DIMENSIONS = 3
+
+
+class SpecValidationError(Exception):
+    """Raised when a query spec refers to unknown metrics, dimensions or periods."""
+
+
+class CompiledQuery:
+    """SQL compiled from a query spec, with named parameters ($name)."""
+
+    def __init__(self, sql, params, spec, description=None):
+        self.sql = sql
+        self.params = params
+        self.spec = spec
+        # Shown with the answer, e.g. when counts are estimated from sketches
+        self.description = description
+
+    @property
+    def display_sql(self):
+        """The SQL with parameters substituted, for display and logging."""
+        return inline_params(self.sql, self.params)
+
+
+class SemanticLayer:
+    def __init__(self, max_rows=1000, sketches=None):
+        """
+        Compile compact JSON query specs into DuckDB SQL.
+
+        Metrics are the business terms of dictionary.json, dimensions and
+        periods are declared in semantic_model.json, and joins are derived
+        from the many-to-one relationships in schema.json, so the compiled
+        SQL never fans out the fact table.
+
+        Distinct counts with a "sketch" in semantic_model.json are read from
+        the HyperLogLog sketches instead of sales when every dimension and
+        filter of the spec joins to the sketch grain (day, store, category):
+        registers are merged per group, then the count is estimated.
+
+        Args:
+            max_rows (int): Row limit for specs without a limit
+            sketches (data_manager.sketches.DistinctSketches, optional): The
+                distinct count sketches; without them counts are exact
+        """
+        self.max_rows = max_rows
+        self.sketches = sketches
+        self.metadata_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metadata")
+        schema = self._load_json("schema.json")
+        dictionary = self._load_json("dictionary.json")
+        model = self._load_json("semantic_model.json")
+
+        self.columns = {
+            table['name']: {column['name'] for column in table['columns']}
+            for table in schema.get('tables', [])
+        }
+        self.fact_table = model['fact_table']
+        self.aliases = model['aliases']
+        self.join_paths = self._join_paths(schema.get('relationships', []))
+        self.sketch_paths = self._sketch_paths()
+
+        terms = {term['term']: term for term in dictionary.get('business_terms', [])}
+        self.metrics = {}
+        for term, spec in model.get('metrics', {}).items():
+            if term not in terms:
+                logger.warning(f"Metric '{term}' is not in dictionary.json, skipped")
+                continue
+            tables = spec.get('tables') or sorted({
+                column.split('.')[0] for column in terms[term].get('related_columns', [])
+            })
+            if spec.get('sketch') is not None and spec['sketch'] not in SKETCHED_COLUMNS:
+                logger.warning(f"Metric '{term}' refers to unknown sketch '{spec['sketch']}', counted exactly")
+            self.metrics[term] = {
+                'name': spec['name'],
+                'sql': spec.get('sql', terms[term]['sql_representation']),
+                'definition': terms[term].get('definition', ''),
+                'tables': tables,
+                'sketch': spec.get('sketch') if spec.get('sketch') in SKETCHED_COLUMNS else None,
+            }
+
+        self.dimensions = {}
+        for name, spec in model.get('dimensions', {}).items():
+            table, column = spec['table'], spec['column']
+            if 'sql' not in spec and column not in self.columns.get(table, set()):
+                logger.warning(f"Dimension '{name}' refers to unknown column {table}.{column}, skipped")
+                continue
+            self.dimensions[name] = {
+                'label': spec['label'],
+                'name': column,
+                'sql': spec.get('sql', f"{self.aliases[table]}.{column}"),
+                'table': table,
+            }
+
+        self.time_grains = {
+            grain: f"{self.aliases['calendar']}.{column}"
+            for grain, column in model.get('time_grains', {}).items()
+            if column in self.columns.get('calendar', set())
+        }
+        self.periods = model.get('periods', {})
+        self.examples = model.get('examples', [])
+
+        unreachable = {
+            table for table in self._tables_for_metrics_and_dimensions() if table not in self.join_paths
+        }
+        if unreachable:
+            logger.warning(f"Tables not reachable from {self.fact_table}: {sorted(unreachable)}")
+        logger.info(
+            f"Semantic layer initialized with {len(self.metrics)} metrics, "
+            f"{len(self.dimensions)} dimensions and {len(self.periods)} periods"
+        )
+
+    def _load_json(self, filename):
+        """Load JSON file from metadata directory."""
+        with open(os.path.join(self.metadata_dir, filename), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _join_paths(self, relationships):
+        """
+        Shortest many-to-one join path from the fact table to every reachable table.
+
+        Returns:
+            dict: table -> list of (from_table, from_column, to_table, to_column)
+        """
+        edges = {}
+        for relationship in relationships:
+            if relationship.get('type') != 'many-to-one':
+                continue
+            source, target = relationship['from'], relationship['to']
+            edges.setdefault(source['table'], []).append(
+                (source['table'], source['column'], target['table'], target['column'])
+            )
+
+        paths = {self.fact_table: []}
+        queue = deque([self.fact_table])
+        while queue:
+            table = queue.popleft()
+            for edge in edges.get(table, []):
+                if edge[2] not in paths and edge[2] in self.aliases:
+                    paths[edge[2]] = paths[table] + [edge]
+                    queue.append(edge[2])
+        return paths
+
+    def _sketch_paths(self):
+        """
+        Join paths from the sketch table: a path from the fact table that
+        passes through a column of the sketch grain starts from the sketch
+        table's copy of that column (sales -> products -> categories becomes
+        sketches -> categories).
+
+        Returns:
+            dict: table -> list of (from_table, from_column, to_table, to_column)
+        """
+        keys = {source: key for key, source in SKETCH_KEYS.items()}
+        paths = {}
+        for table, path in self.join_paths.items():
+            for i, (source, column, target, target_column) in enumerate(path):
+                key = keys.get(f"{source}.{column}")
+                if key is not None:
+                    paths[table] = [(self.fact_table, key, target, target_column)] + path[i + 1:]
+        return paths
+
+    def _tables_for_metrics_and_dimensions(self):
+        tables = {d['table'] for d in self.dimensions.values()}
+        for metric in self.metrics.values():
+            tables.update(metric['tables'])
+        return tables
+
+    def describe(self):
+        """
+        Describe metrics, dimensions, time grains and periods for the LLM prompt.
+
+        Returns:
+            str: The semantic model as compact text
+        """
+        lines = ["Метрики (поле metrics):"]
+        lines += [f"- {term}: {metric['definition']}" for term, metric in self.metrics.items()]
+        lines.append("Измерения (поля dimensions, filters[].dimension):")
+        lines += [f"- {name}: {dimension['label']}" for name, dimension in self.dimensions.items()]
+        lines.append(f"Детализация по времени (поле time_grain): {', '.join(self.time_grains)}")
+        lines.append(
+            "Периоды (поле period): {\"name\": <период>} где период один из "
+            + ", ".join(self.periods)
+            + "; для last_n_* добавь \"n\"; к периодам года можно добавить \"quarter\" (1-4) или \"month\" (1-12); "
+            "произвольный интервал: {\"from\": \"YYYY-MM-DD\", \"to\": \"YYYY-MM-DD\"}"
+        )
+        lines.append("Примеры:")
+        for example in self.examples:
+            lines.append(f"{example['question']}\n{json.dumps(example['spec'], ensure_ascii=False)}")
+        return "\n".join(lines)
+
+    def validate(self, spec):
+        """
+        Check a spec against the semantic model and fill in defaults.
+
+        Args:
+            spec (dict): The query spec
+
+        Returns:
+            dict: The normalized spec
+
+        Raises:
+            SpecValidationError: If the spec refers to unknown names or is malformed
+        """
+        if not isinstance(spec, dict):
+            raise SpecValidationError("Спецификация должна быть JSON объектом")
+
+        metrics = spec.get('metrics') or []
+        if not isinstance(metrics, list) or not 1 <= len(metrics) <= MAX_METRICS:
+            raise SpecValidationError(f"Нужно от 1 до {MAX_METRICS} метрик")
+        for metric in metrics:
+            if metric not in self.metrics:
+                raise SpecValidationError(f"Неизвестная метрика: {metric}")
+
+        dimensions = spec.get('dimensions') or []
+        if not isinstance(dimensions, list) or len(dimensions) > MAX_DIMENSIONS:
+            raise SpecValidationError(f"Допускается не более {MAX_DIMENSIONS} измерений")
+        for dimension in dimensions:
+            if dimension not in self.dimensions:
+                raise SpecValidationError(f"Неизвестное измерение: {dimension}")
+
+        time_grain = spec.get('time_grain')
+        if time_grain is not None and time_grain not in self.time_grains:
+            raise SpecValidationError(f"Неизвестная детализация по времени: {time_grain}")
+
+        period = self._validate_period(spec.get('period'))
+
+        filters = spec.get('filters') or []
+        for condition in filters:
+            if not isinstance(condition, dict) or condition.get('dimension') not in self.dimensions:
+                raise SpecValidationError(f"Неизвестное измерение в фильтре: {condition}")
+            self._validate_condition(condition)
+
+        having = spec.get('having') or []
+        for condition in having:
+            if not isinstance(condition, dict) or condition.get('metric') not in self.metrics:
+                raise SpecValidationError(f"Неизвестная метрика в условии: {condition}")
+            self._validate_condition(condition)
+            if condition['op'] in ('in', 'not in') or not isinstance(condition['value'], (int, float)):
+                raise SpecValidationError(f"Условие на метрику должно сравнивать с числом: {condition}")
+
+        outputs = set(metrics) | set(dimensions) | ({'time', time_grain} if time_grain else set())
+        sort = spec.get('sort') or []
+        for item in sort:
+            if not isinstance(item, dict) or item.get('by') not in outputs:
+                raise SpecValidationError(f"Сортировка по полю, которого нет в результате: {item}")
+            if item.get('order', 'desc') not in SORT_ORDERS:
+                raise SpecValidationError(f"Неизвестный порядок сортировки: {item.get('order')}")
+
+        limit = spec.get('limit')
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+            raise SpecValidationError(f"Некорректный limit: {limit}")
+
+        return {
+            'metrics': metrics,
+            'dimensions': dimensions,
+            'time_grain': time_grain,
+            'period': period,
+            'filters': filters,
+            'having': having,
+            'sort': sort,
+            'limit': min(limit or self.max_rows, self.max_rows),
+            'rollup': bool(spec.get('rollup')) and bool(dimensions or time_grain),
+        }
+
+    def _validate_period(self, period):
+        if period is None:
+            return None
+        if not isinstance(period, dict):
+            raise SpecValidationError(f"Некорректный период: {period}")
+
+        if 'from' in period or 'to' in period:
+            try:
+                date_from = date.fromisoformat(period['from']) if period.get('from') else None
+                date_to = date.fromisoformat(period['to']) if period.get('to') else None
+            except (TypeError, ValueError):
+                raise SpecValidationError(f"Даты периода должны быть в формате YYYY-MM-DD: {period}")
+            if date_from and date_to and date_from > date_to:
+                raise SpecValidationError(f"Начало периода позже конца: {period}")
+            return {'from': date_from, 'to': date_to}
+
+        name = period.get('name')
+        if name not in self.periods:
+            raise SpecValidationError(f"Неизвестный период: {name}")
+        normalized = {'name': name}
+        if '$period_n' in self.periods[name]:
+            n = period.get('n')
+            if not isinstance(n, int) or isinstance(n, bool) or n < 1:
+                raise SpecValidationError(f"Для периода {name} нужно целое n >= 1")
+            normalized['n'] = n
+        for part, upper in (('quarter', 4), ('month', 12)):
+            value = period.get(part)
+            if value is not None:
+                if not isinstance(value, int) or not 1 <= value <= upper:
+                    raise SpecValidationError(f"Некорректное значение {part}: {value}")
+                normalized[part] = value
+        return normalized
+
+    def _validate_condition(self, condition):
+        op = str(condition.get('op', '=')).lower()
+        if op not in FILTER_OPERATORS:
+            raise SpecValidationError(f"Неизвестный оператор: {condition.get('op')}")
+        if 'value' not in condition:
+            raise SpecValidationError(f"В условии нет значения: {condition}")
+        if op in ('in', 'not in') and not isinstance(condition['value'], list):
+            raise SpecValidationError(f"Для оператора {op} нужен список значений: {condition}")
+        condition['op'] = op
+
+    def compile(self, spec):
+        """
+        Compile a query spec into parameterized DuckDB SQL.
+
+        Args:
+            spec (dict): The query spec (validated here)
+
+        Returns:
+            CompiledQuery: SQL with named parameters and their values
+
+        Raises:
+            SpecValidationError: If the spec is invalid
+        """
+        spec = self.validate(spec)
+        sketched = self._sketched(spec)
+        tables, select, group_by, where, having, params = set(), [], [], [], [], {}
+        calendar = self.aliases['calendar']
+        fact = self.aliases[self.fact_table]
+        # Output names of the grouping columns
+        groups = []
+
+        if spec['time_grain']:
+            expression = self.time_grains[spec['time_grain']]
+            select.append(f"{expression} AS {spec['time_grain']}")
+            group_by.append(expression)
+            groups.append(spec['time_grain'])
+            tables.add('calendar')
+        for name in spec['dimensions']:
+            dimension = self.dimensions[name]
+            select.append(f"{dimension['sql']} AS {dimension['name']}")
+            group_by.append(dimension['sql'])
+            groups.append(dimension['name'])
+            tables.add(dimension['table'])
+        if sketched:
+            # Registers of the metrics' sketches, merged per group here and
+            # estimated in the outer query
+            registers = list(dict.fromkeys(
+                self.metrics[term]['sketch']
+                for term in spec['metrics'] + [condition['metric'] for condition in spec['having']]
+            ))
+            select.append(f"{fact}.bucket")
+            select += [f"MAX({fact}.{name}_rho) AS {name}_rho" for name in registers]
+        else:
+            for term in spec['metrics']:
+                metric = self.metrics[term]
+                select.append(f"{metric['sql']} AS {metric['name']}")
+                tables.update(metric['tables'])
+
+        period = spec['period']
+        if period and 'name' in period:
+            where.append(self.periods[period['name']])
+            if 'n' in period:
+                params['period_n'] = period['n']
+            for part in ('quarter', 'month'):
+                if part in period:
+                    where.append(f"{calendar}.{part} = $period_{part}")
+                    params[f"period_{part}"] = period[part]
+            tables.add('calendar')
+        elif period:
+            # Explicit dates filter the fact table directly, which keeps the
+            # predicate on sale_date usable for zone map pruning
+            date_column = f"{self.aliases[self.fact_table]}.sale_date"
+            if period['from']:
+                where.append(f"{date_column} >= $date_from")
+                params['date_from'] = period['from']
+            if period['to']:
+                where.append(f"{date_column} <= $date_to")
+                params['date_to'] = period['to']
+
+        for i, condition in enumerate(spec['filters'], start=1):
+            dimension = self.dimensions[condition['dimension']]
+            name = f"{condition['dimension']}_{i}"
+            where.append(self._condition(dimension['sql'], condition['op'], name))
+            params[name] = condition['value']
+            tables.add(dimension['table'])
+
+        for i, condition in enumerate(spec['having'], start=1):
+            name = f"having_{i}"
+            metric = self.metrics[condition['metric']]
+            expression = self.sketches.estimate_sql(metric['sketch']) if sketched else metric['sql']
+            having.append(self._condition(expression, condition['op'], name))
+            params[name] = condition['value']
+
+        if sketched:
+            sql = f"SELECT {', '.join(select)} FROM {SKETCH_TABLE} {fact}"
+            for join in self._joins(tables, self.sketch_paths):
+                sql += f" {join}"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += f" GROUP BY {', '.join(group_by + [f'{fact}.bucket'])}"
+            estimates = [
+                f"{self.sketches.estimate_sql(self.metrics[term]['sketch'])} AS {self.metrics[term]['name']}"
+                for term in spec['metrics']
+            ]
+            sql = f"SELECT {', '.join(groups + estimates)} FROM ({sql}) registers"
+            if groups:
+                sql += f" GROUP BY {', '.join(groups)}"
+        else:
+            sql = f"SELECT {', '.join(select)} FROM {self.fact_table} {fact}"
+            for join in self._joins(tables):
+                sql += f" {join}"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            if group_by:
+                sql += f" GROUP BY ROLLUP ({', '.join(group_by)})" if spec['rollup'] else f" GROUP BY {', '.join(group_by)}"
+        if having:
+            sql += " HAVING " + " AND ".join(having)
+        sql += " ORDER BY " + ", ".join(self._order_by(spec, group_by))
+        sql += " LIMIT $top_n"
+        params['top_n'] = spec['limit']
+
+        description = None
+        if sketched:
+            description = (
+                f"Количество уникальных значений оценено по скетчам HyperLogLog: "
+                f"погрешность до ±{2 * self.sketches.relative_error * 100:.1f}% с вероятностью 95%"
+            )
+        return CompiledQuery(sql, params, spec, description=description)
+
+    def _sketched(self, spec):
+        """Whether a validated spec is answered from the distinct count sketches."""
+        if self.sketches is None or not self.sketches.available or spec['rollup']:
+            return False
+        terms = spec['metrics'] + [condition['metric'] for condition in spec['having']]
+        if not all(self.metrics[term]['sketch'] for term in terms):
+            return False
+        tables = {self.dimensions[name]['table'] for name in spec['dimensions']}
+        tables.update(self.dimensions[condition['dimension']]['table'] for condition in spec['filters'])
+        return all(table in self.sketch_paths for table in tables)
+
+    def _condition(self, expression, op, name):
+        if op == 'in':
+            return f"list_contains(${name}, {expression})"
+        if op == 'not in':
+            return f"NOT list_contains(${name}, {expression})"
+        return f"{expression} {op} ${name}"
+
+    def _joins(self, tables, paths=None):
+        """JOIN clauses for the tables, parents first, each table once."""
+        paths = paths if paths is not None else self.join_paths
+        edges = []
+        for table in sorted(tables, key=lambda t: (len(paths.get(t, [])), t == 'calendar', t)):
+            if table not in paths:
+                raise SpecValidationError(f"Таблица {table} не связана с {self.fact_table}")
+            for edge in paths[table]:
+                if edge not in edges:
+                    edges.append(edge)
+        return [
+            f"JOIN {target} {self.aliases[target]} ON "
+            f"{self.aliases[source]}.{source_column} = {self.aliases[target]}.{target_column}"
+            for source, source_column, target, target_column in edges
+        ]
+
+    def _order_by(self, spec, group_by):
+        """ORDER BY items: the requested sort, else time series by time, else by the first metric."""
+        columns = {term: self.metrics[term]['name'] for term in spec['metrics']}
+        columns.update({name: self.dimensions[name]['name'] for name in spec['dimensions']})
+        if spec['time_grain']:
+            columns['time'] = columns[spec['time_grain']] = spec['time_grain']
+
+        if spec['sort']:
+            items = [
+                f"{columns[item['by']]} {item.get('order', 'desc').upper()} NULLS LAST" for item in spec['sort']
+            ]
+        elif spec['time_grain']:
+            items = [f"{spec['time_grain']} ASC NULLS LAST", f"{columns[spec['metrics'][0]]} DESC NULLS LAST"]
+        else:
+            items = [f"{columns[spec['metrics'][0]]} DESC NULLS LAST"]
+
+        # Rollup subtotals come after the detail rows
+        if spec['rollup']:
+            items.insert(0, f"GROUPING_ID({', '.join(group_by)})")
+        return items
@@ -0,0 +1,307 @@
+import duckdb
+import logging
+import math
+import threading
+from datetime import datetime
+from .db_bootstrap import is_read_only
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SKETCH_TABLE = 'distinct_sketches'
+
+# Grain of the sketches: column of the sketch table -> column it is read
+# from. Tables joined to sales through these columns (stores, categories,
+# calendar) can filter and group sketched counts.
+SKETCH_KEYS = {
+    'sale_date': 'sales.sale_date',
+    'store_id': 'sales.store_id',
+    'category_id': 'products.category_id',
+}
+
+# Sketched distinct counts: name -> column of sales whose distinct values
+# are counted. Each one is a register column "<name>_rho" of the sketch table.
+SKETCHED_COLUMNS = {
+    'customers': 'customer_id',
+    'receipts': 'sale_id',
+}
+
+
+def relative_error(precision):
+    """
+    Relative standard error of a HyperLogLog estimate.
+
+    Args:
+        precision (int): Bits of the hash that pick the register
+
+    Returns:
+        float: Standard error as a share of the count; 95% of the
+            estimates are within about twice that
+    """
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def estimate_sql(register, precision):
+    """
+    SQL aggregate estimating a distinct count from merged registers.
+
+    The argument is the register column of rows with one row per register
+    (bucket) of the group; buckets without a row are empty. Small counts,
+    while many registers are still empty, are estimated by linear counting,
+    which is close to exact there.
+
+    Args:
+        register (str): The register column
+        precision (int): Precision the registers were built with
+
+    Returns:
+        str: SQL expression, an aggregate over the group's registers
+    """
+    m = 1 << precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    filled = f"COUNT({register})"
+    raw = f"{alpha * m * m!r} / (SUM(pow(2.0, -{register})) + {m} - {filled})"
+    return (
+        f"CAST(round(CASE WHEN {filled} = 0 THEN 0 "
+        f"WHEN {raw} <= {2.5 * m!r} AND {filled} < {m} THEN {m} * ln({m} / ({m} - {filled})) "
+        f"ELSE {raw} END) AS BIGINT)"
+    )
+
+
+class DistinctSketches:
+    def __init__(self, conn, precision=12):
+        """
+        HyperLogLog sketches of distinct customers and receipts per day,
+        store and category, for distinct counts over any period without
+        scanning sales.
+
+        A sketch keeps, for each of 2^precision registers, the longest run
+        of trailing zero bits among the hashes of the values that fall into
+        it. Sketches merge by taking the maximum of each register, so the
+        count over a range of days, stores or categories is estimated from
+        the merged registers of its cells, with a relative standard error
+        of 1.04/sqrt(2^precision) (1.6% at precision 12) whatever the range.
+        Only registers that are set are stored, one row per cell and
+        register.
+
+        Loads are sketched incrementally: sales rows after the last sketched
+        sale_id are sketched and appended, their registers merged with the
+        existing ones when queried. If sketched rows changed (checksum of
+        their keys), the sketches are rebuilt.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the analytics database
+            precision (int): Bits of the hash that pick the register, 4 to 16
+        """
+        if not 4 <= precision <= 16:
+            raise Exception(f"Точность скетчей должна быть от 4 до 16, получено {precision}")
+        self.conn = conn
+        self.precision = precision
+        self.table = SKETCH_TABLE
+        self.sketched_rows = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.sketched_rows is not None
+
+    @property
+    def relative_error(self):
+        return relative_error(self.precision)
+
+    def estimate_sql(self, name, alias=None):
+        """
+        SQL aggregate estimating a sketched distinct count from merged registers.
+
+        Args:
+            name (str): Key of SKETCHED_COLUMNS
+            alias (str, optional): Alias of the relation with the registers
+
+        Returns:
+            str: SQL expression
+        """
+        register = f"{name}_rho" if alias is None else f"{alias}.{name}_rho"
+        return estimate_sql(register, self.precision)
+
+    def refresh(self, force=False, seed_path=None):
+        """
+        Sketch sales rows loaded since the last refresh, and read the state.
+
+        Args:
+            force (bool): Rebuild the sketches from all sales rows
+            seed_path (str, optional): Database file whose sketches are
+                copied first if this database has none, e.g. the previous
+                snapshot; only rows loaded after them are then sketched
+
+        Returns:
+            int: Sales rows sketched now
+        """
+        added = 0
+        with self._lock:
+            cursor = self.conn.cursor()
+            try:
+                if not is_read_only(cursor):
+                    if seed_path is not None and not force:
+                        try:
+                            self._seed(cursor, seed_path)
+                        except Exception as e:
+                            # The seed is only a shortcut: the sketches get built from sales
+                            logger.warning(f"Sketches not copied from {seed_path}: {e}")
+                    added = self._update(cursor, force)
+
+                tables = {row[0] for row in cursor.execute("SHOW TABLES").fetchall()}
+                row = None
+                if 'sketch_state' in tables and self.table in tables:
+                    row = cursor.execute(
+                        "SELECT sketched_rows FROM sketch_state WHERE table_name = ? AND precision = ?",
+                        [self.table, self.precision]
+                    ).fetchone()
+                self.sketched_rows = row[0] if row is not None else None
+            finally:
+                cursor.close()
+        if added:
+            logger.info(f"Distinct count sketches updated with {added} sales rows")
+        return added
+
+    def _create(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sketch_state (
+                table_name TEXT PRIMARY KEY,
+                precision INTEGER,
+                last_sale_id BIGINT,
+                sketched_rows BIGINT,
+                checksum HUGEINT,
+                updated_at TIMESTAMP
+            )
+        """)
+        keys = ", ".join(f"{key} {'DATE' if key == 'sale_date' else 'INTEGER'}" for key in SKETCH_KEYS)
+        registers = ", ".join(f"{name}_rho TINYINT" for name in SKETCHED_COLUMNS)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({keys}, bucket USMALLINT, {registers})")
+
+    def _seed(self, cursor, seed_path):
+        """Copy the sketches of another database file into an empty one."""
+        tables = {row[0] for row in cursor.execute("SHOW TABLES").fetchall()}
+        if 'sketch_state' in tables:
+            return
+        # ATTACH fails on a file this process has open already (the current
+        # snapshot during a rebuild), while connect() shares that database
+        seed = duckdb.connect(seed_path, read_only=True)
+        try:
+            seed_tables = {row[0] for row in seed.execute("SHOW TABLES").fetchall()}
+            if not {'sketch_state', self.table} <= seed_tables:
+                return
+            state = seed.execute(
+                "SELECT * FROM sketch_state WHERE table_name = ? AND precision = ?",
+                [self.table, self.precision]
+            ).fetchone()
+            if state is None:
+                return
+            registers = seed.execute(f"SELECT * FROM {self.table}").fetch_arrow_table()
+        finally:
+            seed.close()
+
+        self._create(cursor)
+        cursor.register('sketch_seed', registers)
+        cursor.execute("BEGIN TRANSACTION")
+        try:
+            cursor.execute(f"INSERT INTO {self.table} SELECT * FROM sketch_seed")
+            cursor.execute("INSERT INTO sketch_state VALUES (?, ?, ?, ?, ?, ?)", list(state))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.unregister('sketch_seed')
+        logger.info(f"Distinct count sketches of {state[3]} sales rows copied from {seed_path}")
+
+    def _checksum(self, cursor, last_sale_id):
+        """
+        Row count of the sketched sales rows (those up to last_sale_id), and
+        a checksum of their sketched columns and of the product categories.
+        """
+        columns = ['sale_id', 'product_id'] + [
+            column.split('.')[1] for column in SKETCH_KEYS.values() if column.startswith('sales.')
+        ] + list(SKETCHED_COLUMNS.values())
+        columns = ", ".join(f"s.{column}" for column in dict.fromkeys(columns))
+        return cursor.execute(f"""
+            SELECT
+                COUNT(*),
+                COALESCE(SUM(hash({columns})), 0)
+                    + (SELECT COALESCE(SUM(hash(product_id, category_id)), 0) FROM products)
+            FROM sales s WHERE s.sale_id <= ?
+        """, [last_sale_id]).fetchone()
+
+    def _update(self, cursor, force):
+        tables = {row[0] for row in cursor.execute("SHOW TABLES").fetchall()}
+        if not {'sales', 'products'} <= tables:
+            return 0
+        self._create(cursor)
+        state = cursor.execute(
+            "SELECT precision, last_sale_id, sketched_rows, checksum FROM sketch_state WHERE table_name = ?",
+            [self.table]
+        ).fetchone()
+
+        rebuild = force or state is None or state[0] != self.precision
+        if not rebuild and state[1] is not None:
+            # Rows already sketched must not have changed since
+            rebuild = self._checksum(cursor, state[1]) != (state[2], state[3])
+        last_sale_id = None if rebuild else state[1]
+        sketched = 0 if rebuild else state[2]
+
+        new_rows, new_last = cursor.execute(
+            "SELECT COUNT(*), MAX(sale_id) FROM sales WHERE ? IS NULL OR sale_id > ?",
+            [last_sale_id, last_sale_id]
+        ).fetchone()
+        if not rebuild and new_rows == 0:
+            return 0
+
+        cursor.execute("BEGIN TRANSACTION")
+        try:
+            if rebuild:
+                cursor.execute(f"DELETE FROM {self.table}")
+            if new_rows:
+                cursor.execute(f"INSERT INTO {self.table} {self._sketch_sql()}", [last_sale_id])
+            last = new_last if new_rows else last_sale_id
+            count, checksum = self._checksum(cursor, last) if last is not None else (0, 0)
+            cursor.execute("DELETE FROM sketch_state WHERE table_name = ?", [self.table])
+            cursor.execute(
+                "INSERT INTO sketch_state VALUES (?, ?, ?, ?, ?, ?)",
+                [self.table, self.precision, last, count, checksum, datetime.now()]
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        if rebuild:
+            logger.info(f"Distinct count sketches rebuilt at precision {self.precision}")
+        return count - sketched
+
+    def _sketch_sql(self):
+        """
+        Registers of the sales rows after a sale_id (the parameter; NULL for
+        all rows), one row per day, store, category and register.
+
+        The 64-bit hash of a value picks its register with the low precision
+        bits; the register keeps the position of the lowest set bit among
+        the rest (trailing zeros + 1).
+        """
+        m = 1 << self.precision
+        keys = [f"{'s' if column.startswith('sales.') else 'p'}.{column.split('.')[1]}" for column in SKETCH_KEYS.values()]
+        parts = []
+        for name, column in SKETCHED_COLUMNS.items():
+            rest = f"(hash(s.{column}) >> {self.precision})"
+            rho = f"CASE WHEN {rest} = 0 THEN {64 - self.precision + 1} ELSE bit_count(xor({rest}, {rest} - 1)) END"
+            registers = ", ".join(
+                f"{rho} AS {other}_rho" if other == name else f"NULL AS {other}_rho" for other in SKETCHED_COLUMNS
+            )
+            parts.append(f"""
+                SELECT {', '.join(keys)}, CAST(hash(s.{column}) & {m - 1} AS USMALLINT) AS bucket, {registers}
+                FROM sales s LEFT JOIN products p ON s.product_id = p.product_id
+                WHERE s.{column} IS NOT NULL AND ($1 IS NULL OR s.sale_id > $1)
+            """)
+        registers = ", ".join(f"CAST(MAX({name}_rho) AS TINYINT)" for name in SKETCHED_COLUMNS)
+        return (
+            f"SELECT {', '.join(SKETCH_KEYS)}, bucket, {registers} "
+            f"FROM ({' UNION ALL '.join(parts)}) GROUP BY ALL"
+        )
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    def __init__(self, db_file, conn):
+        """
+        A database file opened by the query executor, with the queries
+        reading it counted, so that after a switch to a newer snapshot the
+        connection is closed only once they have finished.
+
+        Args:
+            db_file (str): Path to the database file
+            conn (duckdb.DuckDBPyConnection): Connection to it
+        """
+        self.db_file = db_file
+        self.conn = conn
+        self.readers = 0
+        self.retired = False
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def lease(self):
+        """Count a query as reading this snapshot while the block runs; yields the connection."""
+        self.acquire()
+        try:
+            yield self.conn
+        finally:
+            self.release()
+
+    def acquire(self):
+        """Count a reader of this snapshot; each call is matched by release()."""
+        with self._cond:
+            self.readers += 1
+
+    def release(self):
+        with self._cond:
+            self.readers -= 1
+            self._cond.notify_all()
+
+    def retire(self, grace=1.0, timeout=60):
+        """
+        Close the connection in the background once no query reads it.
+
+        Closing a DuckDB connection closes its cursors too, so queries still
+        running on the old snapshot are waited for; the grace period covers
+        short reads that took the connection just before the switch.
+
+        Args:
+            grace (float): Seconds to wait before checking for readers
+            timeout (float): Seconds after which the connection is closed anyway
+        """
+        self.retired = True
+
+        def drain():
+            time.sleep(grace)
+            with self._cond:
+                drained = self._cond.wait_for(lambda: self.readers == 0, timeout)
+                if not drained:
+                    logger.warning(f"Closing {self.db_file} with {self.readers} queries still reading it")
+                self.conn.close()
+            logger.info(f"Connection to snapshot {self.db_file} closed")
+
+        threading.Thread(target=drain, name="snapshot-drain", daemon=True).start()
+
+
+class LeasedCursor:
+    def __init__(self, snapshot):
+        """
+        A cursor of a snapshot's connection that counts as a reader of the
+        snapshot until it is closed, so a switch to a newer snapshot doesn't
+        close the connection under it. Everything but close() is passed to
+        the DuckDB cursor.
+
+        Args:
+            snapshot (Snapshot): The snapshot to read
+        """
+        snapshot.acquire()
+        try:
+            self._cursor = snapshot.conn.cursor()
+        except Exception:
+            snapshot.release()
+            raise
+        self._snapshot = snapshot
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def close(self):
+        if self._snapshot is None:
+            return
+        try:
+            self._cursor.close()
+        finally:
+            snapshot, self._snapshot = self._snapshot, None
+            snapshot.release()
+
+
+class SnapshotConnection:
+    def __init__(self, current):
+        """
+        Connection-like view of whichever snapshot is current, for components
+        that open a cursor per call (validator, rewriter, value catalog...):
+        each cursor reads the snapshot current when it was opened, under a
+        lease, and they need no update when readers switch.
+
+        Args:
+            current (callable): Returns the current Snapshot
+        """
+        self._current = current
+
+    def cursor(self):
+        """
+        Returns:
+            LeasedCursor: A cursor of the current snapshot; close it when done
+        """
+        return LeasedCursor(self._current())
@@ -0,0 +1,389 @@
+import json
+import logging
+import threading
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# date_trunc parts that can be turned into range predicates, with the
+# coarser parts whose boundaries are always aligned to them
+TRUNC_PARTS = {
+    'week': {'week'},
+    'month': {'month', 'quarter', 'year'},
+    'quarter': {'quarter', 'year'},
+    'year': {'year'},
+}
+
+# Comparison types and how they map when the operands are swapped
+FLIPPED_COMPARISONS = {
+    'COMPARE_EQUAL': 'COMPARE_EQUAL',
+    'COMPARE_GREATERTHANOREQUALTO': 'COMPARE_LESSTHANOREQUALTO',
+    'COMPARE_LESSTHANOREQUALTO': 'COMPARE_GREATERTHANOREQUALTO',
+    'COMPARE_GREATERTHAN': 'COMPARE_LESSTHAN',
+    'COMPARE_LESSTHAN': 'COMPARE_GREATERTHAN',
+}
+
+
+class Finding:
+    """A single anti-pattern detected in a query."""
+
+    def __init__(self, rule, message, rewritten=False):
+        self.rule = rule
+        self.message = message
+        self.rewritten = rewritten
+
+    def __str__(self):
+        action = "исправлено" if self.rewritten else "предупреждение"
+        return f"[{self.rule}, {action}] {self.message}"
+
+
+class AnalysisResult:
+    """Outcome of analyzing (and possibly rewriting) a query."""
+
+    def __init__(self, original_sql, sql, findings):
+        self.original_sql = original_sql
+        self.sql = sql
+        self.findings = findings
+
+    @property
+    def rewritten(self):
+        return self.sql != self.original_sql
+
+
+class SQLRewriter:
+    def __init__(self, conn, fact_tables=('sales',), date_columns=('sale_date',),
+                 high_cardinality_columns=('customer_id', 'sale_id')):
+        """
+        Rule-based analyzer for expensive SQL patterns.
+
+        Queries are parsed with DuckDB's own parser (json_serialize_sql), so
+        the rules see the same AST the database will bind. Safe rewrites are
+        applied to the AST and rendered back with json_deserialize_sql;
+        everything else is reported as a warning.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection used for parsing
+            fact_tables (tuple): Large tables that must not be scanned with SELECT *
+            date_columns (tuple): DATE columns that should be filtered with range predicates
+            high_cardinality_columns (tuple): Keys for which COUNT(DISTINCT) is expensive
+        """
+        self.conn = conn
+        self.fact_tables = set(fact_tables)
+        self.date_columns = set(date_columns)
+        self.high_cardinality_columns = set(high_cardinality_columns)
+        # Each analysis uses its own cursor, so analyze() can run concurrently
+        self._local = threading.local()
+
+    @property
+    def _cursor(self):
+        return self._local.cursor
+
+    def analyze(self, sql):
+        """
+        Analyze a query and rewrite the patterns that can be rewritten safely.
+
+        Args:
+            sql (str): The SQL query
+
+        Returns:
+            AnalysisResult: The (possibly) rewritten SQL and the findings
+        """
+        cursor = self.conn.cursor()
+        try:
+            self._local.cursor = cursor
+            tree = json.loads(cursor.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+            if tree.get('error'):
+                # Unparseable SQL is left for the validator to report
+                return AnalysisResult(sql, sql, [])
+
+            findings = []
+            changed = False
+            for statement in tree['statements']:
+                for node in self._walk(statement['node']):
+                    if node.get('type') in ('SELECT_NODE', 'SET_OPERATION_NODE'):
+                        self._check_ctes(node, findings)
+                    if node.get('type') == 'SELECT_NODE':
+                        changed |= self._rewrite_date_predicates(node, findings)
+                        self._check_select_star(node, findings)
+                        self._check_joins(node, findings)
+                    if node.get('class') == 'FUNCTION':
+                        self._check_count_distinct(node, findings)
+
+            rewritten_sql = sql
+            if changed:
+                rewritten_sql = cursor.execute(
+                    "SELECT json_deserialize_sql(?)", [json.dumps(tree)]
+                ).fetchone()[0]
+                logger.info(f"Rewritten SQL query: {rewritten_sql}")
+            for finding in findings:
+                logger.info(f"SQL analysis: {finding}")
+            return AnalysisResult(sql, rewritten_sql, findings)
+        except Exception as e:
+            # The analyzer is an optimization: never fail the query because of it
+            logger.error(f"Error analyzing SQL: {e}")
+            return AnalysisResult(sql, sql, [])
+        finally:
+            self._local.cursor = None
+            cursor.close()
+
+    # AST helpers
+
+    def _walk(self, node):
+        """Yield every dict in the AST, depth first."""
+        if isinstance(node, dict):
+            yield node
+            for value in node.values():
+                yield from self._walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                yield from self._walk(item)
+
+    def _render(self, expression):
+        """Render an expression node back to SQL text."""
+        skeleton = json.loads(self._cursor.execute("SELECT json_serialize_sql('SELECT 1')").fetchone()[0])
+        skeleton['statements'][0]['node']['select_list'] = [expression]
+        sql = self._cursor.execute("SELECT json_deserialize_sql(?)", [json.dumps(skeleton)]).fetchone()[0]
+        return sql[len("SELECT "):]
+
+    def _parse_predicate(self, predicate_sql):
+        """Parse a predicate into an expression node."""
+        tree = json.loads(self._cursor.execute(
+            "SELECT json_serialize_sql(?)", [f"SELECT 1 WHERE {predicate_sql}"]
+        ).fetchone()[0])
+        return tree['statements'][0]['node']['where_clause']
+
+    def _evaluate(self, expression_sql):
+        """Evaluate a constant expression, returning None if it cannot be evaluated."""
+        try:
+            return self._cursor.execute(f"SELECT {expression_sql}").fetchone()[0]
+        except Exception:
+            return None
+
+    def _is_constant(self, node):
+        """
+        True if the expression references no columns. DuckDB's parser emits
+        CURRENT_DATE and friends as column references, so they count as
+        non-constant too.
+        """
+        return not any(
+            n.get('class') in ('COLUMN_REF', 'SUBQUERY', 'PARAMETER') for n in self._walk(node)
+        )
+
+    def _constant_string(self, node):
+        if node.get('class') == 'CONSTANT' and not node['value'].get('is_null'):
+            value = node['value'].get('value')
+            return value.lower() if isinstance(value, str) else None
+        return None
+
+    def _date_column(self, node):
+        """Return the column node if the expression is a bare reference to a date column."""
+        if node.get('class') == 'COLUMN_REF' and node['column_names'][-1].lower() in self.date_columns:
+            return node
+        return None
+
+    def _function(self, node, *names):
+        return node.get('class') == 'FUNCTION' and node.get('function_name', '').lower() in names
+
+    # Rewrite rules
+
+    def _rewrite_date_predicates(self, select_node, findings):
+        """Turn functions over date columns in WHERE into range predicates."""
+        if select_node.get('where_clause') is None:
+            return False
+
+        changed = False
+        conjuncts = self._conjunct_slots(select_node, 'where_clause')
+        for parent, key in conjuncts:
+            predicate = parent[key]
+            replacement = self._rewrite_predicate(predicate)
+            if replacement is not None:
+                findings.append(Finding(
+                    'date_function_in_where',
+                    f"Условие «{self._render(predicate)}» заменено на диапазон «{self._render(replacement)}»",
+                    rewritten=True
+                ))
+                parent[key] = replacement
+                changed = True
+            elif self._wraps_date_column(predicate):
+                findings.append(Finding(
+                    'date_function_in_where',
+                    f"Функция над столбцом даты в условии «{self._render(predicate)}» мешает отсечению "
+                    "данных; используй диапазон дат или JOIN с calendar"
+                ))
+        return changed
+
+    def _conjunct_slots(self, parent, key):
+        """Return (container, key) pairs addressing each top-level AND conjunct."""
+        node = parent[key]
+        if node.get('class') == 'CONJUNCTION' and node.get('type') == 'CONJUNCTION_AND':
+            slots = []
+            for i in range(len(node['children'])):
+                slots.extend(self._conjunct_slots(node['children'], i))
+            return slots
+        return [(parent, key)]
+
+    def _wraps_date_column(self, predicate):
+        for node in self._walk(predicate):
+            if node.get('class') in ('FUNCTION', 'CAST') and not node.get('is_operator'):
+                children = node.get('children', []) if node.get('class') == 'FUNCTION' else [node.get('child')]
+                if any(child and self._date_column(child) for child in children):
+                    return True
+        return False
+
+    def _rewrite_predicate(self, predicate):
+        """Return a sargable replacement for a comparison, or None."""
+        if predicate.get('class') != 'COMPARISON' or predicate.get('type') not in FLIPPED_COMPARISONS:
+            return None
+
+        for function_side, other_side, comparison in (
+            (predicate['left'], predicate['right'], predicate['type']),
+            (predicate['right'], predicate['left'], FLIPPED_COMPARISONS[predicate['type']]),
+        ):
+            # date_trunc('<part>', date_column) <op> aligned value
+            if self._function(function_side, 'date_trunc') and len(function_side['children']) == 2:
+                part = self._constant_string(function_side['children'][0])
+                column = self._date_column(function_side['children'][1])
+                if part in TRUNC_PARTS and column is not None and self._is_aligned(other_side, part):
+                    return self._range_predicate(self._render(column), self._render(other_side), part, comparison)
+
+            # year(date_column) = value
+            if comparison == 'COMPARE_EQUAL':
+                column = None
+                if self._function(function_side, 'year') and len(function_side['children']) == 1:
+                    column = self._date_column(function_side['children'][0])
+                elif (self._function(function_side, 'date_part', 'datepart')
+                      and len(function_side['children']) == 2
+                      and self._constant_string(function_side['children'][0]) == 'year'):
+                    column = self._date_column(function_side['children'][1])
+                if column is not None and not any(
+                    self._date_column(n) for n in self._walk(other_side)
+                ):
+                    column_sql = self._render(column)
+                    year_sql = f"CAST({self._render(other_side)} AS INTEGER)"
+                    return self._parse_predicate(
+                        f"({column_sql} >= make_date({year_sql}, 1, 1) "
+                        f"AND {column_sql} < make_date({year_sql} + 1, 1, 1))"
+                    )
+        return None
+
+    def _range_predicate(self, column_sql, value_sql, part, comparison):
+        start = f"CAST({value_sql} AS DATE)"
+        end = f"CAST({value_sql} + INTERVAL '1 {part}' AS DATE)"
+        predicates = {
+            'COMPARE_EQUAL': f"({column_sql} >= {start} AND {column_sql} < {end})",
+            'COMPARE_GREATERTHANOREQUALTO': f"{column_sql} >= {start}",
+            'COMPARE_LESSTHAN': f"{column_sql} < {start}",
+            'COMPARE_GREATERTHAN': f"{column_sql} >= {end}",
+            'COMPARE_LESSTHANOREQUALTO': f"{column_sql} < {end}",
+        }
+        return self._parse_predicate(predicates[comparison])
+
+    def _is_aligned(self, node, part):
+        """
+        True if the value is guaranteed to fall on a <part> boundary, which
+        makes date_trunc(part, column) <op> value equivalent to a range on column.
+        """
+        if self._is_constant(node):
+            value_sql = self._render(node)
+            return self._evaluate(f"date_trunc('{part}', {value_sql}) = {value_sql}") is True
+
+        if self._function(node, 'date_trunc') and node['children']:
+            return self._constant_string(node['children'][0]) in TRUNC_PARTS[part]
+
+        if node.get('class') == 'CAST' and node['cast_type']['id'] in ('DATE', 'TIMESTAMP'):
+            return self._is_aligned(node['child'], part)
+
+        if node.get('class') == 'FUNCTION' and node.get('is_operator') \
+                and node.get('function_name') in ('+', '-') and len(node['children']) == 2:
+            left, right = node['children']
+            if self._is_aligned(left, part) and self._is_aligned_interval(right, part):
+                return True
+            return node['function_name'] == '+' and self._is_aligned(right, part) \
+                and self._is_aligned_interval(left, part)
+
+        return False
+
+    def _is_aligned_interval(self, node, part):
+        """True if the constant interval is a whole number of <part>s."""
+        if not self._is_constant(node):
+            return False
+        interval_sql = f"CAST({self._render(node)} AS INTERVAL)"
+        if part == 'week':
+            check = (f"to_days(CAST(floor(date_part('day', {interval_sql}) / 7) * 7 AS INTEGER)) "
+                     f"= {interval_sql}")
+        else:
+            months = {'month': 1, 'quarter': 3, 'year': 12}[part]
+            total_months = f"(date_part('year', {interval_sql}) * 12 + date_part('month', {interval_sql}))"
+            check = (f"{total_months} % {months} = 0 "
+                     f"AND to_months(CAST({total_months} AS INTEGER)) = {interval_sql}")
+        return self._evaluate(check) is True
+
+    # Warning-only rules
+
+    def _check_select_star(self, select_node, findings):
+        if not any(item.get('class') == 'STAR' for item in select_node.get('select_list', [])):
+            return
+        tables = [
+            n['table_name'] for n in self._walk(select_node.get('from_table'))
+            if n.get('type') == 'BASE_TABLE' and n.get('table_name', '').lower() in self.fact_tables
+        ]
+        if tables:
+            findings.append(Finding(
+                'select_star_fact_table',
+                f"SELECT * из таблицы фактов {', '.join(sorted(set(tables)))}: перечисли только нужные столбцы"
+            ))
+
+    def _check_joins(self, select_node, findings):
+        where = select_node.get('where_clause')
+        for join in self._walk(select_node.get('from_table')):
+            if join.get('type') != 'JOIN':
+                continue
+            condition = join.get('condition')
+            if join.get('using_columns'):
+                continue
+            if condition is None and join.get('ref_type') in ('CROSS', 'REGULAR'):
+                # Comma joins are fine when WHERE relates the two sides
+                if where is not None and self._has_column_equality(where):
+                    continue
+                findings.append(Finding(
+                    'join_without_predicate',
+                    "Соединение таблиц без условия приводит к декартову произведению"
+                ))
+            elif condition is not None and self._is_constant(condition):
+                findings.append(Finding(
+                    'join_without_predicate',
+                    f"Условие соединения «{self._render(condition)}» не связывает таблицы"
+                ))
+
+    def _has_column_equality(self, node):
+        return any(
+            n.get('class') == 'COMPARISON' and n.get('type') == 'COMPARE_EQUAL'
+            and n['left'].get('class') == 'COLUMN_REF' and n['right'].get('class') == 'COLUMN_REF'
+            for n in self._walk(node)
+        )
+
+    def _check_ctes(self, node, findings):
+        for entry in node.get('cte_map', {}).get('map', []):
+            cte_node = entry['value']['query']['node']
+            modifier_types = [m.get('type') for m in cte_node.get('modifiers', [])]
+            if 'ORDER_MODIFIER' in modifier_types and 'LIMIT_MODIFIER' not in modifier_types:
+                findings.append(Finding(
+                    'order_by_without_limit_in_cte',
+                    f"ORDER BY без LIMIT в CTE «{entry['key']}» не влияет на результат, но требует сортировки"
+                ))
+
+    def _check_count_distinct(self, node, findings):
+        if not (self._function(node, 'count') and node.get('distinct')):
+            return
+        columns = [
+            child['column_names'][-1] for child in node.get('children', [])
+            if child.get('class') == 'COLUMN_REF'
+            and child['column_names'][-1].lower() in self.high_cardinality_columns
+        ]
+        if columns:
+            findings.append(Finding(
+                'count_distinct_high_cardinality',
+                f"COUNT(DISTINCT {columns[0]}) по ключу с высокой кардинальностью дорог на больших "
+                "данных; для оценок используй approx_count_distinct"
+            ))
@@ -0,0 +1,229 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Operators whose work grows with the product of their inputs
+CROSS_PRODUCT_OPERATORS = {'CROSS_PRODUCT', 'NESTED_LOOP_JOIN', 'BLOCKWISE_NL_JOIN'}
+
+# Table functions a query may scan; all others (read_csv, read_text, glob,
+# query, duckdb_* ...) read files or the catalog rather than the data
+ALLOWED_TABLE_FUNCTIONS = {'RANGE', 'GENERATE_SERIES', 'UNNEST'}
+
+
+class SQLValidationError(Exception):
+    """Raised when generated SQL does not bind or is estimated to be too expensive."""
+
+    def __init__(self, message, sql=None, kind='binder'):
+        super().__init__(message)
+        self.sql = sql
+        # One of: 'parser', 'binder', 'statement', 'cost'
+        self.kind = kind
+
+
+class ValidationResult:
+    """Outcome of a successful dry run."""
+
+    def __init__(self, sql, plan, estimated_rows, estimated_cost, cross_products, elapsed_ms):
+        self.sql = sql
+        self.plan = plan
+        self.estimated_rows = estimated_rows
+        self.estimated_cost = estimated_cost
+        self.cross_products = cross_products
+        self.elapsed_ms = elapsed_ms
+
+
+def check_statement(conn, sql):
+    """
+    Allow exactly one read-only SELECT statement.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection used to parse the SQL
+        sql (str): The SQL query
+
+    Raises:
+        SQLValidationError: If the SQL is not a single SELECT
+    """
+    try:
+        statements = conn.extract_statements(sql)
+    except Exception as e:
+        raise SQLValidationError(str(e), sql=sql, kind='parser')
+
+    if len(statements) != 1:
+        raise SQLValidationError(
+            f"Ожидался один SQL запрос, получено {len(statements)}", sql=sql, kind='statement'
+        )
+    statement_type = str(statements[0].type).split('.')[-1]
+    if statement_type != 'SELECT':
+        raise SQLValidationError(
+            f"Разрешены только SELECT запросы, получен {statement_type}", sql=sql, kind='statement'
+        )
+
+
+class SQLValidator:
+    def __init__(self, conn, max_estimated_cost=10_000_000, estimate_cache_size=256):
+        """
+        Dry-run SQL through EXPLAIN before executing it.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the analytics database
+            max_estimated_cost (int): Reject queries whose estimated cost
+                (sum of estimated operator cardinalities) exceeds this value
+            estimate_cache_size (int): Cost estimates kept for estimate()
+        """
+        self.conn = conn
+        self.max_estimated_cost = max_estimated_cost
+        self.estimate_cache_size = estimate_cache_size
+        self._estimates = OrderedDict()
+        self._estimates_lock = threading.Lock()
+
+    def validate(self, sql):
+        """
+        Parse, bind and cost a query without executing it.
+
+        Args:
+            sql (str): The SQL query
+
+        Returns:
+            ValidationResult: The plan and its cost estimate
+
+        Raises:
+            SQLValidationError: If the query does not bind or exceeds the cost threshold
+        """
+        start_time = time.perf_counter()
+        cursor = self.conn.cursor()
+        try:
+            check_statement(cursor, sql)
+            try:
+                rows = cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchall()
+            except Exception as e:
+                kind = 'parser' if type(e).__name__ == 'ParserException' else 'binder'
+                raise SQLValidationError(str(e), sql=sql, kind=kind)
+        finally:
+            cursor.close()
+
+        plan = json.loads(rows[0][1])
+        functions = self._table_functions(plan) - ALLOWED_TABLE_FUNCTIONS
+        if functions:
+            raise SQLValidationError(
+                f"Запрос читает данные вне таблиц базы ({', '.join(sorted(functions)).lower()}). "
+                f"Используй только таблицы и представления базы.",
+                sql=sql,
+                kind='statement'
+            )
+        estimated_rows, estimated_cost, cross_products = self._estimate(plan)
+        self._remember(sql, estimated_cost)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        logger.info(
+            f"Dry run in {elapsed_ms:.1f} ms: estimated rows {estimated_rows}, "
+            f"estimated cost {estimated_cost}, cross products {cross_products}"
+        )
+
+        if estimated_cost > self.max_estimated_cost:
+            hint = " Запрос содержит декартово произведение: проверь условия соединения." if cross_products else ""
+            raise SQLValidationError(
+                f"Оценочная стоимость запроса {estimated_cost:,} превышает допустимую "
+                f"{self.max_estimated_cost:,}.{hint}",
+                sql=sql,
+                kind='cost'
+            )
+
+        return ValidationResult(sql, plan, estimated_rows, estimated_cost, cross_products, elapsed_ms)
+
+    def estimate(self, sql):
+        """
+        Cost estimate of a query, from the dry run if it was validated recently.
+
+        Args:
+            sql (str): The SQL query
+
+        Returns:
+            int: The estimated cost, or None if the query can't be planned
+        """
+        with self._estimates_lock:
+            if sql in self._estimates:
+                self._estimates.move_to_end(sql)
+                return self._estimates[sql]
+
+        cursor = self.conn.cursor()
+        try:
+            rows = cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchall()
+        except Exception as e:
+            logger.warning(f"No cost estimate: {e}")
+            return None
+        finally:
+            cursor.close()
+        _, estimated_cost, _ = self._estimate(json.loads(rows[0][1]))
+        self._remember(sql, estimated_cost)
+        return estimated_cost
+
+    def clear_estimates(self):
+        """Forget cached cost estimates, e.g. after the data was reloaded."""
+        with self._estimates_lock:
+            self._estimates.clear()
+
+    def _remember(self, sql, estimated_cost):
+        with self._estimates_lock:
+            self._estimates[sql] = estimated_cost
+            self._estimates.move_to_end(sql)
+            if len(self._estimates) > self.estimate_cache_size:
+                self._estimates.popitem(last=False)
+
+    def _table_functions(self, plan):
+        """
+        Table functions scanned by a plan, file scans in FROM 'file.csv' included.
+
+        Returns:
+            set: Upper-case function names
+        """
+        functions = set()
+        nodes = list(plan)
+        while nodes:
+            node = nodes.pop()
+            extra_info = node.get('extra_info', {})
+            if isinstance(extra_info, dict) and extra_info.get('Function'):
+                functions.add(str(extra_info['Function']).upper())
+            nodes.extend(node.get('children', []))
+        return functions
+
+    def _estimate(self, plan):
+        """
+        Estimate result size and total work from an EXPLAIN JSON plan.
+
+        Cross products and nested loop joins are costed as the product of
+        their inputs: that is the work they do regardless of how selective
+        their join condition turns out to be.
+
+        Returns:
+            tuple: (estimated_rows, estimated_cost, cross_products)
+        """
+        cross_products = 0
+
+        def visit(node):
+            nonlocal cross_products
+            children = [visit(child) for child in node.get('children', [])]
+            child_rows = [rows for rows, _ in children]
+            child_cost = sum(cost for _, cost in children)
+
+            extra_info = node.get('extra_info', {})
+            estimated = extra_info.get('Estimated Cardinality') if isinstance(extra_info, dict) else None
+            rows = int(estimated) if estimated not in (None, '') else max(child_rows, default=1)
+            work = rows
+
+            if node.get('name') in CROSS_PRODUCT_OPERATORS and len(child_rows) == 2:
+                cross_products += 1
+                work = max(rows, child_rows[0] * child_rows[1])
+                if node.get('name') == 'CROSS_PRODUCT':
+                    rows = work
+
+            return rows, child_cost + work
+
+        roots = [visit(node) for node in plan]
+        estimated_rows = roots[0][0] if roots else 0
+        estimated_cost = sum(cost for _, cost in roots)
+        return estimated_rows, estimated_cost, cross_products
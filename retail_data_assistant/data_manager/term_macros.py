@@ -0,0 +1,258 @@
+import json
+import os
+import logging
+import threading
+import duckdb
+from .db_bootstrap import is_read_only
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parsed as column references, but are functions
+SPECIAL_IDENTIFIERS = {'current_date', 'current_time', 'current_timestamp', 'localtime', 'localtimestamp'}
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metadata", "dictionary.json")
+
+
+class TermMacro:
+    """A business term compiled into a DuckDB macro."""
+
+    def __init__(self, term, name, params, arguments, body, kind='scalar'):
+        self.term = term
+        self.name = name
+        # Macro parameters and the columns the dictionary formula used for them
+        self.params = params
+        self.arguments = arguments
+        self.body = body
+        # 'scalar' for expressions, 'table' for "column IN (subquery)" terms
+        self.kind = kind
+
+    @property
+    def create_sql(self):
+        table = "TABLE " if self.kind == 'table' else ""
+        return f"CREATE OR REPLACE MACRO {self.name}({', '.join(self.params)}) AS {table}{self.body}"
+
+    @property
+    def usage(self):
+        """How the term is written in a query using the macro."""
+        if self.kind == 'table':
+            return f"{self.arguments[0]} IN (SELECT * FROM {self.name}())"
+        return f"{self.name}({', '.join(self.arguments)})"
+
+
+def compile_term_macros(terms, conn=None):
+    """
+    Compile dictionary terms that name a "function" into macros.
+
+    Columns referenced by the formula become macro parameters, so
+    margin = SUM((s.unit_price - p.unit_cost) * s.quantity) / SUM(s.total_amount) * 100
+    turns into margin_pct(unit_price, unit_cost, quantity, total_amount).
+    A formula of the form "column IN (subquery)" becomes a table macro
+    returning the subquery.
+
+    Args:
+        terms (list): business_terms entries from dictionary.json
+        conn (duckdb.DuckDBPyConnection, optional): Connection used for parsing;
+            an in-memory one is used if omitted
+
+    Returns:
+        list: TermMacro objects, in dictionary order
+    """
+    cursor = conn.cursor() if conn is not None else duckdb.connect()
+    macros = []
+    try:
+        for term in terms:
+            name = term.get('function')
+            if not name:
+                continue
+            try:
+                macros.append(_compile_term(cursor, term['term'], name, term['sql_representation']))
+            except Exception as e:
+                logger.warning(f"Term '{term['term']}' could not be compiled into macro {name}: {e}")
+    finally:
+        cursor.close()
+    return macros
+
+
+def _compile_term(cursor, term, name, formula):
+    tree = json.loads(cursor.execute("SELECT json_serialize_sql(?)", [f"SELECT {formula}"]).fetchone()[0])
+    if tree.get('error'):
+        raise ValueError(tree.get('error_message'))
+    expression = tree['statements'][0]['node']['select_list'][0]
+
+    if expression.get('class') == 'SUBQUERY' and expression.get('subquery_type') == 'ANY':
+        body = _render_statement(cursor, expression['subquery'])
+        return TermMacro(term, name, [], [_render(cursor, expression['child'])], body, kind='table')
+
+    # Column references become parameters, named after the column; the same
+    # column name from two tables gets the table as a prefix
+    references = []
+    for node in _walk(expression):
+        if node.get('class') == 'SUBQUERY':
+            raise ValueError("subqueries are only supported as 'column IN (subquery)'")
+        if _is_column(node) and node['column_names'] not in references:
+            references.append(node['column_names'])
+    column_counts = {}
+    for reference in references:
+        column_counts[reference[-1]] = column_counts.get(reference[-1], 0) + 1
+    params = [
+        '_'.join(reference) if column_counts[reference[-1]] > 1 else reference[-1] for reference in references
+    ]
+    arguments = ['.'.join(reference) for reference in references]
+
+    for node in _walk(expression):
+        if _is_column(node):
+            node['column_names'] = [params[references.index(node['column_names'])]]
+    return TermMacro(term, name, params, arguments, _render(cursor, expression))
+
+
+def _is_column(node):
+    return (
+        node.get('class') == 'COLUMN_REF'
+        and not (len(node['column_names']) == 1 and node['column_names'][0].lower() in SPECIAL_IDENTIFIERS)
+    )
+
+
+def _walk(node):
+    """Yield every dict in the AST without descending into subqueries."""
+    if isinstance(node, dict):
+        yield node
+        if node.get('class') == 'SUBQUERY':
+            return
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item)
+
+
+def _render(cursor, expression):
+    """Render an expression node back to SQL text."""
+    skeleton = json.loads(cursor.execute("SELECT json_serialize_sql('SELECT 1')").fetchone()[0])
+    skeleton['statements'][0]['node']['select_list'] = [expression]
+    sql = cursor.execute("SELECT json_deserialize_sql(?)", [json.dumps(skeleton)]).fetchone()[0]
+    return sql[len("SELECT "):]
+
+
+def _render_statement(cursor, statement):
+    skeleton = json.loads(cursor.execute("SELECT json_serialize_sql('SELECT 1')").fetchone()[0])
+    skeleton['statements'][0] = statement
+    return cursor.execute("SELECT json_deserialize_sql(?)", [json.dumps(skeleton)]).fetchone()[0]
+
+
+class TermMacroRegistry:
+    def __init__(self, conn, dictionary_path=DICTIONARY_PATH):
+        """
+        Keep the database macros in sync with dictionary.json.
+
+        Macros are stored in the database file together with a term_macros
+        table describing them; on sync only macros whose definition changed
+        are recreated, and macros of removed terms are dropped. A read-only
+        database (every reader's) is only compared with the dictionary:
+        macros lists those it defines as the dictionary does, and stale is
+        set while the dictionary has changes it lacks.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the analytics database
+            dictionary_path (str): Path to dictionary.json
+        """
+        self.conn = conn
+        self.dictionary_path = dictionary_path
+        self.macros = []
+        self.stale = False
+        self.mtime = None
+        self._lock = threading.Lock()
+
+    def sync(self, force=False):
+        """
+        Recompile the dictionary if it changed since the last sync.
+
+        Args:
+            force (bool): Sync even if the file modification time is unchanged
+
+        Returns:
+            list: TermMacro objects of the macros the database defines
+        """
+        try:
+            mtime = os.path.getmtime(self.dictionary_path)
+        except OSError as e:
+            logger.warning(f"Dictionary not available for macros: {e}")
+            return self.macros
+        if not force and mtime == self.mtime:
+            return self.macros
+
+        with self._lock:
+            if not force and mtime == self.mtime:
+                return self.macros
+            with open(self.dictionary_path, 'r', encoding='utf-8') as f:
+                terms = json.load(f).get('business_terms', [])
+            macros = compile_term_macros(terms, self.conn)
+            self.macros = self._apply(macros)
+            self.mtime = mtime
+        return self.macros
+
+    def _apply(self, macros):
+        """Create the changed macros, or on a read-only database check them; returns those defined."""
+        cursor = self.conn.cursor()
+        try:
+            if is_read_only(cursor):
+                return self._check(cursor, macros)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS term_macros (
+                    function TEXT PRIMARY KEY,
+                    term TEXT,
+                    kind TEXT,
+                    definition TEXT
+                )
+            """)
+            stored = {name: (kind, definition) for name, kind, definition in cursor.execute(
+                "SELECT function, kind, definition FROM term_macros"
+            ).fetchall()}
+
+            changed = 0
+            defined = []
+            for macro in macros:
+                if stored.get(macro.name) == (macro.kind, macro.create_sql):
+                    defined.append(macro)
+                    continue
+                try:
+                    cursor.execute(macro.create_sql)
+                except Exception as e:
+                    logger.warning(f"Macro {macro.name} for '{macro.term}' not created: {e}")
+                    continue
+                defined.append(macro)
+                cursor.execute(
+                    "INSERT OR REPLACE INTO term_macros VALUES (?, ?, ?, ?)",
+                    [macro.name, macro.term, macro.kind, macro.create_sql]
+                )
+                changed += 1
+
+            current = {macro.name for macro in macros}
+            for name, (kind, _) in stored.items():
+                if name not in current:
+                    cursor.execute(f"DROP MACRO {'TABLE ' if kind == 'table' else ''}IF EXISTS {name}")
+                    cursor.execute("DELETE FROM term_macros WHERE function = ?", [name])
+                    changed += 1
+            if changed:
+                logger.info(f"Synced {changed} business term macros ({len(defined)} defined)")
+            self.stale = False
+            return defined
+        finally:
+            cursor.close()
+
+    def _check(self, cursor, macros):
+        """On a read-only database macros can't be changed, only compared with the dictionary."""
+        stored = {}
+        if 'term_macros' in {row[0] for row in cursor.execute("SHOW TABLES").fetchall()}:
+            stored = {name: (kind, definition) for name, kind, definition in cursor.execute(
+                "SELECT function, kind, definition FROM term_macros"
+            ).fetchall()}
+        current = {macro.name: (macro.kind, macro.create_sql) for macro in macros}
+        self.stale = stored != current
+        if self.stale:
+            logger.warning(
+                "Business term macros differ from dictionary.json, but the database is read-only; "
+                "only the macros it defines are used until a snapshot is built with them"
+            )
+        return [macro for macro in macros if stored.get(macro.name) == current[macro.name]]
@@ -0,0 +1,379 @@
+import json
+import os
+import re
+import logging
+import threading
+from datetime import datetime
+from .db_bootstrap import is_read_only
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Categorical columns whose values users mention in questions
+CATALOG_COLUMNS = [
+    ('categories', 'category_name'),
+    ('stores', 'region'),
+    ('stores', 'city'),
+    ('stores', 'format'),
+    ('products', 'brand'),
+    ('products', 'product_name'),
+]
+
+ALIASES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metadata", "value_aliases.json")
+
+# Values and phrases shorter than this match too many ordinary words
+MIN_LENGTH = 3
+# Longest phrase, in words, that is compared with catalog values
+MAX_PHRASE_WORDS = 4
+
+
+def normalize(text):
+    """Lowercase the text, replace ё and collapse punctuation to single spaces."""
+    text = str(text).lower().replace('ё', 'е')
+    return " ".join(re.sub(r"[^\w\s-]|(?<!\w)-|-(?!\w)|_", " ", text).split())
+
+
+def trigrams(text):
+    """Character trigrams of a normalized string, padded at word boundaries."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        previous = current
+    return previous[-1]
+
+
+class ResolvedValue:
+    """A phrase from the question resolved to a canonical column value."""
+
+    def __init__(self, phrase, table, column, value, score, alias=None):
+        self.phrase = phrase
+        self.table = table
+        self.column = column
+        self.value = value
+        self.score = score
+        # The alias the phrase matched ("питер"), if not the value itself
+        self.alias = alias
+
+    @property
+    def qualified_column(self):
+        return f"{self.table}.{self.column}"
+
+    def to_dict(self):
+        return {
+            'phrase': self.phrase,
+            'column': self.qualified_column,
+            'value': self.value,
+            'score': round(self.score, 3),
+            'alias': self.alias,
+        }
+
+    def __repr__(self):
+        return f"ResolvedValue({self.phrase!r} -> {self.qualified_column} = {self.value!r}, {self.score:.2f})"
+
+
+class ValueCatalog:
+    def __init__(self, conn, columns=None, aliases_path=ALIASES_PATH, threshold=0.75):
+        """
+        Catalog of distinct values of categorical columns with a fuzzy index
+        that resolves phrases like "Питер" or "молочки" to canonical values.
+
+        The catalog is stored in the database (value_catalog and
+        value_catalog_columns tables); a refresh recomputes only the columns
+        whose contents changed since the previous one.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection to the analytics database
+            columns (list, optional): (table, column) pairs, CATALOG_COLUMNS by default
+            aliases_path (str): Path to value_aliases.json with colloquial names
+            threshold (float): Minimum similarity (0-1) for a fuzzy match
+        """
+        self.conn = conn
+        self.columns = columns or CATALOG_COLUMNS
+        self.aliases_path = aliases_path
+        self.threshold = threshold
+        self.cardinalities = {}
+        self._values = {}
+        self._aliases = {}
+        self._entries = []
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """
+        Bring the catalog up to date with the database and rebuild the index.
+
+        Columns are fingerprinted by row count and a hash of their values, so
+        after a load only the columns that actually changed are rescanned.
+
+        Args:
+            force (bool): Recompute every column
+
+        Returns:
+            list: (table, column) pairs that were recomputed
+        """
+        with self._lock:
+            cursor = self.conn.cursor()
+            try:
+                # Readers of a read-only database load the catalog as written
+                # by the process that built it
+                refreshed = []
+                if not is_read_only(cursor):
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS value_catalog (
+                            table_name TEXT,
+                            column_name TEXT,
+                            value TEXT,
+                            frequency BIGINT
+                        )
+                    """)
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS value_catalog_columns (
+                            table_name TEXT,
+                            column_name TEXT,
+                            fingerprint TEXT,
+                            cardinality BIGINT,
+                            refreshed_at TIMESTAMP,
+                            PRIMARY KEY (table_name, column_name)
+                        )
+                    """)
+                    tables = {row[0] for row in cursor.execute("SHOW TABLES").fetchall()}
+                    stored = {
+                        (table, column): fingerprint for table, column, fingerprint in cursor.execute(
+                            "SELECT table_name, column_name, fingerprint FROM value_catalog_columns"
+                        ).fetchall()
+                    }
+
+                    for table, column in self.columns:
+                        if table not in tables:
+                            continue
+                        count, checksum = cursor.execute(
+                            f"SELECT COUNT({column}), COALESCE(SUM(hash({column})), 0) FROM {table}"
+                        ).fetchone()
+                        fingerprint = f"{count}:{checksum}"
+                        if not force and stored.get((table, column)) == fingerprint:
+                            continue
+                        cursor.execute("BEGIN TRANSACTION")
+                        try:
+                            cursor.execute(
+                                "DELETE FROM value_catalog WHERE table_name = ? AND column_name = ?", [table, column]
+                            )
+                            cursor.execute(f"""
+                                INSERT INTO value_catalog
+                                SELECT '{table}', '{column}', CAST({column} AS TEXT), COUNT(*)
+                                FROM {table}
+                                WHERE {column} IS NOT NULL
+                                GROUP BY {column}
+                            """)
+                            cursor.execute(f"""
+                                INSERT OR REPLACE INTO value_catalog_columns
+                                SELECT '{table}', '{column}', ?, COUNT(DISTINCT {column}), ?
+                                FROM {table}
+                            """, [fingerprint, datetime.now()])
+                            cursor.execute("COMMIT")
+                        except Exception:
+                            cursor.execute("ROLLBACK")
+                            raise
+                        refreshed.append((table, column))
+
+                rows = cursor.execute("""
+                    SELECT table_name, column_name, value, frequency FROM value_catalog
+                """).fetchall()
+                self.cardinalities = {
+                    (table, column): cardinality for table, column, cardinality in cursor.execute(
+                        "SELECT table_name, column_name, cardinality FROM value_catalog_columns"
+                    ).fetchall()
+                    if (table, column) in self.columns
+                }
+            finally:
+                cursor.close()
+
+            self._build_index([row for row in rows if (row[0], row[1]) in self.columns])
+        if refreshed:
+            logger.info(f"Value catalog refreshed for {', '.join(f'{t}.{c}' for t, c in refreshed)}")
+        return refreshed
+
+    def _build_index(self, rows):
+        aliases = self._load_aliases()
+        values = {}
+        value_aliases = {}
+        entries = []
+        for table, column, value, frequency in sorted(rows, key=lambda r: -r[3]):
+            values.setdefault((table, column), []).append(value)
+            names = [(normalize(value), None)]
+            names += [(normalize(alias), alias) for alias in aliases.get(f"{table}.{column}", {}).get(value, [])]
+            for name, alias in names:
+                if len(name) < MIN_LENGTH:
+                    continue
+                if alias is not None:
+                    value_aliases.setdefault((table, column), {})[name] = value
+                entries.append({
+                    'name': name,
+                    'trigrams': trigrams(name),
+                    'table': table,
+                    'column': column,
+                    'value': value,
+                    'frequency': frequency,
+                    'alias': alias,
+                })
+        index = {}
+        for i, entry in enumerate(entries):
+            for gram in entry['trigrams']:
+                index.setdefault(gram, []).append(i)
+        self._values, self._aliases = values, value_aliases
+        self._entries, self._index = entries, index
+
+    def _load_aliases(self):
+        try:
+            with open(self.aliases_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Value aliases not loaded: {e}")
+            return {}
+
+    def values(self, table, column):
+        """Return the catalog values of a column, most frequent first."""
+        return list(self._values.get((table, column), []))
+
+    def aliases(self, table, column):
+        """Return the normalized aliases of a column's values as {alias: value}."""
+        return dict(self._aliases.get((table, column), {}))
+
+    def lookup(self, phrase):
+        """
+        Find catalog values similar to a phrase.
+
+        Similarity is the larger of the trigram Dice coefficient and the
+        normalized edit distance, which tolerates both typos ("Простаквашино")
+        and Russian case endings ("молочных продуктов").
+
+        Args:
+            phrase (str): Text to look up
+
+        Returns:
+            list: (score, entry) pairs above the threshold, best first
+        """
+        name = normalize(phrase)
+        if len(name) < MIN_LENGTH:
+            return []
+        grams = trigrams(name)
+        shared = {}
+        for gram in grams:
+            for i in self._index.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+
+        matches = []
+        for i, count in shared.items():
+            entry = self._entries[i]
+            # Typos are rarely in the first letter; this also keeps short
+            # words away from unrelated values
+            if entry['name'][0] != name[0]:
+                continue
+            dice = 2 * count / (len(grams) + len(entry['trigrams']))
+            if dice < self.threshold / 2:
+                continue
+            ratio = 1 - edit_distance(name, entry['name']) / max(len(name), len(entry['name']))
+            score = max(dice, ratio)
+            if score >= self.threshold:
+                matches.append((score, entry))
+        matches.sort(key=lambda m: (-m[0], -m[1]['frequency']))
+        return matches
+
+    def resolve(self, text):
+        """
+        Resolve phrases of a question to canonical catalog values.
+
+        Phrases of up to MAX_PHRASE_WORDS words are looked up; the best
+        scoring non-overlapping phrases win, longer ones on ties. A value
+        present in several columns (a city that is also a region) is
+        returned once per column.
+
+        Args:
+            text (str): The question
+
+        Returns:
+            list: ResolvedValue objects in question order
+        """
+        tokens = normalize(text).split()
+        candidates = []
+        for size in range(min(MAX_PHRASE_WORDS, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                phrase = " ".join(tokens[start:start + size])
+                matches = self.lookup(phrase)
+                if matches:
+                    candidates.append((matches[0][0], size, start, phrase, matches))
+        candidates.sort(key=lambda c: (-c[0], -c[1], c[2]))
+
+        taken = set()
+        resolved = []
+        for best, size, start, phrase, matches in candidates:
+            span = set(range(start, start + size))
+            if span & taken:
+                continue
+            taken |= span
+            value = matches[0][1]['value']
+            columns = set()
+            for score, entry in matches:
+                key = (entry['table'], entry['column'])
+                if score < best or entry['value'] != value or key in columns:
+                    continue
+                columns.add(key)
+                resolved.append((start, ResolvedValue(
+                    phrase, entry['table'], entry['column'], value, score, entry['alias']
+                )))
+        resolved.sort(key=lambda r: r[0])
+        return [value for _, value in resolved]
+
+    def describe(self, max_values=30):
+        """
+        Describe the catalog for a prompt: values of small columns, cardinality of large ones.
+
+        Args:
+            max_values (int): Columns with more distinct values only report their count
+
+        Returns:
+            str: One line per column
+        """
+        lines = []
+        for table, column in self.columns:
+            if (table, column) not in self.cardinalities:
+                continue
+            cardinality = self.cardinalities[(table, column)]
+            if cardinality <= max_values:
+                values = ", ".join(self.values(table, column))
+                lines.append(f"{table}.{column} ({cardinality}): {values}")
+            else:
+                lines.append(f"{table}.{column}: {cardinality} различных значений")
+        return "\n".join(lines)
+
+    def hints(self, text):
+        """
+        Format the values resolved from a question as a hint for the LLM.
+
+        Args:
+            text (str): The question
+
+        Returns:
+            str: Hint lines, or an empty string if nothing was resolved
+        """
+        resolved = self.resolve(text)
+        if not resolved:
+            return ""
+        lines = [
+            f"- «{r.phrase}» → {r.qualified_column} = '{r.value}'" for r in resolved
+        ]
+        return "Значения из базы данных, упомянутые в вопросе:\n" + "\n".join(lines)
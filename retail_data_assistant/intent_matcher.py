@@ -0,0 +1,329 @@
+import re
+import logging
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Metrics by dictionary.json term: word stems that name them
+METRICS = {
+    'средний чек': ('чек',),
+    'маржа': ('марж', 'маржинальн'),
+    'прибыль': ('прибыл',),
+    'выручка': ('выручк', 'оборот'),
+    'продажи': ('продаж', 'продан'),
+}
+
+# Entities to rank by semantic layer dimension: word stems that name them
+DIMENSIONS = {
+    'product': ('товар', 'продукт'),
+    'subcategory': ('подкатегор',),
+    'category': ('категор',),
+    'department': ('отдел',),
+    'brand': ('бренд', 'производител'),
+    'supplier': ('поставщик',),
+    'store': ('магазин',),
+    'city': ('город',),
+    'region': ('регион',),
+    'format': ('формат',),
+    'customer': ('клиент', 'покупател'),
+    'payment_type': ('оплат',),
+}
+
+# Dimensions whose values are recognized as filters
+CATALOG = ['category', 'subcategory', 'city', 'region', 'format', 'brand']
+
+# Periods: regex -> (semantic layer period, fixed fields); a regex group is the period's n
+PERIODS = [
+    (r'сегодня', 'today', {}),
+    (r'вчера', 'yesterday', {}),
+    (r'(?:последни[ех]|за)\s+(\d+)\s+(?:дн\w*|суток)', 'last_n_days', {}),
+    (r'(?:последни[ех]|за)\s+(\d+)\s+недел\w*', 'last_n_weeks', {}),
+    (r'(?:последни[ех]|за)\s+(\d+)\s+месяц\w*', 'last_n_months', {}),
+    (r'(?:перв\w*|1(?:-?й)?)\s+квартал\w*\s+прошл\w*\s+год\w*', 'last_year', {'quarter': 1}),
+    (r'(?:втор\w*|2(?:-?й)?)\s+квартал\w*\s+прошл\w*\s+год\w*', 'last_year', {'quarter': 2}),
+    (r'(?:трет\w*|3(?:-?й)?)\s+квартал\w*\s+прошл\w*\s+год\w*', 'last_year', {'quarter': 3}),
+    (r'(?:четверт\w*|4(?:-?й)?)\s+квартал\w*\s+прошл\w*\s+год\w*', 'last_year', {'quarter': 4}),
+    (r'(?:перв\w*|1(?:-?й)?)\s+квартал\w*(?:\s+(?:эт|текущ)\w*\s+год\w*)?', 'current_year', {'quarter': 1}),
+    (r'(?:втор\w*|2(?:-?й)?)\s+квартал\w*(?:\s+(?:эт|текущ)\w*\s+год\w*)?', 'current_year', {'quarter': 2}),
+    (r'(?:трет\w*|3(?:-?й)?)\s+квартал\w*(?:\s+(?:эт|текущ)\w*\s+год\w*)?', 'current_year', {'quarter': 3}),
+    (r'(?:четверт\w*|4(?:-?й)?)\s+квартал\w*(?:\s+(?:эт|текущ)\w*\s+год\w*)?', 'current_year', {'quarter': 4}),
+    (r'(?:прошл|предыдущ)\w*\s+недел\w*', 'last_completed_week', {}),
+    (r'(?:эт|текущ)\w*\s+недел\w*', 'current_week', {}),
+    (r'последн\w*\s+недел\w*', 'last_7_days', {}),
+    (r'(?:прошл|предыдущ)\w*\s+месяц\w*', 'last_completed_month', {}),
+    (r'(?:эт|текущ|последн)\w*\s+месяц\w*', 'current_month', {}),
+    (r'(?:прошл|предыдущ)\w*\s+квартал\w*', 'last_completed_quarter', {}),
+    (r'последн\w*\s+квартал\w*', 'last_n_months', {'n': 3}),
+    (r'(?:эт|текущ)\w*\s+квартал\w*', 'current_quarter', {}),
+    (r'с\s+начала\s+(?:(?:эт|текущ)\w*\s+)?года', 'year_to_date', {}),
+    (r'(?:прошл|предыдущ)\w*\s+год\w*', 'last_year', {}),
+    (r'последн\w*\s+год\w*', 'last_n_months', {'n': 12}),
+    (r'(?:эт|текущ)\w*\s+год\w*', 'current_year', {}),
+]
+
+# Any of these left over after the period was matched means the question
+# mentions time in a way the templates do not cover
+TIME_STEMS = (
+    'дня', 'дней', 'дни', 'дням', 'день', 'суток', 'недел', 'месяц', 'квартал', 'год', 'лет', 'сезон',
+    'праздн', 'выходн', 'январ', 'феврал', 'март', 'апрел', 'мая', 'май', 'июн', 'июл', 'август',
+    'сентябр', 'октябр', 'ноябр', 'декабр',
+)
+
+# Words that change the meaning beyond "top-N by metric"
+BLOCKERS = (
+    'вместе', 'сравн', 'динамик', 'измен', 'рост', 'паден', 'тренд', 'дол', 'процент', 'каждо', 'кроме',
+    'не', 'без', 'запас', 'остат', 'промо', 'акци', 'скидк', 'возраст', 'чаще', 'реже',
+)
+
+ASCENDING = ('наименьш', 'меньш', 'худш', 'минимальн', 'аутсайдер')
+RANKING = ('топ', 'наибольш', 'больш', 'лучш', 'максимальн', 'лидер', 'рейтинг', 'сам', 'крупн', 'ведущ') + ASCENDING
+
+# Words that carry no meaning for the template
+FILLER = (
+    'покаж', 'вывед', 'выведи', 'дай', 'найд', 'найти', 'определ', 'посчит', 'рассчит', 'отобраз', 'перечисл',
+    'список', 'как', 'кто', 'где', 'у', 'в', 'во', 'на', 'по', 'за', 'среди', 'из', 'для', 'от', 'с', 'со',
+    'и', 'мне', 'нам', 'все', 'всег', 'всех', 'имеют', 'имеет', 'принос', 'принесл', 'дают', 'дает', 'дал',
+    'сделал', 'был', 'получ', 'сумм', 'общ', 'итог', 'размер', 'величин', 'значени', 'показател', 'объем',
+    'количеств', 'уровн', 'уровен', 'средн', 'их', 'его', 'ее', 'это', 'эти', 'котор',
+)
+
+def normalize(text):
+    """Lowercase the text, replace ё and drop punctuation except hyphens inside words."""
+    text = text.lower().replace('ё', 'е')
+    return re.sub(r"[^\w\s-]|(?<!\w)-|-(?!\w)", " ", text)
+
+
+def _stem(word):
+    """A prefix that survives Russian case endings."""
+    if len(word) <= 3:
+        return word
+    if len(word) <= 6:
+        return word[:-1]
+    return word[:-2]
+
+
+def _has_stem(token, stems):
+    """Whether the token is one of the words, or starts with one of the stems of three letters or more."""
+    return any(token == stem or (len(stem) >= 3 and token.startswith(stem)) for stem in stems)
+
+
+class TemplateMatch:
+    """A question recognized by the intent matcher, with its compiled SQL."""
+
+    def __init__(self, compiled, period_text, ranking, labels):
+        self.compiled = compiled
+        self.spec = compiled.spec
+        self.period_text = period_text
+        self.ranking = ranking
+        self._labels = labels
+
+    @property
+    def sql(self):
+        return self.compiled.sql
+
+    @property
+    def params(self):
+        return self.compiled.params
+
+    @property
+    def display_sql(self):
+        """The SQL with parameters substituted, for display and logging."""
+        return self.compiled.display_sql
+
+    @property
+    def description(self):
+        """Short summary of the recognized slots for the UI."""
+        spec = self.spec
+        parts = [f"{', '.join(spec['metrics'])} по измерению «{self._labels[spec['dimensions'][0]]}»"]
+        if self.ranking:
+            descending = spec['sort'][0]['order'] == 'desc'
+            parts.append(f"{'наибольшие' if descending else 'наименьшие'} {spec['limit']}")
+        if self.period_text:
+            parts.append(f"период «{self.period_text}»")
+        for condition in spec['filters']:
+            parts.append(f"{self._labels[condition['dimension']]}: {condition['value']}")
+        return "; ".join(parts)
+
+
+class IntentMatcher:
+    def __init__(self, conn, semantic_layer, value_catalog=None):
+        """
+        Recognize "top-N <entity> by <metric> for <period> in <filter>"
+        questions and compile them to SQL without the LLM.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection): Connection used to load filter values
+            semantic_layer (data_manager.semantic_layer.SemanticLayer): Compiles the recognized slots
+            value_catalog (data_manager.value_catalog.ValueCatalog, optional): Source of filter
+                values and their aliases ("Питер"); values are queried directly if omitted
+        """
+        self.conn = conn
+        self.semantic_layer = semantic_layer
+        self.value_catalog = value_catalog
+        self.metrics = {
+            term: stems for term, stems in METRICS.items() if term in semantic_layer.metrics
+        }
+        self.dimensions = {
+            name: stems for name, stems in DIMENSIONS.items() if name in semantic_layer.dimensions
+        }
+        self.labels = {name: d['label'] for name, d in semantic_layer.dimensions.items()}
+
+        self.refresh_catalog()
+        logger.info(f"Intent matcher initialized with {len(self.metrics)} metrics and {len(self.values)} filter values")
+
+    def refresh_catalog(self, conn=None):
+        """
+        Reload filter values (categories, cities, formats...) from the database.
+
+        Args:
+            conn (duckdb.DuckDBPyConnection, optional): Switch to another
+                connection first, e.g. after a snapshot switch
+        """
+        if conn is not None:
+            self.conn = conn
+        values = []
+        cursor = self.conn.cursor()
+        try:
+            for dimension in CATALOG:
+                spec = self.semantic_layer.dimensions[dimension]
+                names = []
+                if self.value_catalog is not None and (spec['table'], spec['name']) in self.value_catalog.columns:
+                    names += [(value, value) for value in self.value_catalog.values(spec['table'], spec['name'])]
+                    names += [
+                        (alias, value) for alias, value in self.value_catalog.aliases(spec['table'], spec['name']).items()
+                    ]
+                else:
+                    rows = cursor.execute(
+                        f"SELECT DISTINCT {spec['name']} FROM {spec['table']} WHERE {spec['name']} IS NOT NULL"
+                    ).fetchall()
+                    names += [(value, value) for (value,) in rows]
+                for name, value in names:
+                    words = normalize(str(name)).split()
+                    # Very short values ("Я") would match ordinary words
+                    if len(''.join(words)) < 3:
+                        continue
+                    values.append((dimension, value, [(_stem(w), len(w)) for w in words]))
+        finally:
+            cursor.close()
+        # Longer values win over their prefixes ("Молочные продукты" over "Молоко")
+        values.sort(key=lambda v: -len(v[2]))
+        self.values = values
+
+    def match(self, question):
+        """
+        Try to answer a question with a template.
+
+        Args:
+            question (str): The question in natural language
+
+        Returns:
+            TemplateMatch: The matched template, or None if the LLM should handle the question
+        """
+        text = normalize(question)
+
+        # N, as in "топ-10" or "5 лучших"
+        limit = None
+        match = re.search(r'топ\s*-?\s*(\d+)|(\d+)\s+(?:сам|лучш|худш|крупн|перв|ведущ)\w*', text)
+        if match:
+            if match.group(1):
+                limit = int(match.group(1))
+                text = text[:match.start()] + " топ " + text[match.end():]
+            else:
+                # Keep the word after the number: "5 худших" sets the order
+                limit = int(match.group(2))
+                text = text[:match.start(2)] + " топ " + text[match.end(2):]
+
+        # Period
+        period, period_text = None, None
+        for pattern, name, fields in PERIODS:
+            match = re.search(rf'\b{pattern}\b', text)
+            if match:
+                period_text = match.group(0)
+                period = dict(fields, name=name)
+                if match.groups():
+                    period['n'] = int(match.group(1))
+                text = text[:match.start()] + " " + text[match.end():]
+                break
+
+        tokens = text.split()
+        if any(token.isdigit() for token in tokens):
+            return self._no_match(question, "unmatched number")
+        if any(_has_stem(token, BLOCKERS) for token in tokens):
+            return self._no_match(question, "unsupported construction")
+        if any(_has_stem(token, TIME_STEMS) for token in tokens):
+            return self._no_match(question, "unsupported period")
+
+        # Filter values; the word naming the filter ("в категории ...") goes with it
+        consumed = set()
+        filters = []
+        for dimension, value, stems in self.values:
+            span = self._find(tokens, stems, consumed)
+            if span is None:
+                continue
+            start, end = span
+            if start > 0 and (start - 1) not in consumed and _has_stem(tokens[start - 1], DIMENSIONS[dimension]):
+                start -= 1
+            consumed.update(range(start, end))
+            if not any(value == condition['value'] for condition in filters):
+                filters.append({'dimension': dimension, 'op': '=', 'value': value})
+
+        # Metrics, dimension and ranking from the remaining words
+        metrics, dimension, ranking, descending, by_dimension = [], None, limit is not None, True, False
+        for i, token in enumerate(tokens):
+            if i in consumed:
+                continue
+            metric = next((term for term, stems in self.metrics.items() if _has_stem(token, stems)), None)
+            if metric is not None:
+                if metric not in metrics:
+                    metrics.append(metric)
+                continue
+            found = next((name for name, stems in self.dimensions.items() if _has_stem(token, stems)), None)
+            if found is not None:
+                if dimension is None:
+                    dimension = found
+                    by_dimension = i > 0 and tokens[i - 1] == 'по'
+                continue
+            if _has_stem(token, RANKING):
+                ranking = True
+                descending = descending and not _has_stem(token, ASCENDING)
+                continue
+            if _has_stem(token, FILLER):
+                continue
+            return self._no_match(question, f"unknown word '{token}'")
+
+        # "продажи" is usually part of another metric ("выручка от продаж")
+        if len(metrics) > 1 and 'продажи' in metrics:
+            metrics.remove('продажи')
+        if not metrics or dimension is None:
+            return self._no_match(question, "no metric or dimension")
+        if not (ranking or by_dimension):
+            return self._no_match(question, "no ranking")
+
+        spec = {
+            'metrics': metrics,
+            'dimensions': [dimension],
+            'period': period,
+            'filters': filters,
+            'sort': [{'by': metrics[0], 'order': 'desc' if descending else 'asc'}],
+            'limit': limit or (10 if ranking else None),
+        }
+        template = TemplateMatch(self.semantic_layer.compile(spec), period_text, ranking, self.labels)
+        logger.info(f"Question matched a template: {template.description}")
+        return template
+
+    def _find(self, tokens, stems, consumed):
+        """Find consecutive unconsumed tokens starting with the value's word stems."""
+        for start in range(len(tokens) - len(stems) + 1):
+            if all(
+                start + j not in consumed
+                and tokens[start + j].startswith(stem)
+                and len(tokens[start + j]) <= length + 3
+                for j, (stem, length) in enumerate(stems)
+            ):
+                return start, start + len(stems)
+        return None
+
+    def _no_match(self, question, reason):
+        logger.info(f"No template for question ({reason}), falling back to LLM")
+        return None
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import math
+import os
+import random
+import zlib
+import logging
+from data_manager.example_warmer import question_key
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Completion:
+    """Text and token usage of an LLM answer, whatever backend produced it."""
+
+    def __init__(self, text, prompt_tokens=None, completion_tokens=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    @property
+    def total_tokens(self):
+        if self.prompt_tokens is None or self.completion_tokens is None:
+            return None
+        return self.prompt_tokens + self.completion_tokens
+
+
+class OpenAIBackend:
+    name = 'openai'
+
+    def __init__(self, api_key, base_url=None, connect_timeout=5, read_timeout=30, max_connections=20):
+        """
+        Chat completions of the OpenAI API or an OpenAI-compatible endpoint.
+
+        Args:
+            api_key (str): API key
+            base_url (str, optional): OpenAI-compatible endpoint instead of the OpenAI API
+            connect_timeout (float): Seconds to establish a connection to the API
+            read_timeout (float): Seconds to wait for a response
+            max_connections (int): Size of the keep-alive connection pool
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        # The openai package is slow to import; it is loaded on first use
+        self._client = None
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use."""
+        if self._client is None:
+            import openai
+            from openai import AsyncOpenAI
+            # Timeout and limits come from the HTTP package the installed
+            # openai version is built on, whichever it is
+            timeout = openai.Timeout(self.read_timeout, connect=self.connect_timeout)
+            limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+                max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+            )
+            # One pool of keep-alive connections for all calls of the process
+            # instead of a TLS handshake per question
+            http_client = openai.DefaultAsyncHttpxClient(timeout=timeout, limits=limits)
+            # Retries are made by LLMProcessor, so they go through the rate limiter
+            self._client = AsyncOpenAI(
+                api_key=self.api_key, base_url=self.base_url, timeout=timeout, max_retries=0,
+                http_client=http_client
+            )
+        return self._client
+
+    async def complete(self, request):
+        """
+        Make a chat completion call.
+
+        Args:
+            request (dict): Chat completion parameters (model, messages, max_tokens...)
+
+        Returns:
+            Completion: The answer
+        """
+        response = await self.client.chat.completions.create(**request)
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage is not None else None,
+            usage.completion_tokens if usage is not None else None,
+        )
+
+    def error_kind(self, error):
+        """
+        Classify a failed call.
+
+        Returns:
+            str: 'rate_limited' for 429, 'transient' for 5xx, timeouts and
+                connection errors, None for errors not worth retrying
+        """
+        import openai
+
+        if isinstance(error, openai.RateLimitError):
+            return 'rate_limited'
+        if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+            return 'transient'
+        return None
+
+    def retry_after(self, error):
+        """Seconds from the Retry-After header of a failed call, or None."""
+        try:
+            return float(error.response.headers.get('retry-after'))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+
+class LatencyDistribution:
+    def __init__(self, kind='lognormal', *params):
+        """
+        Latency of simulated LLM calls.
+
+        Args:
+            kind (str): 'fixed' (ms), 'uniform' (min_ms, max_ms) or
+                'lognormal' (median_ms, sigma[, tail_rate, tail_ms]); the
+                optional tail makes tail_rate of the calls take tail_ms
+            params (float): Parameters of the distribution
+        """
+        expected = {'fixed': (1, 1), 'uniform': (2, 2), 'lognormal': (2, 4)}
+        if kind not in expected or not expected[kind][0] <= len(params) <= expected[kind][1]:
+            raise ValueError(f"Invalid latency distribution: {kind} {params}")
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parse a distribution like "lognormal:800,0.4" or "fixed:500".
+
+        Args:
+            text (str): kind:param,param...
+
+        Returns:
+            LatencyDistribution: The distribution
+        """
+        kind, _, params = text.partition(':')
+        return cls(kind.strip(), *(float(param) for param in params.split(',') if param.strip()))
+
+    def sample(self, rng):
+        """
+        Draw a latency.
+
+        Args:
+            rng (random.Random): Source of randomness
+
+        Returns:
+            float: Seconds
+        """
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.params)
+        else:
+            median, sigma = self.params[:2]
+            ms = median * math.exp(rng.gauss(0, sigma))
+            if len(self.params) == 4 and rng.random() < self.params[2]:
+                ms = self.params[3]
+        return ms / 1000
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(f'{param:g}' for param in self.params)}"
+
+
+class ReplayBackend:
+    name = 'replay'
+
+    def __init__(self, examples_path=None, latency="lognormal:800,0.4", seed=0):
+        """
+        Deterministic stand-in for the LLM, for load tests and capacity
+        planning without the OpenAI API: answers with the SQL of
+        metadata/query_examples.json after a simulated latency.
+
+        A question from the examples gets its own SQL, any other question
+        the SQL of an example chosen by a hash of the question, so the same
+        question always gets the same query. Requests for a semantic-layer
+        spec are answered as unsupported, which sends the question on to SQL
+        generation as a question outside the layer would. Latencies come from
+        a seeded generator, so a run with the same calls in the same order
+        is repeated exactly.
+
+        Args:
+            examples_path (str, optional): Examples file; metadata/query_examples.json by default
+            latency (str or LatencyDistribution): Latency of a call, e.g. "lognormal:800,0.4"
+            seed (int): Seed of the latency generator
+        """
+        if examples_path is None:
+            examples_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metadata", "query_examples.json")
+        with open(examples_path, 'r', encoding='utf-8') as f:
+            self.examples = json.load(f)['examples']
+        if not self.examples:
+            raise ValueError(f"No examples in {examples_path}")
+        self.by_question = {question_key(example['question']): example['sql'] for example in self.examples}
+        self.latency = latency if isinstance(latency, LatencyDistribution) else LatencyDistribution.parse(latency)
+        # Calls run on the processor's event loop thread, one generator is enough
+        self._rng = random.Random(seed)
+        self.calls = 0
+        logger.info(f"Replay LLM backend with {len(self.examples)} examples, latency {self.latency}")
+
+    def sql_for(self, question):
+        """The SQL the backend answers a question with."""
+        key = question_key(question)
+        if key in self.by_question:
+            return self.by_question[key]
+        return self.examples[zlib.crc32(key.encode('utf-8')) % len(self.examples)]['sql']
+
+    async def complete(self, request):
+        """
+        Answer a chat completion request after the simulated latency.
+
+        Args:
+            request (dict): Chat completion parameters (model, messages, max_tokens...)
+
+        Returns:
+            Completion: The answer
+        """
+        self.calls += 1
+        messages = request['messages']
+        # The question is the first user message; resolved values follow it after a blank line
+        question = next(message['content'] for message in messages if message['role'] == 'user').split('\n\n')[0]
+        if request.get('response_format', {}).get('type') == 'json_object':
+            text = json.dumps({'unsupported': True})
+        else:
+            text = f"```sql\n{self.sql_for(question)}\n```"
+        await asyncio.sleep(self.latency.sample(self._rng))
+        return Completion(
+            text,
+            prompt_tokens=sum(len(message['content']) for message in messages) // 3,
+            completion_tokens=len(text) // 3,
+        )
+
+    def error_kind(self, error):
+        return None
+
+    def retry_after(self, error):
+        return None
@@ -1,33 +1,101 @@
+import asyncio
 import json
 import os
+import random
+import threading
+import time
+from datetime import date
 import streamlit as st
-from openai import OpenAI
 import logging
+from llm_backends import OpenAIBackend
+from utils.metrics import QueryMetrics
+from utils.rate_limiter import LLMQueueTimeout
+from data_manager.sql_validator import SQLValidationError
+from data_manager.semantic_layer import SpecValidationError
+from data_manager.decomposition import parse_decomposition
+from data_manager.followup import PREVIOUS_RESULT, parse_followup
+from data_manager.term_macros import compile_term_macros
+from data_manager.example_warmer import question_key
+from utils.single_flight import SingleFlight
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class LLMProcessor:
-    def __init__(self):
-        # Load OpenAI API key from Streamlit secrets
-        try:
-            self.api_key = st.secrets["openai"]["api_key"]
-        except Exception as e:
-            logger.error(f"Failed to load OpenAI API key: {e}")
-            st.error("OpenAI API key not found in secrets. Please set up your .streamlit/secrets.toml file.")
-            self.api_key = None
+    def __init__(self, value_catalog=None, coalesce=True, rate_limiter=None, max_retries=3,
+                 retry_base_delay=0.5, retry_max_delay=20, base_url=None, hedge_policy=None,
+                 connect_timeout=5, read_timeout=30, max_connections=20, backend=None, term_macros=None):
+        """
+        Args:
+            value_catalog (data_manager.value_catalog.ValueCatalog, optional): Resolves
+                column values mentioned in questions; resolved values are added to the prompt
+            coalesce (bool): Share one LLM call between identical questions asked concurrently
+            rate_limiter (utils.rate_limiter.LLMRateLimiter, optional): Process-wide
+                request and token budget the calls queue for
+            max_retries (int): Retries of a call that failed with 429, 5xx or a connection error
+            retry_base_delay (float): Seconds of the first backoff, doubled on each retry
+            retry_max_delay (float): Upper bound of a backoff in seconds
+            base_url (str, optional): OpenAI-compatible endpoint instead of the OpenAI API
+            hedge_policy (utils.hedging.HedgePolicy, optional): Send a duplicate of a
+                call that is slower than usual and use the first answer
+            connect_timeout (float): Seconds to establish a connection to the API
+            read_timeout (float): Seconds to wait for a response
+            max_connections (int): Size of the keep-alive connection pool
+            backend (optional): What answers the calls, e.g. llm_backends.ReplayBackend
+                for load tests; the OpenAI API with the settings above by default
+            term_macros (data_manager.term_macros.TermMacroRegistry, optional): Macros
+                the database defines, listed in the prompt; without it they are
+                compiled from dictionary.json
+        """
+        self.value_catalog = value_catalog
+        self.term_macro_registry = term_macros
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_policy = hedge_policy
+        
+        # Identical questions in flight at the same time wait for one LLM call
+        self.in_flight = SingleFlight('llm', enabled=coalesce)
         
-        self.client = OpenAI(api_key=self.api_key) if self.api_key else None
+        self.backend = backend
+        if self.backend is None:
+            # Load OpenAI API key from Streamlit secrets; headless services
+            # (api_server.py) may set OPENAI_API_KEY instead
+            try:
+                api_key = st.secrets["openai"]["api_key"]
+            except Exception as e:
+                api_key = os.environ.get("OPENAI_API_KEY")
+                if not api_key:
+                    logger.error(f"Failed to load OpenAI API key: {e}")
+                    st.error("OpenAI API key not found in secrets. Please set up your .streamlit/secrets.toml file.")
+            if api_key:
+                self.backend = OpenAIBackend(api_key, base_url, connect_timeout, read_timeout, max_connections)
+        
+        # Calls run as tasks on an event loop of their own, so that the
+        # loser of a hedged pair can be cancelled mid-request
+        self._loop = None
+        self._loop_lock = threading.Lock()
         
         # Load metadata
         self.metadata_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metadata")
         self.schema = self._load_json("schema.json")
         self.dictionary = self._load_json("dictionary.json")
+        self._dictionary_mtime = self._metadata_mtime("dictionary.json")
+        self.term_macros = self._compile_term_macros()
         self.query_examples = self._load_json("query_examples.json")
         
         logger.info("LLM Processor initialized")
 
+    def _io_loop(self):
+        """Event loop of the LLM calls, running in a background thread."""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-io", daemon=True).start()
+            return self._loop
+
     def _load_json(self, filename):
         """Load JSON file from metadata directory."""
         try:
@@ -41,56 +109,547 @@ class LLMProcessor:
             logger.error(f"Error loading {filename}: {e}")
             return {}
 
-    def generate_sql(self, user_query):
-        """Generate SQL query from natural language query using LLM."""
-        if not self.client:
+    def _metadata_mtime(self, filename):
+        try:
+            return os.path.getmtime(os.path.join(self.metadata_dir, filename))
+        except OSError:
+            return None
+
+    def _compile_term_macros(self):
+        """Term macros for the prompt: those the database defines, if known."""
+        if self.term_macro_registry is not None:
+            return list(self.term_macro_registry.macros)
+        return compile_term_macros(self.dictionary.get('business_terms', []))
+
+    def _refresh_dictionary(self):
+        """Reload the dictionary and its term macros if the file changed."""
+        mtime = self._metadata_mtime("dictionary.json")
+        if mtime != self._dictionary_mtime:
+            self.dictionary = self._load_json("dictionary.json")
+            self._dictionary_mtime = mtime
+            logger.info("Dictionary reloaded")
+        # Macros of the database change with a snapshot switch, not only with the file
+        self.term_macros = self._compile_term_macros()
+
+    def _user_message(self, user_query):
+        """The question, followed by the column values it mentions, if any were resolved."""
+        if self.value_catalog is None:
+            return user_query
+        hints = self.value_catalog.hints(user_query)
+        if hints:
+            logger.info(f"Resolved values for the question: {hints}")
+            return f"{user_query}\n\n{hints}"
+        return user_query
+
+    def generate_sql(self, user_query, metrics=None):
+        """
+        Generate SQL query from natural language query using LLM.
+        
+        Args:
+            user_query (str): The question in natural language
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+        """
+        if self.backend is None:
             raise Exception("OpenAI client not initialized. Check your API key.")
         
+        metrics = metrics or QueryMetrics(user_query)
+        
         # Prepare system prompt with context
-        system_prompt = self._prepare_system_prompt()
+        with metrics.stage('prompt_build'):
+            system_prompt = self._prepare_system_prompt()
+            user_message = self._user_message(user_query)
         
         try:
-            # Call the LLM
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Using GPT-4o mini as specified
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_query}
-                ],
-                temperature=0.1,  # Low temperature for more deterministic responses
-                max_tokens=500,   # Limiting token count for the response
-            )
-            
-            # Extract SQL from response
-            sql_query = response.choices[0].message.content.strip()
-            
-            # If the response contains markdown SQL block, extract just the SQL
-            if "```sql" in sql_query:
-                sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
-            elif "```" in sql_query:
-                sql_query = sql_query.split("```")[1].split("```")[0].strip()
-            
-            # Ensure the query has a LIMIT clause
-            if "LIMIT" not in sql_query.upper():
-                # Удаляем точку с запятой в конце запроса, если она есть
-                if sql_query.strip().endswith(';'):
-                    sql_query = sql_query.strip()[:-1]
-                
-                # Добавляем LIMIT в конец запроса
-                sql_query = f"{sql_query} LIMIT 1000"
+            sql_query = self._coalesced(('sql', question_key(user_query)), metrics, self._complete, [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ], metrics)
+            metrics.sql = sql_query
             
             logger.info(f"Generated SQL query: {sql_query}")
             return sql_query
             
+        except LLMQueueTimeout:
+            raise
         except Exception as e:
             logger.error(f"Error generating SQL: {e}")
             raise Exception(f"Failed to generate SQL: {str(e)}")
 
+    def generate_validated_sql(self, user_query, validator, metrics=None, max_repairs=2, rewriter=None):
+        """
+        Generate SQL and dry-run it before execution, asking the LLM to
+        repair queries that fail to bind or are too expensive.
+        
+        Args:
+            user_query (str): The question in natural language
+            validator (data_manager.sql_validator.SQLValidator): Dry-run validator
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+            max_repairs (int): Maximum number of repair round trips
+            rewriter (data_manager.sql_rewriter.SQLRewriter, optional): Rewrites
+                expensive patterns before validation; findings go to metrics.findings
+            
+        Returns:
+            str: SQL that passed validation
+            
+        Raises:
+            SQLValidationError: If the SQL is still invalid after all repairs
+        """
+        metrics = metrics or QueryMetrics(user_query)
+        sql_query = self.generate_sql(user_query, metrics=metrics)
+        
+        for attempt in range(max_repairs + 1):
+            try:
+                with metrics.stage('validate'):
+                    if rewriter is not None:
+                        analysis = rewriter.analyze(sql_query)
+                        sql_query = analysis.sql
+                        metrics.findings = analysis.findings
+                        metrics.sql = sql_query
+                    validator.validate(sql_query)
+                return sql_query
+            except SQLValidationError as e:
+                logger.warning(f"Validation failed ({e.kind}, attempt {attempt + 1}): {e}")
+                if attempt == max_repairs:
+                    raise
+                sql_query = self.repair_sql(user_query, sql_query, e, metrics=metrics)
+
+    def repair_sql(self, user_query, sql_query, error, metrics=None):
+        """
+        Ask the LLM to fix a query using the error reported by the database.
+        
+        Args:
+            user_query (str): The original question
+            sql_query (str): The SQL that failed validation
+            error (Exception): The validation or binder error
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+            
+        Returns:
+            str: The repaired SQL query
+        """
+        if self.backend is None:
+            raise Exception("OpenAI client not initialized. Check your API key.")
+        
+        metrics = metrics or QueryMetrics(user_query)
+        
+        with metrics.stage('prompt_build'):
+            system_prompt = self._prepare_system_prompt()
+            user_message = self._user_message(user_query)
+        
+        try:
+            repaired_sql = self._complete([
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": sql_query},
+                {"role": "user", "content": (
+                    f"Этот запрос не прошел проверку в DuckDB:\n{error}\n"
+                    "Исправь запрос. Верни ТОЛЬКО исправленный SQL запрос."
+                )}
+            ], metrics)
+            
+            logger.info(f"Repaired SQL query: {repaired_sql}")
+            return repaired_sql
+            
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            logger.error(f"Error repairing SQL: {e}")
+            raise Exception(f"Failed to repair SQL: {str(e)}")
+
+    def generate_spec_sql(self, user_query, semantic_layer, metrics=None):
+        """
+        Ask the LLM for a compact JSON query spec and compile it to SQL locally.
+        
+        Args:
+            user_query (str): The question in natural language
+            semantic_layer (data_manager.semantic_layer.SemanticLayer): Validates and compiles the spec
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+            
+        Returns:
+            data_manager.semantic_layer.CompiledQuery: The compiled query, or None
+                if the question does not fit the semantic layer
+        """
+        if self.backend is None:
+            raise Exception("OpenAI client not initialized. Check your API key.")
+        
+        metrics = metrics or QueryMetrics(user_query)
+        
+        with metrics.stage('prompt_build'):
+            system_prompt = self._prepare_spec_prompt(semantic_layer)
+            user_message = self._user_message(user_query)
+        
+        try:
+            content = self._coalesced(
+                ('spec', question_key(user_query)),
+                metrics,
+                self._chat,
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                metrics,
+                max_tokens=200,  # A spec is a few dozen tokens
+                response_format={"type": "json_object"},
+            )
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating query spec: {e}")
+            raise Exception(f"Failed to generate query spec: {str(e)}")
+        
+        try:
+            spec = json.loads(content)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Query spec is not valid JSON: {e}")
+            return None
+        if not isinstance(spec, dict) or spec.get('unsupported'):
+            logger.info("Question does not fit the semantic layer")
+            return None
+        
+        with metrics.stage('validate'):
+            try:
+                compiled = semantic_layer.compile(spec)
+            except SpecValidationError as e:
+                logger.warning(f"Query spec rejected: {e}")
+                return None
+        
+        metrics.sql = compiled.display_sql
+        logger.info(f"Compiled query spec {json.dumps(spec, ensure_ascii=False)} to SQL: {compiled.sql}")
+        return compiled
+
+    def generate_decomposition(self, user_query, metrics=None, max_subqueries=4):
+        """
+        Ask the LLM to split a compound question into independent sub-queries
+        and a query combining their results.
+        
+        Args:
+            user_query (str): The question in natural language
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+            max_subqueries (int): Most sub-queries accepted
+            
+        Returns:
+            data_manager.decomposition.DecomposedQuery: The decomposition, or None
+                if the question is better answered by a single query
+        """
+        if self.backend is None:
+            raise Exception("OpenAI client not initialized. Check your API key.")
+        
+        metrics = metrics or QueryMetrics(user_query)
+        
+        with metrics.stage('prompt_build'):
+            system_prompt = self._prepare_decomposition_prompt(max_subqueries)
+            user_message = self._user_message(user_query)
+        
+        try:
+            content = self._coalesced(
+                ('decompose', question_key(user_query)),
+                metrics,
+                self._chat,
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                metrics,
+                max_tokens=1000,  # Several queries
+                response_format={"type": "json_object"},
+            )
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            logger.error(f"Error decomposing question: {e}")
+            raise Exception(f"Failed to decompose question: {str(e)}")
+        
+        decomposed = parse_decomposition(content, max_subqueries)
+        if decomposed is not None:
+            logger.info(f"Question decomposed into {len(decomposed.subqueries)} sub-queries")
+        return decomposed
+
+    def generate_followup(self, user_query, context, metrics=None):
+        """
+        Ask the LLM how a follow-up question relates to the previous answer:
+        as a standalone question and, if the previous result is enough to
+        answer it, as SQL over that result.
+        
+        The prompt describes the previous result instead of the whole
+        schema, so the call is short.
+        
+        Args:
+            user_query (str): The follow-up in natural language
+            context (data_manager.followup.ResultContext): The previous answer
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+            
+        Returns:
+            data_manager.followup.FollowUp: The follow-up, or None if the answer is malformed
+        """
+        if self.backend is None:
+            raise Exception("OpenAI client not initialized. Check your API key.")
+        
+        metrics = metrics or QueryMetrics(user_query)
+        
+        with metrics.stage('prompt_build'):
+            system_prompt = self._prepare_followup_prompt(context)
+        
+        try:
+            content = self._coalesced(
+                ('followup', context.sql, question_key(user_query)),
+                metrics,
+                self._chat,
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_query}
+                ],
+                metrics,
+                response_format={"type": "json_object"},
+            )
+        except LLMQueueTimeout:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading follow-up question: {e}")
+            raise Exception(f"Failed to read follow-up question: {str(e)}")
+        
+        followup = parse_followup(content, user_query)
+        if followup is not None:
+            logger.info(
+                f"Follow-up read as '{followup.question}', "
+                f"{'answered from the previous result' if followup.sql else 'needs a new query'}"
+            )
+        return followup
+
+    def _coalesced(self, key, metrics, func, *args, **kwargs):
+        """
+        Call the LLM through the single-flight group. A caller that reuses
+        an identical call in flight spends no tokens; its wait counts as
+        the llm stage.
+        """
+        start = time.perf_counter()
+        result, coalesced = self.in_flight.do(key, func, *args, **kwargs)
+        if coalesced:
+            metrics.coalesce('llm', 'llm', time.perf_counter() - start)
+        return result
+
+    def _chat(self, messages, metrics, max_tokens=500, **kwargs):
+        """Call the LLM and return the text of its response."""
+        # Rough estimate for the token budget, about 3 characters per token
+        # of Russian text and SQL; the actual usage is settled afterwards
+        estimated_tokens = sum(len(message['content']) for message in messages) // 3 + max_tokens
+        
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimated_tokens, metrics=metrics)
+            try:
+                with metrics.stage('llm'):
+                    completion = asyncio.run_coroutine_threadsafe(self._hedged(dict(
+                        model="gpt-4o-mini",  # Using GPT-4o mini as specified
+                        messages=messages,
+                        temperature=0.1,  # Low temperature for more deterministic responses
+                        max_tokens=max_tokens,   # Limiting token count for the response
+                        **kwargs
+                    ), estimated_tokens, metrics), self._io_loop()).result()
+            except Exception as e:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.settle(estimated_tokens, 0)
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt == self.max_retries:
+                    raise
+                metrics.llm_retries += 1
+                logger.warning(f"LLM call failed ({e.__class__.__name__}), retry {attempt + 1} in {delay:.2f} s")
+                time.sleep(delay)
+                continue
+            break
+        
+        if completion.total_tokens is not None:
+            metrics.add_tokens(completion.prompt_tokens, completion.completion_tokens)
+        if self.rate_limiter is not None:
+            used = completion.total_tokens if completion.total_tokens is not None else estimated_tokens
+            self.rate_limiter.settle(estimated_tokens, used)
+        
+        return completion.text.strip()
+
+    async def _timed_call(self, request):
+        """One backend call; its latency feeds the hedge policy, also when it is cancelled."""
+        start = time.perf_counter()
+        try:
+            return await self.backend.complete(request)
+        finally:
+            if self.hedge_policy is not None:
+                self.hedge_policy.record(time.perf_counter() - start)
+
+    async def _hedged(self, request, estimated_tokens, metrics):
+        """
+        Make a call, and if it is slower than the hedge delay send a
+        duplicate; the first successful answer wins and the other request
+        is cancelled, which closes its connection.
+        """
+        primary = asyncio.ensure_future(self._timed_call(request))
+        if self.hedge_policy is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_policy.delay())
+        if done:
+            return primary.result()
+        
+        # The duplicate takes only budget that is free right now, so hedging
+        # never delays calls queued for the rate limit. Its reservation is
+        # not settled: the provider counts the cancelled request as well.
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire(estimated_tokens):
+            self.hedge_policy.count(None)
+            return await primary
+        hedge = asyncio.ensure_future(self._timed_call(request))
+        metrics.llm_hedges += 1
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        won = task is hedge
+                        self.hedge_policy.count(won)
+                        logger.info(f"Hedged LLM call answered by the {'duplicate' if won else 'original'} request")
+                        return task.result()
+                    error = task.exception()
+            self.hedge_policy.count(False)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _retry_delay(self, error, attempt):
+        """
+        Backoff before retrying a failed call, or None if the error is not
+        worth retrying (bad request, authentication...).
+
+        Delays are drawn uniformly up to an exponentially growing bound
+        ("full jitter"), so callers that failed together don't retry
+        together. A 429 with Retry-After waits at least that long and
+        pauses the other calls through the rate limiter as well.
+        """
+        kind = self.backend.error_kind(error)
+        if kind is None:
+            return None
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        if kind == 'rate_limited':
+            retry_after = self.backend.retry_after(error)
+            if retry_after is not None:
+                delay = min(self.retry_max_delay, retry_after) + random.uniform(0, self.retry_base_delay)
+            if self.rate_limiter is not None:
+                self.rate_limiter.pause(delay)
+        return delay
+
+    def _complete(self, messages, metrics):
+        """Call the LLM and extract a SQL query from its response."""
+        # Extract SQL from response
+        sql_query = self._chat(messages, metrics)
+        
+        # If the response contains markdown SQL block, extract just the SQL
+        if "```sql" in sql_query:
+            sql_query = sql_query.split("```sql")[1].split("```")[0].strip()
+        elif "```" in sql_query:
+            sql_query = sql_query.split("```")[1].split("```")[0].strip()
+        
+        # Ensure the query has a LIMIT clause
+        if "LIMIT" not in sql_query.upper():
+            # Удаляем точку с запятой в конце запроса, если она есть
+            if sql_query.strip().endswith(';'):
+                sql_query = sql_query.strip()[:-1]
+            
+            # Добавляем LIMIT в конец запроса
+            sql_query = f"{sql_query} LIMIT 1000"
+        
+        metrics.sql = sql_query
+        return sql_query
+
+    def _prepare_spec_prompt(self, semantic_layer):
+        """Prepare system prompt asking for a JSON query spec instead of SQL."""
+        return f"""
+        Ты переводишь вопросы о данных торговой сети в JSON-спецификацию запроса. SQL по ней строится автоматически.
+        
+        Формат ответа (необязательные поля можно опускать):
+        {{"metrics": [...], "dimensions": [...], "time_grain": null, "period": null,
+          "filters": [{{"dimension": ..., "op": "=", "value": ...}}],
+          "having": [{{"metric": ..., "op": ">", "value": 0}}],
+          "sort": [{{"by": <метрика, измерение или "time">, "order": "desc"}}], "limit": null, "rollup": false}}
+        Операторы: =, !=, >, >=, <, <=, in, not in (для in значение - список).
+        Если вопрос нельзя выразить этими полями, верни {{"unsupported": true}}.
+        
+        Сегодня {date.today().isoformat()}.
+        
+        {semantic_layer.describe()}
+        
+        Возвращай ТОЛЬКО JSON.
+        """
+
+    def _prepare_decomposition_prompt(self, max_subqueries):
+        """Prepare system prompt asking for independent sub-queries instead of one SQL query."""
+        return self._prepare_system_prompt() + f"""
+        
+        РЕЖИМ ДЕКОМПОЗИЦИИ. Вместо одного SQL запроса разбей вопрос на независимые подзапросы (от 2 до {max_subqueries}),
+        которые выполняются параллельно, и запрос, объединяющий их результаты. Ответ - JSON:
+        {{"subqueries": [{{"name": "top_customers", "sql": "SELECT ..."}}, {{"name": "purchases", "sql": "SELECT ..."}}],
+          "combine": "SELECT ... FROM top_customers t JOIN purchases p ON p.customer_id = t.customer_id ..."}}
+        
+        Правила декомпозиции:
+        1. Каждый подзапрос читает таблицы базы и не ссылается на другие подзапросы
+        2. Подзапрос агрегирует данные до того уровня, который нужен для объединения (например, клиент и категория), а не возвращает отдельные продажи
+        3. LIMIT в подзапросе ставь, только если он следует из вопроса (например, топ-10 клиентов)
+        4. Объединяющий запрос читает только результаты подзапросов по их именам (таблиц базы и функций-макросов в нем нет), соединяет их по ключам и содержит LIMIT
+        5. Имена подзапросов - латиницей в нижнем регистре
+        6. Если вопрос не делится на независимые части или одним запросом проще, верни {{"single": true}}
+        
+        Возвращай ТОЛЬКО JSON.
+        """
+
+    def _prepare_followup_prompt(self, context):
+        """Prepare system prompt for a follow-up to the previous answer."""
+        if context.complete:
+            scope = "это все строки результата"
+            sql_rule = (
+                f"2. sql - запрос к {PREVIOUS_RESULT}, только если ответ целиком следует из его строк и колонок: "
+                f"фильтр, сортировка, топ-N, доли и итоги по колонкам. Таблиц базы в запросе нет, только {PREVIOUS_RESULT}\n"
+                f"        3. Если нужны данные, которых нет в {PREVIOUS_RESULT} (другие колонки, период, строки, "
+                f"отброшенные предыдущим запросом), верни \"sql\": null"
+            )
+        else:
+            scope = "результат обрезан по лимиту строк, поэтому фильтры и сортировки по нему неточны"
+            sql_rule = "2. Результат неполный, поэтому всегда возвращай \"sql\": null"
+        return f"""
+        Пользователь уточняет свой предыдущий вопрос о данных торговой сети.
+        
+        Предыдущий вопрос: {context.question}
+        SQL предыдущего вопроса:
+        {context.sql}
+        
+        Результат предыдущего вопроса доступен как таблица {PREVIOUS_RESULT} ({scope}).
+        {context.describe()}
+        
+        Ответ - JSON: {{"question": "<уточнение как самостоятельный вопрос>", "sql": "SELECT ... FROM {PREVIOUS_RESULT} ..." или null}}
+        
+        Правила:
+        1. question - полный вопрос, понятный без предыдущего (например, «Топ-10 товаров по продажам за последний месяц в Москве»). Если новый вопрос не связан с предыдущим, верни его без изменений и "sql": null
+        {sql_rule}
+        
+        Возвращай ТОЛЬКО JSON.
+        """
+
     def _prepare_system_prompt(self):
         """Prepare system prompt with schema and example information."""
+        self._refresh_dictionary()
+        
+        # Terms compiled into macros are shown as macro calls, not formulas
+        usages = {macro.term: macro.usage for macro in self.term_macros}
+        dictionary = dict(self.dictionary)
+        dictionary['business_terms'] = [
+            {**term, 'sql_representation': usages[term['term']]} if term.get('term') in usages else term
+            for term in self.dictionary.get('business_terms', [])
+        ]
+        
         # Convert schema to string representation
         schema_str = json.dumps(self.schema, indent=2, ensure_ascii=False)
-        dictionary_str = json.dumps(self.dictionary, indent=2, ensure_ascii=False)
+        dictionary_str = json.dumps(dictionary, indent=2, ensure_ascii=False)
+        catalog_str = "\n".join(
+            f"        - {line}" for line in (self.value_catalog.describe() if self.value_catalog is not None else "").splitlines()
+        )
+        macros_str = "\n".join(
+            f"        - {macro.usage} -- {macro.term}" for macro in self.term_macros
+        )
         examples_str = json.dumps(self.query_examples, indent=2, ensure_ascii=False)
         
         # Create system prompt
@@ -105,6 +664,12 @@ class LLMProcessor:
         Вот словарь бизнес-терминов, который тебе следует учитывать:
         {dictionary_str}
         
+        В базе определены функции (макросы DuckDB) для бизнес-метрик:
+{macros_str}
+        
+        Значения категориальных полей (в скобках - число различных значений):
+{catalog_str}
+        
         Примеры вопросов и соответствующих SQL запросов:
         {examples_str}
         
@@ -114,9 +679,12 @@ class LLMProcessor:
         3. При запросах временных рядов, упорядочивай данные по времени
         4. Всегда учитывай оптимизацию запросов
         5. Если пользователь не указал конкретный период времени, используй последние данные
-        6. Для расчета прибыли используй формулу: сумма(unit_price - unit_cost) * quantity
+        6. Для расчета прибыли используй функцию profit(s.unit_price, p.unit_cost, s.quantity)
         7. Используй только таблицы и поля, определенные в схеме
         8. Возвращай ТОЛЬКО SQL запрос и ничего больше
+        9. Для фильтрации и группировки по периодам соединяй факты с календарем (JOIN calendar cal ON s.sale_date = cal.date) и используй его поля и флаги (cal.is_last_completed_month, cal.quarter, cal.month_start и т.д.) вместо date_trunc, CURRENT_DATE и INTERVAL над sale_date
+        10. Для бизнес-метрик вызывай функции из списка выше, передавая им столбцы своих таблиц, вместо того чтобы переписывать их формулы
+        11. Для фильтров по названиям используй точные значения из базы; если после вопроса перечислены найденные значения, подставляй их, а не слова пользователя
         
         Преобразуй вопрос пользователя в SQL запрос.
         """
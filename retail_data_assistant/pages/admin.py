@@ -0,0 +1,128 @@
+import streamlit as st
+from data_manager.db_bootstrap import DatabaseBootstrap
+from data_manager.query_log import QueryLog
+from data_manager.query_profiler import QueryProfiler
+from utils.config import (
+    DB_PATH, QUERY_LOG_DB_PATH, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_WINDOW,
+    DB_PROFILING_ENABLED, SNAPSHOT_MAX_SHRINK, SNAPSHOTS_KEPT
+)
+
+st.set_page_config(
+    page_title="Retail Data Assistant - Мониторинг",
+    page_icon="📈",
+    layout="wide"
+)
+
+st.title("📈 Мониторинг производительности")
+
+@st.cache_resource
+def get_admin_query_log():
+    return QueryLog(QUERY_LOG_DB_PATH, window=METRICS_WINDOW)
+
+@st.cache_resource
+def get_admin_query_profiler():
+    return QueryProfiler(QUERY_LOG_DB_PATH)
+
+@st.cache_resource
+def get_snapshot_builder():
+    return DatabaseBootstrap(DB_PATH, max_shrink=SNAPSHOT_MAX_SHRINK, snapshots_kept=SNAPSHOTS_KEPT)
+
+query_log = get_admin_query_log()
+query_profiler = get_admin_query_profiler()
+snapshot_builder = get_snapshot_builder()
+
+if st.button("🔄 Обновить"):
+    st.rerun()
+
+# Latency percentiles per pipeline stage
+st.subheader(f"Задержки по этапам (последние {METRICS_WINDOW} запросов)")
+percentiles = query_log.stage_percentiles()
+if len(percentiles) > 0:
+    st.dataframe(
+        percentiles.round(1).rename(columns={
+            'stage': 'Этап',
+            'count': 'Запросов',
+            'p50_ms': 'p50, мс',
+            'p95_ms': 'p95, мс',
+            'max_ms': 'max, мс',
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    st.bar_chart(
+        percentiles[percentiles['stage'] != 'total'].set_index('stage')[['p50_ms', 'p95_ms']]
+    )
+else:
+    st.info("Журнал запросов пока пуст.")
+
+# Calls saved by sharing identical LLM calls and queries in flight
+coalesced = query_log.coalesced_counts()
+llm_column, sql_column = st.columns(2)
+llm_column.metric("Объединенные обращения к LLM", coalesced['llm'])
+sql_column.metric("Объединенные SQL запросы", coalesced['sql'])
+
+# Admission of queries by resource governor class
+admissions = query_log.admission_report()
+if len(admissions) > 0:
+    st.subheader("Допуск запросов по классам нагрузки")
+    st.dataframe(
+        admissions.round(1).rename(columns={
+            'query_class': 'Класс',
+            'immediate': 'Сразу',
+            'waited': 'После ожидания',
+            'rejected': 'Отклонено',
+            'p95_wait_ms': 'p95 ожидания, мс',
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+
+# Recent queries
+st.subheader("Последние запросы")
+st.dataframe(query_log.recent_queries(), use_container_width=True, hide_index=True)
+
+# Slow query shapes from captured DuckDB profiles
+st.subheader("Медленные запросы (по суммарному времени)")
+slow_queries = query_profiler.slow_query_report()
+if len(slow_queries) > 0:
+    st.dataframe(slow_queries.round(1), use_container_width=True, hide_index=True)
+    
+    fingerprint = st.selectbox("План запроса", slow_queries['fingerprint'])
+    profile_id = query_profiler.latest_profile_id(fingerprint)
+    if profile_id:
+        operators = query_profiler.operator_tree(profile_id)
+        operators['operator_name'] = [
+            "    " * depth + name for depth, name in zip(operators['depth'], operators['operator_name'])
+        ]
+        st.dataframe(
+            operators[['operator_name', 'rows_in', 'rows_out', 'estimated_cardinality', 'timing_ms']].round(2),
+            use_container_width=True,
+            hide_index=True
+        )
+elif DB_PROFILING_ENABLED:
+    st.info("Профили запросов пока не собраны.")
+else:
+    st.info("Профилирование выключено (DB_PROFILING_ENABLED в utils/config.py).")
+
+# Database snapshot: rebuilt in the background, readers switch once it is validated
+st.subheader("Снимок базы данных")
+snapshot = snapshot_builder.current_snapshot()
+if snapshot is not None:
+    st.write(f"Текущий снимок: `{snapshot['file']}`, собран {snapshot['built_at']}")
+    st.dataframe(
+        [{'Таблица': table, 'Строк': count} for table, count in snapshot['row_counts'].items()],
+        use_container_width=True,
+        hide_index=True
+    )
+else:
+    st.write("Используется исходная база, снимки еще не собирались.")
+if snapshot_builder.rebuilding:
+    st.info("⏳ Идет сборка нового снимка. Запросы выполняются по текущему.")
+elif st.button("Пересобрать базу"):
+    snapshot_builder.start_rebuild()
+    st.rerun()
+if snapshot_builder.rebuild_error is not None:
+    st.error(f"Последняя сборка не опубликована: {snapshot_builder.rebuild_error}")
+
+if METRICS_ENABLED:
+    st.caption(f"Метрики в формате Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
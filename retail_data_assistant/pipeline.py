@@ -0,0 +1,307 @@
+import logging
+from data_manager.decomposition import looks_compound
+from data_manager.followup import PREVIOUS_RESULT, looks_followup
+from data_manager.query_executor import inline_params, without_row_limit
+from data_manager.resource_governor import QueryRejected
+from data_manager.sql_validator import SQLValidationError
+from utils.metrics import QueryMetrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class QueryPlan:
+    """How a question will be answered: the SQL and where it came from."""
+
+    def __init__(self, question, source, sql, params=None, display_sql=None, description=None,
+                 spec=None, findings=None, results=None, decomposed=None):
+        self.question = question
+        # 'example', 'template', 'spec', 'decomposed', 'followup' or 'llm'
+        self.source = source
+        self.sql = sql
+        # Named parameters for prepared execution (templates and specs)
+        self.params = params
+        self.display_sql = display_sql or sql
+        self.description = description
+        self.spec = spec
+        self.findings = findings or []
+        # Precomputed results (examples answered at startup, follow-ups
+        # answered from the previous result)
+        self.results = results
+        # Sub-queries run in parallel (sql is the same question as one query)
+        self.decomposed = decomposed
+        # The query without its row limit, for charting the whole series of
+        # results cut at that limit; None when it can't be run for that
+        self.chart_sql = None
+
+    def to_dict(self):
+        return {
+            'question': self.question,
+            'source': self.source,
+            'sql': self.display_sql,
+            'description': self.description,
+            'spec': self.spec,
+            'findings': self.findings,
+            'decomposition': self.decomposed.to_dict() if self.decomposed is not None else None,
+        }
+
+
+class QuestionPipeline:
+    def __init__(self, query_executor, llm_processor, intent_matcher=None, semantic_layer=None,
+                 example_warmer=None, max_repairs=2, decompose=False, max_subqueries=4,
+                 max_intermediate_rows=100_000, followups=True, preview_min_cost=None):
+        """
+        Turn questions into SQL and results, trying the cheapest source first:
+        precomputed examples, templates, the semantic layer and finally SQL
+        generated by the LLM.
+
+        Args:
+            query_executor (data_manager.query_executor.QueryExecutor): Runs the SQL
+            llm_processor (llm_processor.LLMProcessor): Generates specs and SQL
+            intent_matcher (intent_matcher.IntentMatcher, optional): Template fast path
+            semantic_layer (data_manager.semantic_layer.SemanticLayer, optional): Compiles JSON specs
+            example_warmer (data_manager.example_warmer.ExampleWarmer, optional): Precomputed examples
+            max_repairs (int): LLM repair round trips for SQL that fails validation
+            decompose (bool): Split compound questions into independent
+                sub-queries that run in parallel
+            max_subqueries (int): Most sub-queries of a decomposed question
+            max_intermediate_rows (int): Row limit of a sub-query result
+            followups (bool): Answer refinements of the previous question
+                from its result when it has what they need
+            preview_min_cost (int, optional): Estimated cost from which
+                aggregate queries get an approximate preview from the sales
+                sample while the exact query runs; None turns previews off
+        """
+        self.query_executor = query_executor
+        self.llm_processor = llm_processor
+        self.intent_matcher = intent_matcher
+        self.semantic_layer = semantic_layer
+        self.example_warmer = example_warmer
+        self.max_repairs = max_repairs
+        self.decompose = decompose
+        self.max_subqueries = max_subqueries
+        self.max_intermediate_rows = max_intermediate_rows
+        self.followups = followups
+        self.preview_min_cost = preview_min_cost
+
+    def plan(self, question, metrics=None, context=None):
+        """
+        Find the SQL for a question without executing it.
+
+        Args:
+            question (str): The question in natural language
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+            context (data_manager.followup.ResultContext, optional): The previous
+                answer, which the question may refine
+
+        Returns:
+            QueryPlan: The SQL and its source
+        """
+        metrics = metrics or QueryMetrics(question)
+
+        # Recompile term macros if dictionary.json was edited
+        self.query_executor.sync_term_macros()
+
+        if context is not None and self.followups and looks_followup(question):
+            plan = self._plan_followup(question, context, metrics)
+        else:
+            plan = self._plan_question(question, metrics)
+        # Follow-ups may query the previous result, which the database doesn't have
+        if plan.source != 'followup':
+            plan.chart_sql = without_row_limit(plan.display_sql, self.query_executor.max_rows)
+
+        metrics.source = plan.source
+        metrics.sql = plan.display_sql
+        return plan
+
+    def _plan_followup(self, question, context, metrics):
+        """
+        Plan a refinement of the previous answer: a query over its result
+        when the result has what it needs, otherwise the refinement as a
+        standalone question.
+        """
+        followup = self.llm_processor.generate_followup(question, context, metrics=metrics)
+        if followup is None:
+            return self._plan_question(question, metrics)
+
+        if followup.sql is not None:
+            try:
+                with metrics.stage('sql_exec'):
+                    results = self.query_executor.query_results(followup.sql, {PREVIOUS_RESULT: context.results})
+                logger.info(f"Follow-up answered from the previous result: {len(results)} rows")
+                return QueryPlan(
+                    question, 'followup', followup.sql,
+                    description=f"Ответ получен из результата предыдущего вопроса «{context.question}» без запроса к базе",
+                    results=results.head(self.query_executor.max_rows),
+                )
+            except Exception as e:
+                logger.warning(f"Follow-up query over the previous result failed, planning a new query: {e}")
+
+        plan = self._plan_question(followup.question, metrics)
+        plan.question = question
+        rewritten = f"Уточнение выполнено как вопрос «{followup.question}»"
+        plan.description = f"{rewritten}. {plan.description}" if plan.description else rewritten
+        return plan
+
+    def _plan_question(self, question, metrics):
+        """Plan a question on its own, from the cheapest source that answers it."""
+        # Sidebar examples are answered from results computed at startup,
+        # other known question shapes from templates without the LLM
+        example, template = None, None
+        with metrics.stage('match'):
+            if self.example_warmer is not None:
+                example = self.example_warmer.lookup(question)
+            if example is None and self.intent_matcher is not None:
+                template = self.intent_matcher.match(question)
+
+        if example is not None:
+            plan = QueryPlan(
+                question, 'example', example.sql,
+                description="Ответ на пример вычислен заранее, при запуске приложения",
+                results=example.results,
+            )
+        elif template is not None:
+            plan = QueryPlan(
+                question, 'template', template.sql, params=template.params,
+                display_sql=template.display_sql, description=template.description,
+            )
+        else:
+            # Compound questions may be split into parallel sub-queries
+            plan = None
+            if self.decompose and looks_compound(question):
+                plan = self._plan_decomposed(question, metrics)
+            if plan is None:
+                plan = self._plan_generated(question, metrics)
+        return plan
+
+    def _plan_generated(self, question, metrics):
+        """Plan a question with the LLM: a spec compiled locally, or SQL."""
+        # Ask the LLM for a compact query spec and compile it locally;
+        # questions outside the semantic layer get raw SQL
+        compiled = None
+        if self.semantic_layer is not None:
+            compiled = self.llm_processor.generate_spec_sql(question, self.semantic_layer, metrics=metrics)
+        if compiled is not None:
+            with metrics.stage('validate'):
+                self.query_executor.validator.validate(compiled.display_sql)
+            return QueryPlan(
+                question, 'spec', compiled.sql, params=compiled.params,
+                display_sql=compiled.display_sql, description=compiled.description, spec=compiled.spec,
+            )
+
+        # Generate SQL and dry-run it before execution
+        sql_query = self.llm_processor.generate_validated_sql(
+            question,
+            self.query_executor.validator,
+            metrics=metrics,
+            max_repairs=self.max_repairs,
+            rewriter=self.query_executor.rewriter
+        )
+        return QueryPlan(question, 'llm', sql_query, findings=list(metrics.findings))
+
+    def _plan_decomposed(self, question, metrics):
+        """
+        Plan a compound question as independent sub-queries, or None if the
+        LLM keeps it whole or a sub-query fails the dry run. The whole
+        question as one query with CTEs, which execute() falls back to, is
+        dry-run too, so the combining query never reaches the database
+        unchecked.
+        """
+        decomposed = self.llm_processor.generate_decomposition(
+            question, metrics=metrics, max_subqueries=self.max_subqueries
+        )
+        if decomposed is None:
+            return None
+        findings = []
+        try:
+            with metrics.stage('validate'):
+                for sub in decomposed.subqueries:
+                    analysis = self.query_executor.rewriter.analyze(sub.sql)
+                    sub.sql = analysis.sql
+                    findings.extend(analysis.findings)
+                    self.query_executor.validator.validate(sub.sql)
+                single_sql = decomposed.as_single_sql()
+                self.query_executor.validator.validate(single_sql)
+        except SQLValidationError as e:
+            logger.warning(f"Decomposition rejected, planning a single query: {e}")
+            return None
+        return QueryPlan(
+            question, 'decomposed', single_sql,
+            description=(
+                f"Вопрос разбит на {len(decomposed.subqueries)} независимых подзапроса: они выполняются "
+                f"параллельно, а результаты объединяются локально"
+            ),
+            findings=findings, decomposed=decomposed,
+        )
+
+    def execute(self, plan, metrics=None):
+        """
+        Execute a plan.
+
+        Args:
+            plan (QueryPlan): The plan from plan()
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings
+
+        Returns:
+            pandas.DataFrame: The query results
+        """
+        metrics = metrics or QueryMetrics(plan.question)
+        if plan.results is not None:
+            results = plan.results.copy()
+            metrics.row_count = len(results)
+            return results
+        if plan.params is not None:
+            return self.query_executor.execute_prepared(plan.sql, plan.params, metrics=metrics)
+        if plan.decomposed is not None:
+            try:
+                return self.query_executor.execute_decomposed(
+                    plan.decomposed, metrics=metrics, max_intermediate_rows=self.max_intermediate_rows
+                )
+            except (QueryRejected, SQLValidationError):
+                # A combining query that is not a single SELECT fails as one query too
+                raise
+            except Exception as e:
+                # The sub-queries passed the dry run, so the same question
+                # as one query with CTEs is still worth running
+                logger.warning(f"Decomposed execution failed, running it as a single query: {e}")
+        return self.query_executor.execute_query(plan.sql, metrics=metrics)
+
+    def preview(self, plan, metrics=None, exact_metrics=None):
+        """
+        Start a plan with an approximate preview, if it gets one.
+
+        Args:
+            plan (QueryPlan): The plan from plan()
+            metrics (utils.metrics.QueryMetrics, optional): Collector for the preview's stages
+            exact_metrics (utils.metrics.QueryMetrics, optional): Collector for the exact query's stages
+
+        Returns:
+            data_manager.sampling.Preview: The preview and the future of the
+                exact results, or None if the plan gets no preview; run it
+                with execute() then
+        """
+        # Precomputed and decomposed answers don't scan the sales table as one query
+        if self.preview_min_cost is None or plan.results is not None or plan.decomposed is not None:
+            return None
+        sql = inline_params(plan.sql, plan.params) if plan.params is not None else plan.sql
+        return self.query_executor.execute_preview(
+            sql, metrics=metrics, exact_metrics=exact_metrics, min_cost=self.preview_min_cost
+        )
+
+    def answer(self, question, metrics=None, context=None):
+        """
+        Plan and execute a question.
+
+        Args:
+            question (str): The question in natural language
+            metrics (utils.metrics.QueryMetrics, optional): Collector for stage timings and token usage
+            context (data_manager.followup.ResultContext, optional): The previous
+                answer, which the question may refine
+
+        Returns:
+            tuple: (QueryPlan, pandas.DataFrame)
+        """
+        metrics = metrics or QueryMetrics(question)
+        plan = self.plan(question, metrics=metrics, context=context)
+        return plan, self.execute(plan, metrics=metrics)
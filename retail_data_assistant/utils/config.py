@@ -9,12 +9,90 @@ APP_DESCRIPTION = "BI AI-Agent for retail data analysis using natural language"
 DB_PATH = "retail_data.db"
 DB_QUERY_TIMEOUT = 10  # seconds
 DB_MAX_ROWS = 1000
+STARTUP_IMPORT_BUDGET_MS = 300  # app module imports before the first render, checked by benchmarks/bench_startup.py
+SQL_MAX_ESTIMATED_COST = 10_000_000  # dry-run cost gate (sum of estimated operator cardinalities)
+SQL_MAX_REPAIR_ATTEMPTS = 2  # LLM repair round trips for SQL that fails validation
+TEMPLATES_ENABLED = True  # answer recognized "top-N by metric" questions without the LLM
+SEMANTIC_LAYER_ENABLED = True  # ask the LLM for a JSON query spec and compile it, raw SQL as fallback
+VALUE_CATALOG_ENABLED = True  # resolve column values mentioned in questions ("Питер", "молочка") before prompting
+EXAMPLE_WARMUP_ENABLED = True  # run the query examples at startup and answer them from the results
+SESSION_MAX_ANSWERS = 20  # answers kept per browser session for reruns and the session history
+SINGLE_FLIGHT_ENABLED = True  # identical questions and SQL arriving together share one LLM call and one query
+SANDBOX_WORKERS = 0  # worker processes for generated SQL (read-only, killed on timeout); 0 runs it in the app process
+SANDBOX_MEMORY_LIMIT = "1GB"  # DuckDB memory limit of each sandbox worker
+SANDBOX_THREADS = 2  # DuckDB threads of each sandbox worker
+GOVERNOR_ENABLED = True  # classify queries by estimated cost and cap concurrent heavy ones
+GOVERNOR_CLASSES = [  # in order of max_cost; threads and memory_limit apply in sandbox workers
+    {'name': 'light', 'max_cost': 200_000, 'threads': 1, 'memory_limit': "256MB", 'timeout': 5, 'slots': None},
+    {'name': 'medium', 'max_cost': 2_000_000, 'threads': 2, 'memory_limit': "512MB", 'timeout': 10, 'slots': 4},
+    {'name': 'heavy', 'max_cost': None, 'threads': 4, 'memory_limit': "1GB", 'timeout': 30, 'slots': 2},
+]
+GOVERNOR_ADMISSION_WAIT = 5  # seconds a query waits for a slot of its class before it is rejected
+DB_THREADS = 4  # DuckDB threads of the app process, shared by all in-process queries
+DB_MEMORY_LIMIT = "2GB"  # DuckDB memory limit of the app process
+DB_TEMP_DIRECTORY = "duckdb_tmp"  # spill directory on local disk, inside the data directory
+DB_MAX_TEMP_DIRECTORY_SIZE = "10GB"  # cap on data spilled to disk
+SNAPSHOT_POLL_INTERVAL = 5  # seconds between checks for a newly published database snapshot
+SNAPSHOT_DRAIN_TIMEOUT = 60  # seconds queries on a replaced snapshot may run before it is closed
+SNAPSHOT_MAX_SHRINK = 0.5  # a rebuild is rejected if a table loses more than this share of rows
+SNAPSHOTS_KEPT = 2  # snapshot files kept on disk, including the current one
+
+# Query log and metrics settings
+QUERY_LOG_DB_PATH = "query_log.db"  # separate file, so logging never contends with analytics
+API_QUERY_LOG_DB_PATH = "api_query_log.db"  # the API service logs to its own file, DuckDB allows one writer per file
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+METRICS_WINDOW = 1000  # number of recent queries used for percentiles
+DB_PROFILING_ENABLED = False  # capture DuckDB JSON profiles of every executed query
+
+# HTTP API settings (api_server.py)
+API_HOST = "127.0.0.1"
+API_PORT = 8000
+API_WORKERS = 4  # threads for DuckDB queries and LLM calls
+API_MAX_PENDING = 32  # requests waiting for a worker before new ones get 503
+API_REQUEST_TIMEOUT = 30  # seconds
 
 # OpenAI API settings
 # Note: The actual API key should be stored in .streamlit/secrets.toml
 OPENAI_MODEL = "gpt-4o-mini"
 OPENAI_TEMPERATURE = 0.1
 OPENAI_MAX_TOKENS = 500
+DECOMPOSITION_ENABLED = False  # split compound questions into sub-queries run in parallel (one more LLM call for them)
+DECOMPOSITION_MAX_SUBQUERIES = 4
+DECOMPOSITION_MAX_INTERMEDIATE_ROWS = 100_000  # row limit of a sub-query result combined locally
+FOLLOWUP_ENABLED = True  # answer refinements ("а теперь только Москва") from the previous result when it has what they need
+FOLLOWUP_CONTEXTS_KEPT = 200  # previous results the HTTP API keeps for follow-ups (previous_result_id)
+PREVIEW_ENABLED = True  # show slow aggregate queries approximately from a sample of sales first, then the exact result
+PREVIEW_MIN_ESTIMATED_COST = 1_000_000  # estimated cost (EXPLAIN) from which a query gets a preview
+PREVIEW_SAMPLE_PERCENT = 1  # size of the sales sample, percent of the table
+PREVIEW_SAMPLE_MIN_ROWS = 1_000_000  # smaller sales tables get no sample: exact queries are fast enough
+SKETCHES_ENABLED = True  # answer unique customer and receipt counts from HyperLogLog sketches per day, store and category
+SKETCH_PRECISION = 12  # 2^precision registers per sketch; relative standard error 1.04/sqrt(2^precision), 1.6% at 12
+CHARTS_ENABLED = True  # chart results that are time series (date column, numeric measures)
+CHART_MAX_POINTS = 2000  # points per line after downsampling, about two per pixel of a wide chart
+CHART_MAX_SERIES = 10  # lines per chart, those with the largest totals
+CHART_DOWNSAMPLING = 'lttb'  # 'lttb' (keeps the shape of lines) or 'minmax' (keeps every peak)
+CHART_FULL_SERIES = True  # chart the whole series of results cut at the row limit, downsampled by DuckDB
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai")  # 'openai', or 'replay' for load tests without the API
+LLM_REPLAY_LATENCY = "lognormal:800,0.4"  # replay backend latency: fixed:ms, uniform:min,max or lognormal:median,sigma[,tail_rate,tail_ms]
+LLM_REPLAY_SEED = 0
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL")  # OpenAI-compatible endpoint, e.g. the stub in benchmarks/
+LLM_REQUESTS_PER_MINUTE = 500  # client-side budget shared by all LLM calls of the process
+LLM_TOKENS_PER_MINUTE = 200_000
+LLM_QUEUE_MAX_WAIT = 60  # seconds a call may wait for the budget before the question fails
+LLM_MAX_RETRIES = 3  # retries after 429, 5xx and connection errors, with jittered exponential backoff
+LLM_RETRY_BASE_DELAY = 0.5  # seconds
+LLM_RETRY_MAX_DELAY = 20  # seconds
+LLM_CONNECT_TIMEOUT = 5  # seconds to connect to the API
+LLM_READ_TIMEOUT = 30  # seconds to wait for a response before the call is retried
+LLM_MAX_CONNECTIONS = 20  # keep-alive connection pool shared by all LLM calls
+LLM_HEDGE_ENABLED = True  # send a duplicate of a call slower than usual and use the first answer
+LLM_HEDGE_PERCENTILE = 95  # percentile of recent latencies used as the hedge delay
+LLM_HEDGE_MIN_DELAY = 0.5  # seconds
+LLM_HEDGE_INITIAL_DELAY = 3  # seconds, until LLM_HEDGE_MIN_SAMPLES latencies are known
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_HEDGE_WINDOW = 200  # recent latencies kept
 
 # Path settings
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
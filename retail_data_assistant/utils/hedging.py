@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import deque
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    def __init__(self, percentile=95, min_delay=0.5, initial_delay=3.0, min_samples=20, window=200):
+        """
+        When to send a duplicate of a slow LLM call.
+
+        A call still unanswered after the given percentile of recent call
+        latencies is sent again, and whichever answer comes first is used.
+        With the 95th percentile about one call in twenty is duplicated,
+        while the slow tail of the primary calls is cut off.
+
+        Args:
+            percentile (float): Percentile (0-100) of recent latencies used as the delay
+            min_delay (float): Lower bound of the delay in seconds
+            initial_delay (float): Delay until min_samples latencies are known
+            min_samples (int): Latencies needed before the percentile is trusted
+            window (int): Number of recent latencies kept
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+
+    def record(self, seconds):
+        """
+        Add the latency of a call.
+
+        Args:
+            seconds (float): Time to the answer, or to the cancellation of
+                a call that lost, which is a lower bound of its latency
+        """
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self):
+        """
+        Seconds to wait for an answer before the duplicate is sent.
+
+        Returns:
+            float: The delay
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self._latencies)
+        k = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[k])
+
+    def count(self, won=None):
+        """
+        Count a hedge: sent and won (True) or lost (False), or not sent
+        because the rate limit had no spare budget (None).
+        """
+        with self._lock:
+            if won is None:
+                self.skipped += 1
+                return
+            self.hedged += 1
+            if won:
+                self.hedge_wins += 1
+
+    def stats(self):
+        delay = self.delay()
+        with self._lock:
+            return {
+                'delay_seconds': round(delay, 3),
+                'samples': len(self._latencies),
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'skipped': self.skipped,
+            }
@@ -0,0 +1,139 @@
+import time
+import uuid
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in execution order
+STAGES = [
+    'match', 'prompt_build', 'llm_queue', 'llm', 'validate', 'admission', 'sql_exec', 'fetch', 'combine', 'format',
+    'chart', 'render'
+]
+
+
+class QueryMetrics:
+    """Timings and token counts collected while answering a single question."""
+
+    def __init__(self, question=None):
+        self.query_id = str(uuid.uuid4())
+        self.started_at = datetime.now()
+        self.question = question
+        self.sql = None
+        # 'llm', 'spec', 'template', 'example', 'decomposed', 'followup' (from the
+        # previous result), 'preview' (estimate from the sales sample; the exact
+        # query is logged with the plan's source) or 'api' (SQL sent to the HTTP API)
+        self.source = 'llm'
+        self.status = 'ok'
+        self.error = None
+        self.row_count = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        # LLM calls repeated after 429, 5xx or connection errors
+        self.llm_retries = 0
+        # Duplicates sent for LLM calls slower than the hedge delay
+        self.llm_hedges = 0
+        self.findings = []
+        self.stages = {}
+        # Layers ('llm', 'sql') where an identical call in flight was reused
+        self.coalesced = []
+        # Resource governor class and whether the query got a slot
+        # at once ('immediate'), after waiting ('waited') or not ('rejected')
+        self.query_class = None
+        self.admission = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a pipeline stage.
+
+        Args:
+            name (str): The stage name (see STAGES)
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            # Repeated stages (e.g. a retried LLM call) are accumulated
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def add_tokens(self, prompt_tokens, completion_tokens):
+        """Accumulate LLM token usage."""
+        self.prompt_tokens = (self.prompt_tokens or 0) + (prompt_tokens or 0)
+        self.completion_tokens = (self.completion_tokens or 0) + (completion_tokens or 0)
+
+    def coalesce(self, layer, stage, seconds):
+        """
+        Record that another caller's identical call was reused.
+
+        Args:
+            layer (str): The coalesced layer ('llm' or 'sql')
+            stage (str): The stage the wait is accounted to
+            seconds (float): Time spent waiting for the shared result
+        """
+        self.coalesced.append(layer)
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def fail(self, error):
+        """Mark the query as failed."""
+        self.status = 'error'
+        self.error = str(error)
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self._start
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    render = None
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        try:
+            body = self.render().encode('utf-8')
+        except Exception as e:
+            logger.error(f"Error rendering metrics: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of the application log
+        pass
+
+
+def start_metrics_server(render, host='127.0.0.1', port=9108):
+    """
+    Serve Prometheus text exposition format on http://host:port/metrics.
+
+    Args:
+        render (callable): Returns the metrics page as a string
+        host (str): Interface to bind to
+        port (int): Port to listen on
+
+    Returns:
+        ThreadingHTTPServer: The running server, or None if the port is busy
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'render': staticmethod(render)})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,222 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from utils.metrics import QueryMetrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Priorities of LLM calls, lower is served first
+INTERACTIVE = 0
+BATCH = 1
+
+PRIORITIES = {'interactive': INTERACTIVE, 'batch': BATCH}
+
+_priority = ContextVar('llm_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """
+    Run LLM calls made in the block with the given priority.
+
+    Args:
+        level (int): INTERACTIVE or BATCH
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LLMQueueTimeout(Exception):
+    """Raised when an LLM call waited longer than max_wait for the rate limit."""
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        """
+        Continuously refilled budget of requests or tokens per minute.
+
+        Args:
+            per_minute (int): Budget per minute, also the burst size
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available."""
+        self._refill(now)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class LLMRateLimiter:
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200_000, max_wait=60):
+        """
+        Process-wide client-side limit on LLM calls, so bursts queue here
+        instead of hitting the provider's rate limits.
+
+        A call reserves one request and its estimated tokens (prompt plus
+        max_tokens); the unused part of the estimate is returned once the
+        response reports actual usage. Calls are admitted in priority order
+        (interactive questions before batch jobs), first come first served
+        within a priority. A 429 from the provider pauses all admissions for
+        its Retry-After.
+
+        Args:
+            requests_per_minute (int): Request budget
+            tokens_per_minute (int): Token budget
+            max_wait (float): Seconds a call may wait before LLMQueueTimeout
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self.admitted = 0
+        self.timed_out = 0
+        self.rate_limited = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self, tokens, level=None, metrics=None):
+        """
+        Wait for the turn and budget of a call.
+
+        Args:
+            tokens (int): Estimated tokens of the call
+            level (int, optional): Priority; the priority() context by default
+            metrics (utils.metrics.QueryMetrics, optional): Collector; the wait
+                is timed as the llm_queue stage
+
+        Raises:
+            LLMQueueTimeout: If the call can't start within max_wait seconds
+        """
+        metrics = metrics or QueryMetrics()
+        level = _priority.get() if level is None else level
+        ticket = (level, next(self._sequence), tokens)
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        with metrics.stage('llm_queue'), self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._waiting[0] is ticket:
+                        wait = max(
+                            self._paused_until - now,
+                            self.requests.wait_time(1, now),
+                            # A call larger than the bucket waits for a full one
+                            self.tokens.wait_time(min(tokens, self.tokens.capacity), now),
+                        )
+                        if wait <= 0:
+                            heapq.heappop(self._waiting)
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self.admitted += 1
+                            self.wait_seconds += now - start
+                            # The next call in line may fit as well
+                            self._cond.notify_all()
+                            return
+                    else:
+                        wait = deadline - now
+                    if now >= deadline:
+                        self.timed_out += 1
+                        raise LLMQueueTimeout(
+                            f"Очередь к LLM не подошла за {self.max_wait} секунд. Повторите запрос позже."
+                        )
+                    self._cond.wait(min(wait, deadline - now))
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def try_acquire(self, tokens):
+        """
+        Take the budget of a call only if it is free right now and no call is
+        queued; for optional calls such as hedged duplicates.
+
+        Args:
+            tokens (int): Estimated tokens of the call
+
+        Returns:
+            bool: True if the call may start
+        """
+        with self._cond:
+            now = time.monotonic()
+            if (self._waiting or self._paused_until > now or self.requests.wait_time(1, now) > 0
+                    or self.tokens.wait_time(min(tokens, self.tokens.capacity), now) > 0):
+                return False
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.admitted += 1
+            return True
+
+    def settle(self, reserved, used):
+        """
+        Return the unused part of a reservation.
+
+        Args:
+            reserved (int): Tokens reserved by acquire()
+            used (int): Tokens the call actually used (0 for a failed call)
+        """
+        with self._cond:
+            self.tokens.give_back(max(0, reserved - used))
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Hold all admissions for seconds, after the provider answered 429."""
+        with self._cond:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"LLM rate limited by the provider, pausing calls for {seconds:.1f} s")
+
+    def estimate_wait(self, tokens=2000, level=INTERACTIVE):
+        """
+        Rough queue time of a call made now: the calls ahead of it in line
+        and the call itself have to fit into the refilling budgets.
+
+        Args:
+            tokens (int): Estimated tokens of the call
+            level (int): Its priority
+
+        Returns:
+            float: Seconds
+        """
+        with self._cond:
+            now = time.monotonic()
+            ahead = [ticket for ticket in self._waiting if ticket[0] <= level]
+            request_wait = self.requests.wait_time(len(ahead) + 1, now)
+            token_wait = self.tokens.wait_time(sum(ticket[2] for ticket in ahead) + tokens, now)
+            return max(self._paused_until - now, request_wait, token_wait)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._waiting),
+                'admitted': self.admitted,
+                'timed_out': self.timed_out,
+                'rate_limited': self.rate_limited,
+                'wait_seconds': round(self.wait_seconds, 3),
+            }
@@ -0,0 +1,94 @@
+import re
+import threading
+import logging
+from concurrent.futures import Future
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Single-quoted SQL string literals, with '' escapes
+_SQL_STRING = re.compile(r"('(?:[^']|'')*')")
+
+
+def sql_key(sql):
+    """Normalize SQL for coalescing: spacing and a trailing semicolon are ignored, string literals are kept as is."""
+    parts = _SQL_STRING.split(sql.strip().rstrip(';'))
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+
+class SingleFlight:
+    def __init__(self, name, enabled=True):
+        """
+        Coalesce identical concurrent calls: the first caller for a key runs
+        the function, callers arriving while it runs wait for the same
+        result instead of repeating the work. Nothing is cached; once the
+        call finishes, the next caller for the key starts a new one.
+
+        Args:
+            name (str): Name of the coalesced layer, used in logs and stats
+            enabled (bool): When False, every call runs on its own
+        """
+        self.name = name
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, share=None, **kwargs):
+        """
+        Run func(*args, **kwargs), or wait for the identical call in flight.
+
+        Args:
+            key (hashable): Identity of the call
+            func (callable): The function to run
+            share (callable, optional): Applied to a result handed to more
+                than one caller, so each gets its own copy (e.g. DataFrame.copy)
+
+        Returns:
+            tuple: (result, coalesced), where coalesced is True if this
+                caller waited for another caller's call
+
+        Raises:
+            Exception: Whatever the call in flight raised
+        """
+        if not self.enabled:
+            return func(*args, **kwargs), False
+
+        with self._lock:
+            self.calls += 1
+            flight = self._in_flight.get(key)
+            if flight is None:
+                flight = self._in_flight[key] = [Future(), 0]
+                leader = True
+            else:
+                flight[1] += 1
+                self.coalesced += 1
+                leader = False
+
+        future = flight[0]
+        if not leader:
+            logger.info(f"Waiting for identical {self.name} call in flight")
+            result = future.result()
+            return (share(result) if share else result), True
+
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            # Followers join under the lock, so their count is final once the key is gone
+            with self._lock:
+                del self._in_flight[key]
+                followers = flight[1]
+        result = future.result()
+        return (share(result) if share and followers else result), False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight),
+            }